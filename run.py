@@ -1,4 +1,5 @@
-import uvicorn
+from simplebank.server import main
 
 if __name__ == "__main__":
-    uvicorn.run("simplebank.main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    # APP_ENV=production runs the multi-worker server, see simplebank/server.py
+    main()
@@ -1,49 +1,119 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query, Header
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List, Union, Dict
+from sqlalchemy import func
+from typing import List, Union, Dict, Optional
+from datetime import datetime
 
-from simplebank.database import get_db
+from simplebank.database import get_db, get_read_db
 from simplebank.models import models, schemas
-from simplebank.utils.security_deps import SecurityAudit
 from simplebank.utils.cache import check_conditional_request
+from simplebank.utils.history import recent_transactions_by_account
+from simplebank.utils.balance_audit import balance_change, balance_update_message
+from simplebank.utils.pubsub import balance_updates, sse_stream
+from simplebank.utils.ledger import deposit_entries
+from simplebank.utils.pagination import encode_cursor, decode_cursor
+from simplebank.utils.partitions import account_balance_changes
+from simplebank.utils.sharding import (
+    shard_router, get_account_db, get_account_primary_db, get_customer_accounts_db
+)
+from simplebank.utils.fx import fx_rates
 from simplebank.models.schemas import (
-    AccountMinimal, AccountFull, CustomerInfo, TransactionSummary, AccountResponse, BalanceResponse
+    AccountMinimal, AccountFull, CustomerInfo, AccountResponse, BalanceResponse,
+    AccountBatchRequest, AccountBatchItem, AccountBatchResponse, BalanceBatchItem, BalanceBatchResponse
 )
 
 router = APIRouter()
-read_account_audit = SecurityAudit(operation_name="Account API")
+
+# Maximum number of missed balance changes replayed on Last-Event-ID resume
+SSE_REPLAY_LIMIT = 100
 
 
 @router.post("/accounts", response_model=Dict[str, str])
-def create_account(account: schemas.AccountCreate, db: Session = Depends(get_db),audit: SecurityAudit = Depends(read_account_audit)):
+def create_account(account: schemas.AccountCreate, request: Request, db: Session = Depends(get_db)):
     """
     Create a new account for a customer.
-    Protected by API key via global dependency.
-    Audit logging via read_account_audit dependency.
+    The initial deposit is recorded in the ledger and the balance change audit trail in the same commit.
+    The currency must be one of the current FX rate table.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
     """
     # Check if customer exists
     customer = db.get(models.Customer, account.customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
+
+    if not fx_rates.current.supports(account.currency):
+        raise HTTPException(status_code=400, detail=f"Unsupported currency: {account.currency}")
+
+    if shard_router.enabled:
+        shard_router.create_account(account.customer_id, account.initial_deposit, request, account.currency)
+        return {"message": "Account created successfully"}
     
     # Create new account with initial deposit
     db_account = models.Account(
         customer_id=account.customer_id,
-        balance=account.initial_deposit
+        balance=account.initial_deposit,
+        currency=account.currency
     )
     
     db.add(db_account)
+    db.add(balance_change(request, db_account, balance_before=0.0))
+    db.add_all(deposit_entries(db_account, account.initial_deposit))
     db.commit()
     db.refresh(db_account)
     return {"message": "Account created successfully"}
 
+def _accounts_by_id(db: Session, ids: List[int]) -> Dict[int, models.Account]:
+    """Resolve a set of account ids with a single IN query (one per shard when sharded)"""
+    if shard_router.enabled:
+        return shard_router.accounts_by_id(ids)
+    accounts = db.query(models.Account).filter(models.Account.id.in_(set(ids))).all()
+    return {account.id: account for account in accounts}
+
+@router.post("/accounts:batchGet", response_model=AccountBatchResponse)
+def batch_get_accounts(batch: AccountBatchRequest, db: Session = Depends(get_read_db)):
+    """
+    Get many accounts at once.
+    Results follow the order of the requested ids; unknown ids are marked as not found.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    accounts = _accounts_by_id(db, batch.ids)
+    return AccountBatchResponse(items=[
+        AccountBatchItem(id=account_id, found=account_id in accounts, account=accounts.get(account_id))
+        for account_id in batch.ids
+    ])
+
+@router.post("/accounts/balances:batchGet", response_model=BalanceBatchResponse)
+def batch_get_account_balances(batch: AccountBatchRequest, db: Session = Depends(get_read_db)):
+    """
+    Get the balances of many accounts at once.
+    Results follow the order of the requested ids; unknown ids are marked as not found.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    accounts = _accounts_by_id(db, batch.ids)
+    return BalanceBatchResponse(items=[
+        BalanceBatchItem(
+            account_id=account_id,
+            found=account_id in accounts,
+            balance=accounts[account_id].balance if account_id in accounts else None
+        )
+        for account_id in batch.ids
+    ])
+
 @router.get("/accounts", response_model=List[schemas.Account])
-def read_accounts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db),audit: SecurityAudit = Depends(read_account_audit)):
+def read_accounts(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """
     Get all accounts.
-    Protected by API key via global dependency.
-    Audit logging via read_account_audit dependency.
+    With sharding enabled the shards are queried in parallel and merged by id.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
     """
+    if shard_router.enabled:
+        return shard_router.list_accounts(skip, limit)
     accounts = db.query(models.Account).offset(skip).limit(limit).all()
     return accounts
 
@@ -58,14 +128,15 @@ def read_account(
     response: Response,
     detail_level: str = Query("full", pattern="^(minimal|full)$"),
     expand: List[str] = Query(default=[]),
-    db: Session = Depends(get_db),
-    audit: SecurityAudit = Depends(read_account_audit)
+    db: Session = Depends(get_account_db),
+    customer_db: Session = Depends(get_read_db)
 ):
     """
     Get account details with configurable response format. 
     This endpoint supports caching and pagination.
-    Protected by API key via global dependency.
-    Audit logging via read_account_audit dependency.
+    The account is read from its shard when sharding is enabled; customers stay on the primary.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
     """
     account = db.get(models.Account, account_id)
     if account is None:
@@ -81,13 +152,14 @@ def read_account(
     if detail_level == "full":
         response_data.update({
             "customer_id": account.customer_id,
+            "currency": account.currency,
             "created_at": account.created_at
         })
 
     # Handle expansions
     if expand:
         if "customer" in expand:
-            customer = db.query(models.Customer).filter(
+            customer = customer_db.query(models.Customer).filter(
                 models.Customer.id == account.customer_id
             ).first()
             if customer:
@@ -97,20 +169,9 @@ def read_account(
                 )
         
         if "recent_transactions" in expand:
-            recent_tx = db.query(models.Transaction).filter(
-                (models.Transaction.from_account_id == account_id) |
-                (models.Transaction.to_account_id == account_id)
-            ).order_by(models.Transaction.timestamp.desc()).limit(5).all()
-            
-            response_data["recent_transactions"] = [
-                TransactionSummary(
-                    id=tx.id,
-                    amount=tx.amount,
-                    timestamp=tx.timestamp,
-                    is_credit=tx.to_account_id == account_id
-                )
-                for tx in recent_tx
-            ]
+            response_data["recent_transactions"] = recent_transactions_by_account(
+                db, [account_id], limit=5
+            )[account_id]
 
     # Apply caching strategy
     if check_conditional_request(request, response, response_data):
@@ -131,11 +192,11 @@ def read_account(
         return AccountResponse(**response_data)
 
 @router.get("/accounts/{account_id}/balance", response_model=BalanceResponse)
-def read_account_balance(account_id: int, db: Session = Depends(get_db),audit: SecurityAudit = Depends(read_account_audit)):
+def read_account_balance(account_id: int, db: Session = Depends(get_account_db)):
     """
     Get the balance of an account.
-    Protected by API key via global dependency.
-    Audit logging via read_account_audit dependency.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
     """
     account = db.get(models.Account, account_id)
     if account is None:
@@ -143,16 +204,94 @@ def read_account_balance(account_id: int, db: Session = Depends(get_db),audit: S
     return BalanceResponse(account_id=account_id, balance=account.balance)
 
 @router.get("/customers/{customer_id}/accounts", response_model=List[schemas.Account])
-def read_customer_accounts(customer_id: int, db: Session = Depends(get_db),audit: SecurityAudit = Depends(read_account_audit)):
+def read_customer_accounts(
+    customer_id: int,
+    db: Session = Depends(get_read_db),
+    accounts_db: Session = Depends(get_customer_accounts_db)
+):
     """
-    Get all accounts for a customer.    
-    Protected by API key via global dependency.
-    Audit logging via read_account_audit dependency.
+    Get all accounts for a customer.
+    With sharding enabled the accounts are read from the customer's shard.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
     """
     # Check if customer exists
     customer = db.get(models.Customer, customer_id)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
-    accounts = db.query(models.Account).filter(models.Account.customer_id == customer_id).all()
-    return accounts 
\ No newline at end of file
+    accounts = accounts_db.query(models.Account).filter(models.Account.customer_id == customer_id).all()
+    return accounts
+
+@router.get("/accounts/{account_id}/balance-changes", response_model=schemas.PaginatedBalanceChanges)
+def read_account_balance_changes(
+    account_id: int,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_account_db)
+):
+    """
+    Range-scan the balance change audit trail of an account, oldest first,
+    across the live table and the day partitions of the range.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    # Rows are append-only, so the id alone is a stable keyset position
+    after_id = decode_cursor(cursor).get("id") if cursor else None
+    items = account_balance_changes(db, account_id, start, end, after_id, limit + 1)
+    next_cursor = encode_cursor({"id": items[limit - 1].id}) if len(items) > limit else None
+    return schemas.PaginatedBalanceChanges(items=items[:limit], next_cursor=next_cursor)
+
+def _balance_stream_backlog(db: Session, account_id: int, last_event_id: Optional[int]) -> Optional[List[dict]]:
+    """
+    Messages to send before live updates: the balance changes missed since
+    `last_event_id`, or the current balance on a fresh connection.
+    Returns None if the account does not exist.
+    """
+    try:
+        account = db.get(models.Account, account_id)
+        if account is None:
+            return None
+        change = models.BalanceChange
+        if last_event_id is not None:
+            missed = db.query(change).filter(
+                change.account_id == account_id, change.id > last_event_id
+            ).order_by(change.id.desc()).limit(SSE_REPLAY_LIMIT).all()
+            return [balance_update_message(row) for row in reversed(missed)]
+        latest_id = db.query(func.max(change.id)).filter(change.account_id == account_id).scalar()
+        return [{"event_id": latest_id, "account_id": account_id, "balance": account.balance}]
+    finally:
+        # Release the connection now: the stream may stay open for hours
+        db.close()
+
+@router.get("/accounts/{account_id}/stream")
+async def stream_account_balance(
+    account_id: int,
+    last_event_id: Optional[int] = Header(None, alias="Last-Event-ID"),
+    db: Session = Depends(get_account_primary_db)
+):
+    """
+    Stream live balance updates of an account as Server-Sent Events.
+    Sends the current balance (or the changes missed since `Last-Event-ID`), then an
+    event per committed transfer, with heartbeat comments while idle.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    # Subscribe before reading the backlog so no update falls in between
+    subscription = balance_updates.subscribe(account_id)
+    try:
+        backlog = await run_in_threadpool(_balance_stream_backlog, db, account_id, last_event_id)
+    except Exception:
+        balance_updates.unsubscribe(subscription)
+        raise
+    if backlog is None:
+        balance_updates.unsubscribe(subscription)
+        raise HTTPException(status_code=404, detail="Account not found")
+
+    return StreamingResponse(
+        sse_stream(subscription, balance_updates, backlog),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
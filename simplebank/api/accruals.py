@@ -0,0 +1,88 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import Union
+from simplebank.database import get_db, SessionLocal
+from simplebank.models import models, schemas
+from simplebank.utils.security_deps import require_scope
+from simplebank.utils.accrual import preview_accrual, run_accrual, claim_accrual_run
+from simplebank.utils.leases import worker_owner
+from simplebank.utils.sharding import shard_router
+
+router = APIRouter(dependencies=[Depends(require_scope("admin"))])
+
+# Session factory used by background runs (replaced in tests)
+accrual_session_factory = SessionLocal
+
+
+def _require_unsharded():
+    # Runs post set-based SQL against one database and its house account
+    if shard_router.enabled:
+        raise HTTPException(status_code=501, detail="Accrual runs are not supported with sharding enabled")
+
+
+@router.post("/accruals", response_model=Union[schemas.AccrualRun, schemas.AccrualPreview])
+def create_accrual_run(
+    accrual: schemas.AccrualCreate,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)):
+    """
+    Start an interest or fee run over all accounts, or report its totals with `dry_run`.
+    The run executes in the background in committed chunks; poll it by id.
+    Not available with sharding enabled (501).
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    _require_unsharded()
+    if db.get(models.Account, accrual.house_account_id) is None:
+        raise HTTPException(status_code=404, detail="House account not found")
+
+    if accrual.dry_run:
+        count, total = preview_accrual(db, accrual.kind, accrual.house_account_id, accrual.rate, accrual.amount)
+        return schemas.AccrualPreview(kind=accrual.kind, accounts=count, total_amount=total)
+
+    run = models.AccrualRun(
+        kind=accrual.kind,
+        rate=accrual.rate,
+        amount=accrual.amount,
+        house_account_id=accrual.house_account_id,
+    )
+    db.add(run)
+    db.commit()
+    db.refresh(run)
+    background_tasks.add_task(run_accrual, accrual_session_factory, run.id)
+    return run
+
+@router.get("/accruals/{run_id}", response_model=schemas.AccrualRun)
+def read_accrual_run(run_id: int, db: Session = Depends(get_db)):
+    """
+    Get the progress of an accrual run.
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    run = db.get(models.AccrualRun, run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Accrual run not found")
+    return run
+
+@router.post("/accruals/{run_id}/resume", response_model=schemas.AccrualRun)
+def resume_accrual_run(run_id: int, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    """
+    Resume a failed or interrupted run from its last committed account id.
+    The run is claimed before this returns, so a run that is completed or still
+    running in a live worker is rejected with 409 rather than executed twice.
+    Not available with sharding enabled (501).
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    _require_unsharded()
+    run = db.get(models.AccrualRun, run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Accrual run not found")
+    if run.status == "completed":
+        raise HTTPException(status_code=409, detail="Accrual run already completed")
+    owner = worker_owner()
+    if not claim_accrual_run(db, run.id, owner):
+        raise HTTPException(status_code=409, detail="Accrual run is already running")
+    background_tasks.add_task(run_accrual, accrual_session_factory, run.id, owner=owner)
+    db.refresh(run)
+    return run
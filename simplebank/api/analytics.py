@@ -0,0 +1,70 @@
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from simplebank.models import schemas
+from simplebank.utils.security_deps import require_scope
+from simplebank.utils import columnar
+
+router = APIRouter(dependencies=[Depends(require_scope("admin"))])
+
+
+def get_snapshot() -> columnar.ColumnarSnapshot:
+    snapshot = columnar.current_snapshot()
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Analytics snapshot not exported yet",
+                            headers={"Retry-After": str(int(columnar.ANALYTICS_SNAPSHOT_INTERVAL) or 60)})
+    return snapshot
+
+
+@router.get("/analytics/top-accounts", response_model=schemas.TopAccounts)
+def read_top_accounts(
+    by: str = Query("amount", pattern="^(amount|count)$"),
+    direction: str = Query("out", pattern="^(out|in|both)$"),
+    limit: int = Query(10, ge=1, le=1000),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    snapshot: columnar.ColumnarSnapshot = Depends(get_snapshot)
+):
+    """
+    Accounts ranked by money (or number of transfers) sent, received, or both.
+    Computed from the columnar snapshot, which lags the database by up to ANALYTICS_SNAPSHOT_INTERVAL.
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    items = columnar.top_accounts(snapshot, by, direction, limit, start, end)
+    return schemas.TopAccounts(snapshot=snapshot.info(), items=items)
+
+
+@router.get("/analytics/amount-distribution", response_model=schemas.AmountDistribution)
+def read_amount_distribution(
+    percentiles: List[float] = Query([50, 90, 95, 99]),
+    bins: int = Query(20, ge=1, le=200),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    snapshot: columnar.ColumnarSnapshot = Depends(get_snapshot)
+):
+    """
+    Percentiles and a log-scale histogram of transfer amounts.
+    Computed from the columnar snapshot, which lags the database by up to ANALYTICS_SNAPSHOT_INTERVAL.
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    if any(not 0 <= p <= 100 for p in percentiles):
+        raise HTTPException(status_code=422, detail="Percentiles must be between 0 and 100")
+    distribution = columnar.amount_distribution(snapshot, percentiles, bins, start, end)
+    return schemas.AmountDistribution(snapshot=snapshot.info(), **distribution)
+
+
+@router.get("/analytics/daily-totals", response_model=schemas.DailyTotals)
+def read_daily_totals(
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    snapshot: columnar.ColumnarSnapshot = Depends(get_snapshot)
+):
+    """
+    Number and amount of transfers per UTC day.
+    Computed from the columnar snapshot, which lags the database by up to ANALYTICS_SNAPSHOT_INTERVAL.
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    return schemas.DailyTotals(snapshot=snapshot.info(), items=columnar.daily_totals(snapshot, start, end))
@@ -0,0 +1,60 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List
+from simplebank.utils.security_deps import require_scope
+from simplebank.utils.api_keys import create_api_key, api_key_cache, ALL_SCOPES
+from simplebank.database import get_db
+from simplebank.models import models, schemas
+
+
+router = APIRouter(dependencies=[Depends(require_scope("admin"))])
+
+
+@router.post("/api-keys", response_model=schemas.ApiKeyCreated)
+def issue_api_key(
+    api_key: schemas.ApiKeyCreate,
+    db: Session = Depends(get_db)):
+    """Issue a new client API key.
+    
+    The raw key is only returned in this response; the database stores its hash.
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    unknown_scopes = set(api_key.scopes) - ALL_SCOPES
+    if unknown_scopes:
+        raise HTTPException(status_code=400, detail=f"Unknown scopes: {', '.join(sorted(unknown_scopes))}")
+    db_api_key, raw_key = create_api_key(db, api_key.name, api_key.scopes, api_key.rate_limit)
+    return schemas.ApiKeyCreated(
+        **schemas.ApiKeyInfo.model_validate(db_api_key).model_dump(),
+        api_key=raw_key
+    )
+
+@router.get("/api-keys", response_model=List[schemas.ApiKeyInfo])
+def read_api_keys(
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db)):
+    """Get all client API keys (without their values).
+    
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    return db.query(models.ApiKey).offset(skip).limit(limit).all()
+
+@router.delete("/api-keys/{api_key_id}", response_model=schemas.ApiKeyInfo)
+def revoke_api_key(
+    api_key_id: int,
+    db: Session = Depends(get_db)):
+    """Revoke a client API key.
+    
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    db_api_key = db.get(models.ApiKey, api_key_id)
+    if db_api_key is None:
+        raise HTTPException(status_code=404, detail="API key not found")
+    db_api_key.active = False
+    db.commit()
+    db.refresh(db_api_key)
+    api_key_cache.invalidate(str(api_key_id))
+    return db_api_key
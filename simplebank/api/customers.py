@@ -1,51 +1,129 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
 from sqlalchemy.orm import Session
-from typing import List, Dict
-from simplebank.utils.security_deps import SecurityAudit
-from simplebank.database import get_db
+from typing import List, Dict, Optional
+from simplebank.database import get_db, get_read_db
 from simplebank.models import models, schemas
+from simplebank.utils.cache import check_conditional_request
+from simplebank.utils.history import recent_transactions_by_account
+from simplebank.utils.pagination import encode_cursor, decode_cursor
+from simplebank.utils.search import search_customers
+from simplebank.utils.sharding import get_customer_accounts_db
 
 
 router = APIRouter()
-customer_audit = SecurityAudit(operation_name="Customer API")
 
 
 @router.get("/customers", response_model=List[schemas.Customer])
 def read_customers(
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db),
-    audit: SecurityAudit = Depends(customer_audit)):
+    db: Session = Depends(get_read_db)):
     """Get all customers.
     
-    Protected by API key via global dependency.
-    Audit logging via customer_audit dependency.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
     """
     customers = db.query(models.Customer).offset(skip).limit(limit).all()
     return customers
 
+@router.get("/customers/search", response_model=schemas.PaginatedCustomers)
+def search_customers_by_name(
+    q: str = Query(..., min_length=1, max_length=100),
+    fuzzy: bool = Query(False),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_read_db)):
+    """Search customers by name, best matches first.
+    
+    By default every word of `q` must start a word of the name ("bra gib" finds
+    "Branden Gibson"); with `fuzzy=true` names sharing the most trigrams with `q`
+    rank first, which tolerates typos. Results are keyset-paginated on (rank, id).
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    after = None
+    if cursor:
+        values = decode_cursor(cursor)
+        if "score" in values and "id" in values:
+            after = (values["score"], values["id"])
+
+    results = search_customers(db, q, fuzzy=fuzzy, limit=limit + 1, after=after)
+    next_cursor = None
+    if len(results) > limit:
+        last, score = results[limit - 1]
+        next_cursor = encode_cursor({"score": score, "id": last.id})
+    return schemas.PaginatedCustomers(items=[customer for customer, _ in results[:limit]], next_cursor=next_cursor)
+
 @router.get("/customers/{customer_id}", response_model=schemas.Customer)
 def read_customer(
     customer_id: int, 
-    db: Session = Depends(get_db),
-    audit: SecurityAudit = Depends(customer_audit)):
+    db: Session = Depends(get_read_db)):
     """Get a customer by ID.
     
-    Protected by API key via global dependency.
-    Audit logging via customer_audit dependency.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
     """
     customer = db.get(models.Customer, customer_id)
     if customer is None:
         raise HTTPException(status_code=404, detail="Customer not found")
     return customer
 
+@router.get("/customers/{customer_id}/portfolio", response_model=schemas.CustomerPortfolio)
+def read_customer_portfolio(
+    customer_id: int,
+    request: Request,
+    response: Response,
+    recent: int = Query(5, ge=0, le=50),
+    db: Session = Depends(get_read_db),
+    accounts_db: Session = Depends(get_customer_accounts_db)):
+    """Get a customer with all accounts and the latest transactions of each account.
+    
+    Costs a constant number of queries regardless of the number of accounts:
+    the accounts come from one query and the recent transactions from a single
+    windowed query, both on the customer's shard when sharding is enabled.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    customer = db.get(models.Customer, customer_id)
+    if customer is None:
+        raise HTTPException(status_code=404, detail="Customer not found")
+
+    accounts = accounts_db.query(models.Account).filter(
+        models.Account.customer_id == customer_id
+    ).order_by(models.Account.id).all()
+    recent_by_account = recent_transactions_by_account(
+        accounts_db, [account.id for account in accounts], limit=recent
+    )
+    response_data = schemas.CustomerPortfolio(
+        id=customer.id,
+        name=customer.name,
+        accounts=[
+            schemas.AccountPortfolio(
+                id=account.id,
+                balance=account.balance,
+                customer_id=account.customer_id,
+                currency=account.currency,
+                created_at=account.created_at,
+                recent_transactions=recent_by_account[account.id]
+            )
+            for account in accounts
+        ]
+    )
+
+    # Apply caching strategy
+    if check_conditional_request(request, response, response_data):
+        return Response(status_code=304, headers=dict(response.headers))
+
+    response.headers["Cache-Control"] = "private, max-age=30"
+    return response_data
+
 @router.post("/customers", response_model=Dict[str, str])
-def create_customer(customer: schemas.CustomerCreate, db: Session = Depends(get_db),audit: SecurityAudit = Depends(customer_audit)):
+def create_customer(customer: schemas.CustomerCreate, db: Session = Depends(get_db)):
     """
     Create a new customer.
     
-    Protected by API key via global dependency.
-    Audit logging via customer_audit dependency.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
     """
     db_customer = models.Customer(name=customer.name)
     db.add(db_customer)
@@ -0,0 +1,101 @@
+import time
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+from simplebank.database import get_db
+from simplebank.models import models, schemas
+from simplebank.utils.outbox import fetch_events, webhook_allowed, OUTBOX_BATCH_SIZE
+from simplebank.utils.security_deps import require_scope
+
+router = APIRouter()
+
+# How often a long-poll re-checks the outbox while waiting
+LONG_POLL_INTERVAL = 0.25
+
+
+async def _wait_for_events(db: Session, after: int, limit: int, wait: float) -> List[schemas.Event]:
+    """Return events after `after`, waiting up to `wait` seconds for the first one"""
+    deadline = time.monotonic() + wait
+    while True:
+        events = await run_in_threadpool(fetch_events, db, after, limit)
+        if events or time.monotonic() >= deadline:
+            return events
+        await asyncio.sleep(LONG_POLL_INTERVAL)
+
+
+@router.get("/events", response_model=schemas.EventBatch)
+async def read_events(
+    after: Optional[int] = Query(None, ge=0),
+    consumer: Optional[str] = Query(None),
+    limit: int = Query(OUTBOX_BATCH_SIZE, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=30),
+    db: Session = Depends(get_db)
+):
+    """
+    Read transaction events, oldest first, with optional long-polling (`wait` seconds).
+    Start after an explicit event id, or after the committed offset of `consumer`.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    if after is None:
+        after = 0
+        if consumer is not None:
+            db_consumer = await run_in_threadpool(db.get, models.EventConsumer, consumer)
+            if db_consumer is None:
+                raise HTTPException(status_code=404, detail="Consumer not found")
+            after = db_consumer.offset
+
+    events = await _wait_for_events(db, after, limit, wait)
+    return schemas.EventBatch(items=events, next_after=events[-1].id if events else after)
+
+@router.post("/events/consumers", response_model=schemas.EventConsumer,
+             dependencies=[Depends(require_scope("admin"))])
+def create_event_consumer(consumer: schemas.EventConsumerCreate, db: Session = Depends(get_db)):
+    """
+    Register an event consumer.
+    With a `webhook_url` the dispatcher pushes events to it; otherwise the consumer
+    pulls with `GET /api/events?consumer=` and acknowledges what it processed.
+    Webhook hosts must be listed in OUTBOX_WEBHOOK_HOSTS.
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    if consumer.webhook_url is not None and not webhook_allowed(consumer.webhook_url):
+        raise HTTPException(status_code=400, detail="Webhook host is not allowed")
+    if db.get(models.EventConsumer, consumer.name) is not None:
+        raise HTTPException(status_code=409, detail="Consumer already exists")
+    db_consumer = models.EventConsumer(name=consumer.name, webhook_url=consumer.webhook_url, offset=0)
+    db.add(db_consumer)
+    db.commit()
+    db.refresh(db_consumer)
+    return db_consumer
+
+@router.get("/events/consumers/{name}", response_model=schemas.EventConsumer)
+def read_event_consumer(name: str, db: Session = Depends(get_db)):
+    """
+    Get an event consumer and its committed offset.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    db_consumer = db.get(models.EventConsumer, name)
+    if db_consumer is None:
+        raise HTTPException(status_code=404, detail="Consumer not found")
+    return db_consumer
+
+@router.post("/events/consumers/{name}/ack", response_model=schemas.EventConsumer)
+def acknowledge_events(name: str, ack: schemas.EventAck, db: Session = Depends(get_db)):
+    """
+    Commit a consumer's offset: every event up to `event_id` has been processed.
+    Offsets never move backwards.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    db_consumer = db.get(models.EventConsumer, name)
+    if db_consumer is None:
+        raise HTTPException(status_code=404, detail="Consumer not found")
+    if ack.event_id > db_consumer.offset:
+        db_consumer.offset = ack.event_id
+        db.commit()
+        db.refresh(db_consumer)
+    return db_consumer
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from simplebank.database import get_db
+from simplebank.models import schemas
+from simplebank.utils.security_deps import require_scope
+from simplebank.utils.fx import fx_rates, RateTable
+
+router = APIRouter(dependencies=[Depends(require_scope("admin"))])
+
+
+def _table_response(table: RateTable) -> schemas.FxRateTable:
+    return schemas.FxRateTable(version=table.version, base=table.base, rates=dict(table.rates),
+                               loaded_at=table.loaded_at)
+
+
+@router.get("/fx/rates", response_model=schemas.FxRateTable)
+def read_fx_rates():
+    """
+    The FX rate table this worker prices transfers with.
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    return _table_response(fx_rates.current)
+
+
+@router.post("/fx/rates", response_model=schemas.FxRateTable)
+def publish_fx_rates(rates: schemas.FxRatesPublish, db: Session = Depends(get_db)):
+    """
+    Publish a new FX rate table as the next version, replacing the current one atomically.
+    Other workers adopt it on their next FX_REFRESH_INTERVAL tick.
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    try:
+        table = fx_rates.publish(db, rates.base, rates.rates)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _table_response(table)
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+from simplebank.database import get_db
+from simplebank.models import schemas
+from simplebank.utils.security_deps import require_scope
+from simplebank.utils.ledger import check_ledger, merge_reports, LEDGER_CHECK_CHUNK_SIZE
+from simplebank.utils.sharding import shard_router
+
+router = APIRouter(dependencies=[Depends(require_scope("admin"))])
+
+
+@router.get("/ledger/check", response_model=schemas.LedgerCheckReport)
+def check_ledger_consistency(
+    chunk_size: int = Query(LEDGER_CHECK_CHUNK_SIZE, ge=100, le=100000),
+    db: Session = Depends(get_db)):
+    """
+    Verify every account balance against its ledger entries and report drift.
+    With sharding enabled every shard is checked in parallel and the reports are merged.
+    For nightly runs over the full dataset use `python -m simplebank.utils.ledger check`.
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    if shard_router.enabled:
+        return merge_reports(shard_router.fan_out(lambda shard_db, shard: check_ledger(shard_db, chunk_size=chunk_size)))
+    return check_ledger(db, chunk_size=chunk_size)
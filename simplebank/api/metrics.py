@@ -0,0 +1,22 @@
+import os
+from fastapi import APIRouter, Depends
+from simplebank.models import schemas
+from simplebank.utils.security_deps import require_scope
+from simplebank.utils.single_flight import single_flight_stats
+from simplebank.utils.admission import admission_controller
+
+router = APIRouter(dependencies=[Depends(require_scope("admin"))])
+
+
+@router.get("/metrics", response_model=schemas.WorkerMetrics)
+def read_metrics():
+    """
+    In-process counters of the worker serving the request (one of several in production).
+    Requires the "admin" scope.
+    Audit logging via SecurityMiddleware.
+    """
+    return schemas.WorkerMetrics(
+        pid=os.getpid(),
+        single_flight=single_flight_stats.snapshot(),
+        admission=admission_controller.snapshot(),
+    )
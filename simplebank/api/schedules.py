@@ -0,0 +1,83 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List
+from datetime import datetime
+from simplebank.database import get_db, get_read_db
+from simplebank.models import models, schemas
+from simplebank.utils.scheduler import next_run_time
+from simplebank.utils.sharding import shard_router
+
+router = APIRouter()
+
+
+@router.post("/scheduled-transfers", response_model=schemas.ScheduledTransfer)
+def create_scheduled_transfer(schedule: schemas.ScheduledTransferCreate, db: Session = Depends(get_db)):
+    """
+    Create a standing order executed by the in-app scheduler.
+    With sharding enabled the accounts are looked up on their shards.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    account_ids = [schedule.from_account_id, schedule.to_account_id]
+    if shard_router.enabled:
+        accounts = shard_router.accounts_by_id(account_ids)
+    else:
+        accounts = {account.id: account for account in db.query(models.Account).filter(models.Account.id.in_(account_ids))}
+    if schedule.from_account_id not in accounts:
+        raise HTTPException(status_code=404, detail="Source account not found")
+    if schedule.to_account_id not in accounts:
+        raise HTTPException(status_code=404, detail="Destination account not found")
+
+    db_schedule = models.ScheduledTransfer(
+        from_account_id=schedule.from_account_id,
+        to_account_id=schedule.to_account_id,
+        amount=schedule.amount,
+        interval_seconds=schedule.interval_seconds,
+        cron=schedule.cron,
+    )
+    if schedule.start_at is not None:
+        db_schedule.next_run_at = schedule.start_at
+    else:
+        db_schedule.next_run_at = next_run_time(db_schedule, datetime.utcnow())
+    db.add(db_schedule)
+    db.commit()
+    db.refresh(db_schedule)
+    return db_schedule
+
+@router.get("/scheduled-transfers", response_model=List[schemas.ScheduledTransfer])
+def read_scheduled_transfers(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
+    """
+    Get all scheduled transfers.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    return db.query(models.ScheduledTransfer).order_by(
+        models.ScheduledTransfer.id
+    ).offset(skip).limit(limit).all()
+
+@router.get("/scheduled-transfers/{schedule_id}", response_model=schemas.ScheduledTransfer)
+def read_scheduled_transfer(schedule_id: int, db: Session = Depends(get_read_db)):
+    """
+    Get a scheduled transfer with the outcome of its last run.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    db_schedule = db.get(models.ScheduledTransfer, schedule_id)
+    if db_schedule is None:
+        raise HTTPException(status_code=404, detail="Scheduled transfer not found")
+    return db_schedule
+
+@router.delete("/scheduled-transfers/{schedule_id}", response_model=schemas.ScheduledTransfer)
+def cancel_scheduled_transfer(schedule_id: int, db: Session = Depends(get_db)):
+    """
+    Cancel a scheduled transfer (kept for history, no longer executed).
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    db_schedule = db.get(models.ScheduledTransfer, schedule_id)
+    if db_schedule is None:
+        raise HTTPException(status_code=404, detail="Scheduled transfer not found")
+    db_schedule.active = False
+    db.commit()
+    db.refresh(db_schedule)
+    return db_schedule
@@ -1,25 +1,84 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List, Optional, Dict
-from sqlalchemy import or_
+from typing import List, Optional, Dict, Tuple
+import io
+import json
+import tempfile
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_, and_, func, case
 from sqlalchemy.ext.asyncio import AsyncSession
-from simplebank.database import get_db, get_db_async
+from simplebank.database import get_read_db, get_db_async
 from simplebank.models import models, schemas
-from simplebank.utils.security_deps import SecurityAudit
-from simplebank.utils.cache import check_conditional_request
-from simplebank.utils.pagination import cursor_paginate, PaginationField
-from simplebank.models.schemas import TransactionResponse, CounterpartyInfo
+from simplebank.utils.cache import (
+    check_conditional_request, summary_cache, history_page_cache, IMMUTABLE_MAX_AGE, HISTORY_PIN_LAG
+)
+from simplebank.utils.balance_audit import balance_change, balance_update_message
+from simplebank.utils.pubsub import balance_updates
+from simplebank.utils.outbox import transaction_created_event
+from simplebank.utils.ledger import transfer_entries
+from simplebank.utils.pagination import encode_cursor, decode_cursor, sign_cursor, cursor_signed
+from simplebank.utils.partitions import (
+    account_history_page, history_high_water, iter_account_statement, all_transactions, archived_transactions
+)
+from simplebank.utils.sharding import shard_router, get_account_db
+from simplebank.utils.flow_graph import transfer_graph, FLOW_GRAPH_REFRESH_INTERVAL
+from simplebank.utils.reconcile import RECONCILE_TOLERANCE, parse_records, reconcile
+from simplebank.utils.fx import fx_rates, pricing, RateUnavailable
+from simplebank.utils.velocity import velocity_rules, TransferRejected, recent_transfers_query, load_recent_transfers
+from simplebank.models.schemas import (
+    TransactionResponse, CounterpartyInfo, AccountSummary, PeriodSummary, CounterpartySummary
+)
 
 router = APIRouter()
-transaction_audit = SecurityAudit(operation_name="Transaction API")
 
-@router.post("/transactions", response_model=Dict[str, str],dependencies=[Depends(transaction_audit)])
-async def create_transaction(transaction: schemas.TransactionCreate, db: AsyncSession = Depends(get_db_async)):
+async def get_transfer_db():
+    """Async session for unsharded transfers; sharded transfers open their shard sessions themselves"""
+    if shard_router.enabled:
+        yield None
+        return
+    async for db in get_db_async():
+        yield db
+
+@router.post("/transactions", response_model=Dict[str, str])
+async def create_transaction(transaction: schemas.TransactionCreate, request: Request, db: AsyncSession = Depends(get_transfer_db)):
     """
     Create a new transaction with async db
-    Protected by API key via global dependency.
-    Audit logging via transaction_audit dependency.
+    Velocity limits and fraud rules are checked before any account is locked.
+    Cross-currency transfers are priced from the current FX rate table, whose version is recorded on the transaction.
+    The ledger entries, both balance changes and the outbox event are recorded within the same commit.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
     """
+    if not velocity_rules.is_hydrated(transaction.from_account_id):
+        if shard_router.enabled:
+            recent = await run_in_threadpool(_load_recent_sharded_transfers, transaction.from_account_id)
+        else:
+            recent = (await db.execute(recent_transfers_query(transaction.from_account_id))).all()
+        velocity_rules.hydrate(transaction.from_account_id, recent)
+    try:
+        reservation = velocity_rules.admit(transaction.from_account_id, transaction.amount)
+    except TransferRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+    try:
+        if shard_router.enabled:
+            return await _create_sharded_transaction(transaction, request)
+        return await _create_local_transaction(transaction, request, db)
+    except BaseException:
+        # Failed transfers do not count against the limits
+        velocity_rules.cancel(reservation)
+        raise
+
+def _load_recent_sharded_transfers(account_id: int):
+    db = shard_router.session(shard_router.shard_of(account_id))
+    try:
+        return load_recent_transfers(db, account_id)
+    finally:
+        db.close()
+
+async def _create_local_transaction(transaction: schemas.TransactionCreate, request: Request, db: AsyncSession) -> Dict[str, str]:
     # Check if both accounts exist``
     from_account = await db.get(models.Account, transaction.from_account_id, with_for_update=True)
     to_account = await db.get(models.Account, transaction.to_account_id, with_for_update=True)
@@ -32,19 +91,37 @@ async def create_transaction(transaction: schemas.TransactionCreate, db: AsyncSe
     # Check if the source account has sufficient funds
     if from_account.balance < transaction.amount:
         raise HTTPException(status_code=400, detail="Insufficient funds in source account")
+
+    # Priced from one reference to the current rate table, taken without locking
+    try:
+        conversion = fx_rates.current.convert(transaction.amount, from_account.currency, to_account.currency)
+    except RateUnavailable as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     # Update account balances
+    from_balance_before = from_account.balance
+    to_balance_before = to_account.balance
     from_account.balance -= transaction.amount
-    to_account.balance += transaction.amount
+    to_account.balance += conversion.amount
     
     # Create transaction record
     db_transaction = models.Transaction(
         from_account_id=transaction.from_account_id,
         to_account_id=transaction.to_account_id,
-        amount=transaction.amount
+        amount=transaction.amount,
+        **pricing(from_account.currency, conversion)
     )
     
     db.add(db_transaction)
+    db.add_all(transfer_entries(db_transaction))
+    # Both audit rows go out as one batched insert
+    balance_changes = [
+        balance_change(request, from_account, from_balance_before, transaction=db_transaction),
+        balance_change(request, to_account, to_balance_before, transaction=db_transaction),
+    ]
+    db.add_all(balance_changes)
+    # Published to consumers by the outbox dispatcher once committed
+    db.add(transaction_created_event(db_transaction))
 
     try:
         await db.commit()
@@ -52,15 +129,38 @@ async def create_transaction(transaction: schemas.TransactionCreate, db: AsyncSe
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+
+    # Notify live balance streams; the balance change id doubles as the SSE event id
+    for change in balance_changes:
+        balance_updates.publish(change.account_id, balance_update_message(change))
+    return {"message": "Transaction created successfully"}
+
+async def _create_sharded_transaction(transaction: schemas.TransactionCreate, request: Request) -> Dict[str, str]:
+    """Single-shard transfers commit locally; cross-shard ones run as an outbox saga"""
+    try:
+        completed, messages = await run_in_threadpool(
+            shard_router.transfer, transaction.from_account_id, transaction.to_account_id, transaction.amount, request
+        )
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for message in messages:
+        balance_updates.publish(message["account_id"], message)
+    if not completed:
+        return {"message": "Transaction accepted, credit pending"}
     return {"message": "Transaction created successfully"}
 
-@router.get("/transactions", response_model=List[schemas.Transaction],dependencies=[Depends(transaction_audit)])
-def read_transactions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@router.get("/transactions", response_model=List[schemas.Transaction])
+def read_transactions(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """
     Get all transactions.
-    Protected by API key via global dependency.
-    Audit logging via transaction_audit dependency.
+    With sharding enabled the shards are queried in parallel and merged by id.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
     """
+    if shard_router.enabled:
+        return shard_router.list_transactions(skip, limit)
     transactions = db.query(models.Transaction).offset(skip).limit(limit).all()
     return transactions
 
@@ -76,53 +176,67 @@ async def get_account_transactions(
     cursor: Optional[str] = Query(None),
     limit: int = Query(20, ge=1, le=100),
     expand: List[str] = Query(default=[]),
-    db: Session = Depends(get_db),
-    audit: SecurityAudit = Depends(transaction_audit)
+    db: Session = Depends(get_account_db)
 ):
     """
     Get transactions with configurable response format and pagination.
-    This endpoint supports caching and pagination.
-    Protected by API key via global dependency.
-    Audit logging via transaction_audit dependency.
+    The first page pins the highest transaction id in its cursor, signed with
+    CURSOR_SECRET, and later pages leave out higher ids. Once HISTORY_PIN_LAG has passed since pinning, every
+    lower id has committed, so those pages never change: they are served from a
+    shared page cache and marked immutable. Not with sharding, where cross-shard
+    credits arrive later with their source shard's ids. Transfers made while
+    paging show up on a fresh first page.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
     """
+    before, high_water, pinned_at = _history_cursor(cursor, account_id) if cursor else (None, None, None)
+
+    # Ids drawn before the mark but committed after it are in by now
+    settled = (pinned_at is not None and not shard_router.enabled
+               and datetime.utcnow() >= pinned_at + timedelta(seconds=HISTORY_PIN_LAG))
+    page_key = None
+    if before is not None and high_water is not None and settled:
+        # Per API key: a page is only served back to the key that paged to it
+        page_key = (getattr(request.state, "api_key_id", None), account_id, high_water, before, limit,
+                    detail_level, tuple(sorted(set(expand))))
+        cached = history_page_cache.get(page_key)
+        if cached is not None:
+            return _immutable_page(request, response, cached)
+
     # First verify account exists
     account = db.get(models.Account, account_id)
     if not account:
         raise HTTPException(status_code=404, detail="Account not found")
 
-    base_query = db.query(models.Transaction).filter(
-        or_(
-            models.Transaction.from_account_id == account_id,
-            models.Transaction.to_account_id == account_id
-        )
-    ).order_by(models.Transaction.timestamp.desc())
-
-    # Add debug logging
-    print(f"Account ID: {account_id}")
-    print(f"Cursor: {cursor}")
-    print(f"Base query count: {base_query.count()}")
-
-    # Apply cursor-based pagination
-    transactions, next_cursor = cursor_paginate(
-        query=base_query,
-        cursor=cursor,
-        limit=limit,
-        pagination_fields=[
-            PaginationField("timestamp", is_timestamp=True),
-            PaginationField("id")
-        ]
-    )
+    if cursor is None:
+        pinned_at = datetime.utcnow()
+        high_water = history_high_water(db)
 
-    print(f"Returned transactions count: {len(transactions)}")
+    # Live table first, then only the month partitions this page reaches
+    rows = account_history_page(db, account_id, before, limit + 1, high_water)
+    transactions = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = transactions[-1]
+        next_values = {"timestamp": last.timestamp, "id": last.id}
+        if high_water is not None:
+            next_values["max_id"] = high_water
+        if pinned_at is not None:
+            next_values["pinned_at"] = pinned_at
+        if high_water is not None:
+            next_values = sign_cursor(next_values, str(account_id))
+        next_cursor = encode_cursor(next_values)
 
     # Format transactions based on detail level
     results = []
     for tx in transactions:
+        is_credit = tx.to_account_id == account_id
         tx_data = {
             "id": tx.id,
-            "amount": tx.amount,
+            # Credit legs in this account's currency
+            "amount": tx.credited_amount if is_credit and tx.credited_amount is not None else tx.amount,
             "timestamp": tx.timestamp,
-            "is_credit": tx.to_account_id == account_id
+            "is_credit": is_credit
         }
 
         if detail_level == "full":
@@ -154,10 +268,322 @@ async def get_account_transactions(
         next_cursor=next_cursor
     )
 
+    if page_key is not None:
+        history_page_cache.set(page_key, response_data)
+        return _immutable_page(request, response, response_data)
+
     # Apply caching strategy
     if check_conditional_request(request, response, response_data):
         response.status_code = 304
         return response_data
 
     response.headers["Cache-Control"] = "private, max-age=30"
-    return response_data 
\ No newline at end of file
+    return response_data 
+
+def _history_cursor(cursor: str, account_id: int) -> Tuple[Optional[Tuple[datetime, int]], Optional[int], Optional[datetime]]:
+    """
+    Keyset position (timestamp, id) of the last item of the previous page, and the
+    pinned high-water mark and pinning time. The mark and the time are only taken
+    from cursors this server signed for the account; anyone else's are ignored, so a
+    forged cursor cannot get a partial page into the shared page cache.
+    Raises 400 for a malformed cursor.
+    """
+    values = decode_cursor(cursor)
+    try:
+        if not isinstance(values, dict) or not values:
+            raise ValueError("not an object")
+        before = None
+        if values.get("timestamp") is not None or values.get("id") is not None:
+            if not isinstance(values["timestamp"], str) or type(values["id"]) is not int:
+                raise ValueError("bad position")
+            before = (datetime.fromisoformat(values["timestamp"]), values["id"])
+        if not cursor_signed(values, str(account_id)):
+            return before, None, None  # Also cursors issued before pinning
+        high_water = values.get("max_id")
+        if high_water is not None and type(high_water) is not int:
+            raise ValueError("bad max_id")
+        pinned_at = values.get("pinned_at")
+        if pinned_at is not None:
+            pinned_at = datetime.fromisoformat(pinned_at)
+        return before, high_water, pinned_at
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _immutable_page(request: Request, response: Response, page: schemas.PaginatedTransactions) -> schemas.PaginatedTransactions:
+    """A history page below its cursor's high-water mark: the same URL always returns the same content"""
+    response.headers["Cache-Control"] = f"private, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    if check_conditional_request(request, response, page):
+        response.status_code = 304
+    return page
+
+def _naive_utc(moment: Optional[datetime]) -> Optional[datetime]:
+    """Query bounds as stored: naive UTC (`to=...Z` parses timezone-aware)"""
+    if moment is not None and moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+STATEMENT_CSV_COLUMNS = ["id", "timestamp", "from_account_id", "to_account_id", "amount", "is_credit"]
+
+def _statement_lines(rows, format: str):
+    if format == "csv":
+        yield ",".join(STATEMENT_CSV_COLUMNS) + "\n"
+        for row in rows:
+            yield ",".join(str(row[column]) for column in STATEMENT_CSV_COLUMNS) + "\n"
+    else:
+        for row in rows:
+            yield json.dumps(row, default=str, separators=(",", ":")) + "\n"
+
+@router.get("/accounts/{account_id}/statement")
+def export_account_statement(
+    account_id: int,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    db: Session = Depends(get_account_db)
+):
+    """
+    Stream every transaction of an account in a time range, oldest first, as NDJSON or CSV.
+    Reads archived months from their compressed files as well as the partitions and the live table.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    if db.get(models.Account, account_id) is None:
+        raise HTTPException(status_code=404, detail="Account not found")
+    rows = iter_account_statement(db, account_id, _naive_utc(start), _naive_utc(end))
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _statement_lines(rows, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="statement-{account_id}.{format}"'},
+    )
+
+@router.get("/accounts/{account_id}/trace", response_model=schemas.MoneyFlowTrace)
+def trace_money_flow(
+    account_id: int,
+    hops: int = Query(3, ge=1, le=6),
+    since: Optional[datetime] = Query(None),
+    db: Session = Depends(get_account_db)
+):
+    """
+    Where did the funds of an account go within `hops` transfers since `since`.
+    Runs a breadth-first search over the in-memory transfer graph, following each
+    account's outgoing transfers made after the funds reached it. Covers the live
+    transactions table and the month partitions, not archived months. The graph is
+    kept up to date by a background task, so the latest transfers may be missing.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    if db.get(models.Account, account_id) is None:
+        raise HTTPException(status_code=404, detail="Account not found")
+    if not transfer_graph.ready:
+        raise HTTPException(status_code=503, detail="Transfer graph is still loading",
+                            headers={"Retry-After": str(int(FLOW_GRAPH_REFRESH_INTERVAL) or 1)})
+    trace = transfer_graph.trace(account_id, hops, since)
+    return schemas.MoneyFlowTrace(account_id=account_id, hops=hops, since=since, **trace)
+
+# Uploads above this size are spooled to a temporary file
+RECONCILE_SPOOL_MEMORY = 1024 * 1024
+
+@router.post("/reconcile")
+async def reconcile_external_records(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    tolerance: float = Query(RECONCILE_TOLERANCE, ge=0, le=86400),
+    account_id: Optional[List[int]] = Query(None),
+    db: Session = Depends(get_read_db)
+):
+    """
+    Reconcile an external settlement file against the transactions.
+    The body is CSV or NDJSON (`format`, else guessed from Content-Type) of records with
+    account_id, signed amount (negative for debits), timestamp and reference. Records are
+    matched to transaction legs of the same account and amount within `tolerance`
+    seconds. The response streams NDJSON: one "matched", "missing" (no transaction) or
+    "invalid" line per record, "extra" lines for unmatched transactions in the covered
+    period (of the `account_id` accounts when given) and a final "summary".
+    The upload is spooled to disk first, then joined in bounded memory.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    upload = tempfile.SpooledTemporaryFile(max_size=RECONCILE_SPOOL_MEMORY)
+    async for chunk in request.stream():
+        upload.write(chunk)
+    upload.seek(0)
+
+    if shard_router.enabled:
+        sessions, shards = [shard_router.session(shard) for shard in range(shard_router.count)], shard_router.count
+    else:
+        sessions, shards = [db], None
+
+    def results():
+        lines = io.TextIOWrapper(upload, encoding="utf-8", newline="")
+        try:
+            for result in reconcile(parse_records(lines, format), sessions, tolerance, account_id, shards):
+                yield json.dumps(result, default=str, separators=(",", ":")) + "\n"
+        finally:
+            lines.close()
+            if shards:
+                for session in sessions:
+                    session.close()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+def _period_bucket(column, group_by: str, dialect_name: str):
+    """SQL expression labelling a timestamp with its day/week/month period"""
+    if dialect_name == "postgresql":
+        if group_by == "month":
+            return func.to_char(column, "YYYY-MM")
+        return func.to_char(func.date_trunc(group_by, column), "YYYY-MM-DD")
+    # SQLite: weeks are labelled by their Monday
+    if group_by == "month":
+        return func.strftime("%Y-%m", column)
+    if group_by == "week":
+        return func.date(column, "weekday 0", "-6 days")
+    return func.date(column)
+
+def _period_label(timestamp: datetime, group_by: str) -> str:
+    """The label _period_bucket gives `timestamp`, for rows read from archive files"""
+    if group_by == "month":
+        return timestamp.strftime("%Y-%m")
+    day = timestamp.date()
+    if group_by == "week":
+        day -= timedelta(days=day.weekday())
+    return day.isoformat()
+
+
+@router.get("/accounts/{account_id}/summary", response_model=AccountSummary)
+def get_account_summary(
+    account_id: int,
+    request: Request,
+    response: Response,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    group_by: str = Query("day", pattern="^(day|week|month)$"),
+    top: int = Query(5, ge=0, le=50),
+    db: Session = Depends(get_account_db)
+):
+    """
+    Get inflow/outflow totals per period and the top counterparties of an account.
+    Aggregation runs in SQL: one grouped query per section over the live table and
+    the month partitions in the range. Archived months in the range are added from
+    their files.
+    Summaries of closed periods (`to` in the past) are cached in-process.
+    Protected by API key via SecurityMiddleware.
+    Audit logging via SecurityMiddleware.
+    """
+    account = db.get(models.Account, account_id)
+    if not account:
+        raise HTTPException(status_code=404, detail="Account not found")
+
+    start, end = _naive_utc(start), _naive_utc(end)
+    is_closed = end is not None and end <= datetime.utcnow()
+    cache_key = (account_id, start, end, group_by, top)
+    response_data = summary_cache.get(cache_key) if is_closed else None
+
+    if response_data is None:
+        # Live table and the month partitions in the range, then the archive files
+        tx = all_transactions(db, start, end).c
+        is_credit = tx.to_account_id == account_id
+        is_debit = tx.from_account_id == account_id
+        # Credits in this account's currency, debits in the amount sent
+        credited = func.coalesce(tx.credited_amount, tx.amount)
+
+        conditions = [or_(is_debit, is_credit)]
+        if start is not None:
+            conditions.append(tx.timestamp >= start)
+        if end is not None:
+            conditions.append(tx.timestamp < end)
+
+        # period: [inflow, outflow, credit count, debit count]; counterparty: [total, count]
+        period_totals: Dict[str, list] = {}
+        counterparty_totals: Dict[int, list] = {}
+        for row in archived_transactions(start, end):
+            row_credit, row_debit = row["to_account_id"] == account_id, row["from_account_id"] == account_id
+            if not (row_credit or row_debit):
+                continue
+            amount_in = row["credited_amount"] if row["credited_amount"] is not None else row["amount"]
+            totals = period_totals.setdefault(_period_label(row["timestamp"], group_by), [0.0, 0.0, 0, 0])
+            if row_credit:
+                totals[0] += amount_in
+                totals[2] += 1
+            if row_debit:
+                totals[1] += row["amount"]
+                totals[3] += 1
+            cp_id = row["from_account_id"] if row_credit else row["to_account_id"]
+            cp_totals = counterparty_totals.setdefault(cp_id, [0.0, 0])
+            cp_totals[0] += amount_in if row_credit else row["amount"]
+            cp_totals[1] += 1
+
+        bucket = _period_bucket(tx.timestamp, group_by, db.get_bind().dialect.name).label("period")
+        period_rows = db.query(
+            bucket,
+            func.sum(case((is_credit, credited), else_=0)),
+            func.sum(case((is_debit, tx.amount), else_=0)),
+            func.count(case((is_credit, 1))),
+            func.count(case((is_debit, 1))),
+        ).filter(and_(*conditions)).group_by(bucket).order_by(bucket).all()
+        for period, inflow, outflow, credit_count, debit_count in period_rows:
+            totals = period_totals.setdefault(str(period), [0.0, 0.0, 0, 0])
+            totals[0] += inflow or 0.0
+            totals[1] += outflow or 0.0
+            totals[2] += credit_count
+            totals[3] += debit_count
+
+        periods = [
+            PeriodSummary(
+                period=period,
+                inflow=inflow,
+                outflow=outflow,
+                credit_count=credit_count,
+                debit_count=debit_count
+            )
+            for period, (inflow, outflow, credit_count, debit_count) in sorted(period_totals.items())
+        ]
+
+        top_counterparties = []
+        if top:
+            counterparty = case((is_credit, tx.from_account_id), else_=tx.to_account_id).label("counterparty")
+            total = func.sum(case((is_credit, credited), else_=tx.amount)).label("total")
+            counterparty_query = db.query(
+                counterparty, total, func.count(tx.id)
+            ).filter(and_(*conditions)).group_by(counterparty).order_by(total.desc(), counterparty)
+            if not counterparty_totals:
+                counterparty_query = counterparty_query.limit(top)
+            for cp_id, cp_total, cp_count in counterparty_query.all():
+                cp_totals = counterparty_totals.setdefault(cp_id, [0.0, 0])
+                cp_totals[0] += cp_total
+                cp_totals[1] += cp_count
+            ranked = sorted(counterparty_totals.items(), key=lambda item: (-item[1][0], item[0]))[:top]
+            top_counterparties = [
+                CounterpartySummary(account_id=cp_id, total_amount=cp_total, transaction_count=cp_count)
+                for cp_id, (cp_total, cp_count) in ranked
+            ]
+
+        total_inflow = sum(p.inflow for p in periods)
+        total_outflow = sum(p.outflow for p in periods)
+        response_data = AccountSummary(
+            account_id=account_id,
+            start=start,
+            end=end,
+            group_by=group_by,
+            total_inflow=total_inflow,
+            total_outflow=total_outflow,
+            net=total_inflow - total_outflow,
+            credit_count=sum(p.credit_count for p in periods),
+            debit_count=sum(p.debit_count for p in periods),
+            periods=periods,
+            top_counterparties=top_counterparties
+        )
+        if is_closed:
+            summary_cache.set(cache_key, response_data)
+
+    # Apply caching strategy
+    if check_conditional_request(request, response, response_data):
+        return Response(status_code=304, headers=dict(response.headers))
+
+    if is_closed:
+        response.headers["Cache-Control"] = "private, max-age=86400"
+    else:
+        response.headers["Cache-Control"] = "private, max-age=30"
+    return response_data
@@ -1,24 +1,65 @@
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from simplebank.api import customers,accounts,transactions   
-from simplebank.utils.security_deps import verify_api_key
-from simplebank.utils.init_db import init_db, init_customers
+from simplebank.api import customers,accounts,transactions,api_keys,events,schedules,accruals,ledger,metrics,analytics,fx
+from simplebank.utils.security_deps import SecurityMiddleware
+from simplebank.utils.single_flight import SingleFlightMiddleware
+from simplebank.utils.admission import AdmissionMiddleware
+from simplebank.utils.audit_log import audit_pipeline
+from simplebank.utils.outbox import OutboxDispatcher
+from simplebank.utils.scheduler import TransferScheduler
+from simplebank.utils.sharding import shard_router, ShardSagaRelay
+from simplebank.utils.columnar import SnapshotExporter
+from simplebank.utils.fx import FXRateRefresher
+from simplebank.utils.flow_graph import TransferGraphRefresher
+from simplebank.utils.pubsub import balance_updates
+from simplebank.utils.balance_audit import BalanceChangeFeed
+from simplebank.utils.leases import JobLease
+from simplebank.utils.init_db import bootstrap
 from simplebank.database import SessionLocal
 from contextlib import asynccontextmanager
+import os
+
+# Set to 0 when the schema is created by `python -m simplebank.utils.init_db` before the app starts
+INIT_DB_ON_STARTUP = os.getenv("INIT_DB_ON_STARTUP", "1").lower() in ("1", "true", "yes")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Lifespan for the FastAPI app.
-    This is used to initialize the database and customers.
+    This is used to initialize the database and customers (once per process, see bootstrap).
     """
     # Startup code
-    db = SessionLocal()
-    init_db()
-    init_customers(db)
+    if INIT_DB_ON_STARTUP:
+        bootstrap()
+    audit_pipeline.start()
+    fx_refresher = FXRateRefresher(SessionLocal)
+    fx_refresher.start()
+    outbox_dispatcher = OutboxDispatcher(SessionLocal)
+    outbox_dispatcher.start()
+    transfer_scheduler = TransferScheduler(SessionLocal)
+    transfer_scheduler.start()
+    # Singleton jobs run in every worker but only work while holding their lease
+    saga_relay = ShardSagaRelay(shard_router, balance_updates.publish, lease=JobLease(SessionLocal, "shard_saga_relay"))
+    if shard_router.enabled:
+        saga_relay.start()
+    snapshot_exporter = SnapshotExporter(lease=JobLease(SessionLocal, "analytics_snapshot"))
+    snapshot_exporter.start()
+    # Balance changes made by other workers, for this worker's live streams
+    balance_feed = BalanceChangeFeed(shard_router.sessions if shard_router.enabled else [SessionLocal])
+    balance_feed.start()
+    graph_refresher = TransferGraphRefresher()
+    graph_refresher.start()
     yield
-    # Shutdown code (if needed)
-    
+    # Shutdown code: stop background jobs and flush queued audit records
+    await graph_refresher.stop()
+    await balance_feed.stop()
+    await snapshot_exporter.stop()
+    await saga_relay.stop()
+    await transfer_scheduler.stop()
+    await outbox_dispatcher.stop()
+    await fx_refresher.stop()
+    audit_pipeline.stop()
+
 
 app = FastAPI(
     title="Simple Banking API",
@@ -27,6 +68,16 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
+# Per-route-class concurrency limits and load shedding, closest to the handlers
+app.add_middleware(AdmissionMiddleware)
+
+# Identical concurrent reads share one execution; inside SecurityMiddleware so each is still authenticated
+app.add_middleware(SingleFlightMiddleware)
+
+# Authentication, rate limiting, auditing and security headers for every route.
+# Added before CORS so that CORS stays the outermost middleware.
+app.add_middleware(SecurityMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -36,9 +87,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-app.include_router(customers.router, prefix="/api", tags=["customers"],dependencies=[Depends(verify_api_key)])
-app.include_router(accounts.router, prefix="/api", tags=["accounts"],dependencies=[Depends(verify_api_key)])
-app.include_router(transactions.router, prefix="/api", tags=["transactions"],dependencies=[Depends(verify_api_key)])
+app.include_router(customers.router, prefix="/api", tags=["customers"])
+app.include_router(accounts.router, prefix="/api", tags=["accounts"])
+app.include_router(transactions.router, prefix="/api", tags=["transactions"])
+app.include_router(api_keys.router, prefix="/api", tags=["api-keys"])
+app.include_router(events.router, prefix="/api", tags=["events"])
+app.include_router(schedules.router, prefix="/api", tags=["scheduled-transfers"])
+app.include_router(accruals.router, prefix="/api", tags=["accruals"])
+app.include_router(ledger.router, prefix="/api", tags=["ledger"])
+app.include_router(metrics.router, prefix="/api", tags=["metrics"])
+app.include_router(analytics.router, prefix="/api", tags=["analytics"])
+app.include_router(fx.router, prefix="/api", tags=["fx"])
 
 
 @app.get("/")
@@ -47,5 +106,5 @@ async def root():
 
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run("simplebank.main:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    from simplebank.server import main
+    main() 
\ No newline at end of file
@@ -1,7 +1,11 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Date, Boolean, Text, ForeignKey, Index
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import relationship
 from datetime import datetime
+import os
+
+# Currency of accounts opened without one
+DEFAULT_CURRENCY = os.getenv("DEFAULT_CURRENCY", "USD")
 
 class Base(DeclarativeBase):
     pass
@@ -20,6 +24,7 @@ class Account(Base):
     id = Column(Integer, primary_key=True, index=True)
     customer_id = Column(Integer, ForeignKey("customers.id"))
     balance = Column(Float, default=0.0)
+    currency = Column(String(3), default=DEFAULT_CURRENCY, nullable=False)  # ISO 4217 code
     created_at = Column(DateTime, default=datetime.utcnow)
     
     owner = relationship("Customer", back_populates="accounts")
@@ -36,12 +41,27 @@ class Account(Base):
 
 class Transaction(Base):
     __tablename__ = "transactions"
+    __table_args__ = (
+        # History indexes: per-account lookups ordered/filtered by time
+        Index("ix_transactions_from_account_timestamp", "from_account_id", "timestamp"),
+        Index("ix_transactions_to_account_timestamp", "to_account_id", "timestamp"),
+        # Time-ordered scans across all accounts (reconciliation)
+        Index("ix_transactions_timestamp", "timestamp"),
+        # Never reuse the ids of rows detached into partitions: later commits get higher ids
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     from_account_id = Column(Integer, ForeignKey("accounts.id"))
     to_account_id = Column(Integer, ForeignKey("accounts.id"))
-    amount = Column(Float)
+    amount = Column(Float)  # In the source account's currency
     timestamp = Column(DateTime, default=datetime.utcnow)
+    # Pricing of the transfer; credited_amount is in the destination account's currency
+    currency = Column(String(3), nullable=True)
+    credited_amount = Column(Float, nullable=True)
+    fx_rate = Column(Float, nullable=True)
+    fx_rate_version = Column(Integer, nullable=True)  # FxRateVersion.id; None before any rate table was loaded
+    accrual_run_id = Column(Integer, ForeignKey("accrual_runs.id"), nullable=True)  # Set on accrual postings
     
     from_account = relationship(
         "Account", 
@@ -52,4 +72,159 @@ class Transaction(Base):
         "Account", 
         foreign_keys=[to_account_id],
         back_populates="incoming_transactions"
-    ) 
\ No newline at end of file
+    )
+
+class FxRateVersion(Base):
+    """One published FX rate table; transactions record the version they were priced with"""
+    __tablename__ = "fx_rate_versions"
+
+    id = Column(Integer, primary_key=True)  # The version
+    base = Column(String(3), nullable=False)
+    rates = Column(Text, nullable=False)  # JSON {currency: units per unit of base}
+    checksum = Column(String(64), nullable=False)
+    loaded_at = Column(DateTime, default=datetime.utcnow)
+
+class BalanceChange(Base):
+    """Append-only record of every change made to an account balance"""
+    __tablename__ = "balance_changes"
+    __table_args__ = (
+        # Range scans by account and time; `day` picks the rows moved into a day partition
+        Index("ix_balance_changes_account_timestamp", "account_id", "timestamp"),
+        Index("ix_balance_changes_day", "day"),
+        # Ids are cursors and stream event ids: never reuse those of detached days
+        {"sqlite_autoincrement": True},
+    )
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    # No foreign key: the transaction may have been detached into a partition
+    transaction_id = Column(Integer, nullable=True)
+    balance_before = Column(Float, nullable=False)
+    balance_after = Column(Float, nullable=False)
+    request_id = Column(String(64))
+    api_key_id = Column(String(64))
+
+    account = relationship("Account")
+    transaction = relationship("Transaction", primaryjoin="foreign(BalanceChange.transaction_id) == Transaction.id")
+
+class ApiKey(Base):
+    """Client API key; only the SHA-256 hash of the key is stored"""
+    __tablename__ = "api_keys"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    key_hash = Column(String(64), unique=True, index=True, nullable=False)
+    scopes = Column(String, default="read")  # Comma-separated, e.g. "read,write"
+    rate_limit = Column(Integer, nullable=True)  # Requests per window; None uses RATE_LIMIT_MAX
+    active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class OutboxEvent(Base):
+    """Event written in the same commit as the change it describes (transactional outbox)"""
+    __tablename__ = "outbox_events"
+    __table_args__ = (
+        # One event of each type per transaction: a repeated saga step collides here
+        Index("ux_outbox_events_transaction_type", "transaction_id", "event_type", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)  # Monotonic; consumers track their offset by it
+    event_type = Column(String, nullable=False)
+    # No foreign key: the transaction may have been detached into a partition
+    transaction_id = Column(Integer, nullable=True)
+    payload = Column(Text, nullable=False)  # JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    transaction = relationship("Transaction", primaryjoin="foreign(OutboxEvent.transaction_id) == Transaction.id")
+
+class EventConsumer(Base):
+    """Registered consumer of outbox events and the id of the last event it acknowledged"""
+    __tablename__ = "event_consumers"
+
+    name = Column(String, primary_key=True)
+    webhook_url = Column(String, nullable=True)  # None for pull (long-poll) consumers
+    offset = Column(Integer, default=0, nullable=False)
+    active = Column(Boolean, default=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ScheduledTransfer(Base):
+    """Standing order: a transfer repeated on an interval or a cron schedule"""
+    __tablename__ = "scheduled_transfers"
+    __table_args__ = (
+        # The scheduler scans active schedules by due time
+        Index("ix_scheduled_transfers_due", "active", "next_run_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    from_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    to_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    amount = Column(Float, nullable=False)
+    interval_seconds = Column(Integer, nullable=True)
+    cron = Column(String, nullable=True)
+    next_run_at = Column(DateTime, nullable=False)
+    last_run_at = Column(DateTime, nullable=True)
+    last_status = Column(String, nullable=True)
+    active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class SchedulerLease(Base):
+    """Time-limited lease so only one worker runs a given background job at a time"""
+    __tablename__ = "scheduler_leases"
+
+    name = Column(String, primary_key=True)
+    owner = Column(String, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+
+class ShardIdSequence(Base):
+    """
+    Next free id slot of a table on one shard: ids are `slot * shard count + shard`.
+    Workers reserve blocks of slots from it and hand the ids out in memory.
+    """
+    __tablename__ = "shard_id_sequences"
+
+    name = Column(String, primary_key=True)  # Table name
+    next_slot = Column(Integer, nullable=False)
+
+class AccrualRun(Base):
+    """Interest or fee run over all accounts, checkpointed by account id so it can resume"""
+    __tablename__ = "accrual_runs"
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # "interest" or "fee"
+    rate = Column(Float, nullable=True)  # Interest: fraction of the balance
+    amount = Column(Float, nullable=True)  # Fee: flat amount per account
+    house_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False)
+    status = Column(String, default="pending")  # pending, running, completed, failed
+    last_account_id = Column(Integer, default=0, nullable=False)  # Checkpoint: accounts <= id are done
+    accounts_posted = Column(Integer, default=0, nullable=False)
+    total_amount = Column(Float, default=0.0, nullable=False)
+    posted_at = Column(DateTime, default=datetime.utcnow)  # Timestamp of every posting of the run
+    error = Column(String, nullable=True)
+    # Worker executing the run; its claim lapses when heartbeat_at is older than ACCRUAL_LEASE_TTL
+    owner = Column(String, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+class LedgerEntry(Base):
+    """
+    Double-entry ledger line. The entries of one posting sum to zero;
+    account_id NULL is the outside world (deposits). Account.balance is a
+    materialized cache of the sum of an account's entries.
+    """
+    __tablename__ = "ledger_entries"
+    __table_args__ = (
+        Index("ix_ledger_entries_account_id", "account_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey("accounts.id"), nullable=True)
+    # No foreign key: the transaction may have been detached into a partition
+    transaction_id = Column(Integer, nullable=True)
+    amount = Column(Float, nullable=False)  # Signed: positive credits, negative debits
+    kind = Column(String, nullable=False)  # "opening", "deposit", "transfer", "fx", "accrual"
+    timestamp = Column(DateTime, default=datetime.utcnow)
+
+    account = relationship("Account")
+    transaction = relationship("Transaction", primaryjoin="foreign(LedgerEntry.transaction_id) == Transaction.id")
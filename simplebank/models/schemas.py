@@ -1,6 +1,9 @@
-from pydantic import BaseModel, ConfigDict, Field, field_validator
-from datetime import datetime
-from typing import List, Optional, Any
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+from datetime import datetime, date
+import os
+from simplebank.utils.cron import CronSchedule
+from simplebank.models.models import DEFAULT_CURRENCY
+from typing import Dict, List, Optional, Any
 
 # Customer schemas
 class CustomerBase(BaseModel):
@@ -19,11 +22,13 @@ class AccountBase(BaseModel):
 
 class AccountCreate(AccountBase):
     initial_deposit: float = Field(..., gt=0.0) # greater than 0.0
+    currency: str = Field(DEFAULT_CURRENCY, pattern="^[A-Z]{3}$")  # Must be in the current FX rate table
 
 class Account(AccountBase):
     model_config = ConfigDict(from_attributes=True)
     id: int
     balance: float
+    currency: str
     created_at: datetime
 
 class AccountWithCustomer(Account):
@@ -35,6 +40,28 @@ class BalanceResponse(BaseModel):
     account_id: int
     balance: float
 
+# Bulk lookup schemas
+BATCH_GET_MAX = int(os.getenv("BATCH_GET_MAX", "500"))
+
+class AccountBatchRequest(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=BATCH_GET_MAX)
+
+class AccountBatchItem(BaseModel):
+    id: int
+    found: bool
+    account: Optional[Account] = None
+
+class AccountBatchResponse(BaseModel):
+    items: List[AccountBatchItem]
+
+class BalanceBatchItem(BaseModel):
+    account_id: int
+    found: bool
+    balance: Optional[float] = None
+
+class BalanceBatchResponse(BaseModel):
+    items: List[BalanceBatchItem]
+
 
 # Transaction schemas
 class TransactionBase(BaseModel):
@@ -51,10 +78,39 @@ class TransactionBase(BaseModel):
 class TransactionCreate(TransactionBase):
     pass
 
+# Scheduled (recurring) transfer schemas
+class ScheduledTransferCreate(TransactionBase):
+    interval_seconds: Optional[int] = Field(None, ge=60)
+    cron: Optional[str] = None
+    start_at: Optional[datetime] = None  # First run; defaults to the next scheduled time
+
+    @model_validator(mode='after')
+    def exactly_one_schedule(self):
+        if (self.cron is None) == (self.interval_seconds is None):
+            raise ValueError('provide exactly one of interval_seconds or cron')
+        if self.cron is not None:
+            CronSchedule(self.cron)  # Raises ValueError on invalid expressions
+        return self
+
+class ScheduledTransfer(TransactionBase):
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+    interval_seconds: Optional[int] = None
+    cron: Optional[str] = None
+    next_run_at: datetime
+    last_run_at: Optional[datetime] = None
+    last_status: Optional[str] = None
+    active: bool
+
 class Transaction(TransactionBase):
     model_config = ConfigDict(from_attributes=True)
     id: int
     timestamp: datetime
+    # Pricing: amount is in `currency`, credited_amount in the destination account's currency
+    currency: Optional[str] = None
+    credited_amount: Optional[float] = None
+    fx_rate: Optional[float] = None
+    fx_rate_version: Optional[int] = None
 
 class TransactionWithAccounts(Transaction):
     from_account: Account
@@ -77,6 +133,7 @@ class AccountMinimal(BaseResponse):
 
 class AccountFull(AccountMinimal):
     customer_id: int
+    currency: str
     created_at: datetime
 
 # Account response with optional expanded fields
@@ -121,4 +178,255 @@ class PaginatedResponse(BaseModel):
     
 class PaginatedTransactions(PaginatedResponse):
     items: List[TransactionResponse]
-    next_cursor: Optional[str] = None 
\ No newline at end of file
+    next_cursor: Optional[str] = None 
+
+# Account summary (aggregated history)
+class PeriodSummary(BaseModel):
+    period: str
+    inflow: float
+    outflow: float
+    credit_count: int
+    debit_count: int
+
+class CounterpartySummary(BaseModel):
+    account_id: int
+    total_amount: float
+    transaction_count: int
+
+class AccountSummary(BaseModel):
+    account_id: int
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    group_by: str
+    total_inflow: float
+    total_outflow: float
+    net: float
+    credit_count: int
+    debit_count: int
+    periods: List[PeriodSummary]
+    top_counterparties: List[CounterpartySummary]
+
+
+# Customer portfolio (dashboard)
+class AccountPortfolio(AccountFull):
+    recent_transactions: List[TransactionSummary] = []
+
+class CustomerPortfolio(BaseResponse):
+    id: int
+    name: str
+    accounts: List[AccountPortfolio]
+
+
+# Balance change audit trail
+class BalanceChange(BaseResponse):
+    id: int
+    timestamp: datetime
+    account_id: int
+    transaction_id: Optional[int] = None
+    balance_before: float
+    balance_after: float
+    request_id: Optional[str] = None
+    api_key_id: Optional[str] = None
+
+class PaginatedBalanceChanges(PaginatedResponse):
+    items: List[BalanceChange]
+    next_cursor: Optional[str] = None
+
+
+# Money-flow tracing
+class FlowNode(BaseModel):
+    account_id: int
+    hop: int
+    first_reached: Optional[datetime] = None
+    received: float
+
+class FlowEdge(BaseModel):
+    transaction_id: int
+    from_account_id: int
+    to_account_id: int
+    amount: float
+    timestamp: datetime
+    hop: int
+
+class MoneyFlowTrace(BaseModel):
+    account_id: int
+    hops: int
+    since: Optional[datetime] = None
+    nodes: List[FlowNode]
+    edges: List[FlowEdge]
+    truncated: bool
+
+
+# Analytics over the columnar snapshot
+class AnalyticsSnapshotInfo(BaseModel):
+    rows: int
+    version: int
+    built_at: Optional[datetime] = None
+
+class AccountVolume(BaseModel):
+    account_id: int
+    total_amount: float
+    transaction_count: int
+
+class TopAccounts(BaseModel):
+    snapshot: AnalyticsSnapshotInfo
+    items: List[AccountVolume]
+
+class HistogramBin(BaseModel):
+    lower: float
+    upper: float
+    count: int
+
+class AmountDistribution(BaseModel):
+    snapshot: AnalyticsSnapshotInfo
+    count: int
+    total: float
+    mean: Optional[float] = None
+    min: Optional[float] = None
+    max: Optional[float] = None
+    percentiles: Dict[str, float]
+    histogram: List[HistogramBin]
+
+class DailyTotal(BaseModel):
+    day: date
+    total_amount: float
+    transaction_count: int
+
+class DailyTotals(BaseModel):
+    snapshot: AnalyticsSnapshotInfo
+    items: List[DailyTotal]
+
+
+# Customer name search
+class PaginatedCustomers(PaginatedResponse):
+    items: List[Customer]
+    next_cursor: Optional[str] = None
+
+
+# API key management
+class ApiKeyCreate(BaseModel):
+    name: str
+    scopes: List[str] = ["read"]
+    rate_limit: Optional[int] = Field(None, gt=0)
+
+class ApiKeyInfo(BaseResponse):
+    id: int
+    name: str
+    scopes: List[str]
+    rate_limit: Optional[int] = None
+    active: bool
+    created_at: datetime
+
+    @field_validator('scopes', mode='before')
+    def split_scopes(cls, v):
+        return v.split(",") if isinstance(v, str) else v
+
+class ApiKeyCreated(ApiKeyInfo):
+    api_key: str  # Only returned once, at creation
+
+
+# Outbox event stream
+class Event(BaseModel):
+    id: int
+    event_type: str
+    transaction_id: Optional[int] = None
+    created_at: datetime
+    data: dict
+
+class EventBatch(BaseModel):
+    items: List[Event]
+    next_after: int  # Pass as `after` (or acknowledge) to continue
+
+class EventConsumerCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    webhook_url: Optional[str] = None
+
+class EventConsumer(BaseResponse):
+    name: str
+    webhook_url: Optional[str] = None
+    offset: int
+    active: bool
+
+class EventAck(BaseModel):
+    event_id: int = Field(..., ge=0)
+
+
+# Interest/fee accrual runs
+class AccrualCreate(BaseModel):
+    kind: str = Field(..., pattern="^(interest|fee)$")
+    rate: Optional[float] = Field(None, gt=0.0, lt=1.0)
+    amount: Optional[float] = Field(None, gt=0.0)
+    house_account_id: int
+    dry_run: bool = False
+
+    @model_validator(mode='after')
+    def parameter_matches_kind(self):
+        if self.kind == "interest" and self.rate is None:
+            raise ValueError('interest runs need a rate')
+        if self.kind == "fee" and self.amount is None:
+            raise ValueError('fee runs need an amount')
+        return self
+
+class AccrualPreview(BaseModel):
+    kind: str
+    accounts: int
+    total_amount: float
+
+class AccrualRun(BaseResponse):
+    id: int
+    kind: str
+    rate: Optional[float] = None
+    amount: Optional[float] = None
+    house_account_id: int
+    status: str
+    last_account_id: int
+    accounts_posted: int
+    total_amount: float
+    posted_at: datetime
+    error: Optional[str] = None
+    finished_at: Optional[datetime] = None
+
+
+# Ledger consistency check
+class LedgerDrift(BaseModel):
+    account_id: int
+    balance: float
+    ledger_balance: float
+    drift: float
+
+class LedgerCheckReport(BaseModel):
+    accounts_checked: int
+    accounts_drifted: int
+    max_drift: float
+    unbalanced_total: float  # Sum of all entries; 0 when every posting balances
+    drifted: List[LedgerDrift]  # First drifted accounts, capped
+
+# Worker metrics
+class SingleFlightMetrics(BaseModel):
+    leaders: int  # Requests that executed the endpoint
+    followers: int  # Identical concurrent requests served from a leader's response
+    bypassed: int  # Skipped coalescing (client inside its read-your-writes window)
+    coalescing_ratio: float  # followers / (leaders + followers)
+
+class AdmissionClassMetrics(BaseModel):
+    active: int
+    queued: int
+    admitted: int
+    rejected: int  # Queue full
+    timed_out: int  # Waited longer than the class's queue timeout
+
+class WorkerMetrics(BaseModel):
+    pid: int
+    single_flight: SingleFlightMetrics
+    admission: Dict[str, AdmissionClassMetrics]  # Per route class: write, read, bulk
+
+# FX rates
+class FxRatesPublish(BaseModel):
+    base: str = Field(..., pattern="^[A-Z]{3}$")
+    rates: Dict[str, float]  # Units of each currency per unit of base
+
+class FxRateTable(BaseModel):
+    version: Optional[int] = None  # None: built-in table, no rates loaded yet
+    base: str
+    rates: Dict[str, float]
+    loaded_at: Optional[datetime] = None
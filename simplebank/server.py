@@ -0,0 +1,159 @@
+"""
+Server launcher.
+
+Development (`APP_ENV=development`, the default) runs a single uvicorn process
+with auto-reload. Production (`APP_ENV=production`) runs gunicorn with uvicorn
+workers:
+
+- `WEB_CONCURRENCY` workers, defaulting to the CPUs available to the process
+- the app is imported once in the master (preload) and shared with the forked
+  workers copy-on-write; database pools are reset after the fork
+- the schema is created and the sample data seeded once, in the master, before
+  any worker starts (`INIT_DB_ON_STARTUP=0` skips it)
+- uvloop and httptools are used when installed (`SERVER_LOOP`, `SERVER_HTTP`)
+- SIGTERM stops accepting connections and lets in-flight requests finish for
+  `GRACEFUL_TIMEOUT` seconds, then runs the lifespan shutdown of each worker
+- workers are recycled after `MAX_REQUESTS` requests (plus jitter)
+- each worker writes its own audit log file (`AUDIT_LOG_PER_PROCESS`)
+
+Usage: python -m simplebank.server
+"""
+import os
+import logging
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+APP = "simplebank.main:app"
+APP_ENV = os.getenv("APP_ENV", "development")
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# Auto-reload defaults to on in development only
+RELOAD = os.getenv("RELOAD", "0" if APP_ENV.lower() in ("production", "prod") else "1").lower() in ("1", "true", "yes")
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", "10000"))
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))  # Seconds
+KEEPALIVE = int(os.getenv("KEEPALIVE", "5"))  # Seconds
+BACKLOG = int(os.getenv("BACKLOG", "2048"))
+
+
+def is_production(env: str = APP_ENV) -> bool:
+    return env.lower() in ("production", "prod")
+
+
+def worker_count() -> int:
+    """WEB_CONCURRENCY, else the CPUs this process may run on (respects affinity/cpusets)"""
+    configured = os.getenv("WEB_CONCURRENCY")
+    if configured:
+        return max(1, int(configured))
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:  # Not available on macOS/Windows
+        return max(1, os.cpu_count() or 1)
+
+
+def _installed(module: str) -> bool:
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+def event_loop() -> str:
+    return os.getenv("SERVER_LOOP") or ("uvloop" if _installed("uvloop") else "asyncio")
+
+
+def http_protocol() -> str:
+    return os.getenv("SERVER_HTTP") or ("httptools" if _installed("httptools") else "h11")
+
+
+def check_reload(env: str = APP_ENV, reload: bool = RELOAD) -> None:
+    """Auto-reload watches the file system and runs one process: never in production"""
+    if reload and is_production(env):
+        raise SystemExit("Refusing to start with reload enabled in production (unset RELOAD or APP_ENV)")
+
+
+def gunicorn_options() -> Dict[str, Any]:
+    return {
+        "bind": f"{HOST}:{PORT}",
+        "workers": worker_count(),
+        "worker_class": "simplebank.server.BankWorker",
+        "preload_app": True,
+        "max_requests": MAX_REQUESTS,
+        "max_requests_jitter": MAX_REQUESTS_JITTER,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        # Async workers heartbeat from the event loop; a blocked loop is killed after this
+        "timeout": GRACEFUL_TIMEOUT * 2,
+        "keepalive": KEEPALIVE,
+        "backlog": BACKLOG,
+        "on_starting": on_starting,
+        "post_fork": post_fork,
+    }
+
+
+def on_starting(server) -> None:
+    """Create the schema and seed once in the master; the forked workers skip it"""
+    from simplebank.main import INIT_DB_ON_STARTUP
+    from simplebank.utils.init_db import bootstrap
+    if INIT_DB_ON_STARTUP:
+        bootstrap()
+
+
+def post_fork(server, worker) -> None:
+    """Drop connections inherited from the master; each worker opens its own"""
+    from simplebank.database import engine, replica_router
+    from simplebank.utils.sharding import shard_router
+    for pooled in [engine, *replica_router.replicas, *shard_router.engines]:
+        pooled.dispose(close=False)
+
+
+try:
+    from uvicorn.workers import UvicornWorker
+
+    class BankWorker(UvicornWorker):
+        CONFIG_KWARGS = {
+            "loop": event_loop(),
+            "http": http_protocol(),
+            "lifespan": "on",
+            "timeout_graceful_shutdown": GRACEFUL_TIMEOUT,
+        }
+except ImportError:  # gunicorn or uvicorn missing; only needed in production
+    BankWorker = None
+
+
+def serve_production() -> None:
+    from gunicorn.app.base import BaseApplication
+    # Workers must not rotate the same audit file; set before the sink is created
+    os.environ.setdefault("AUDIT_LOG_PER_PROCESS", "1")
+    from simplebank.main import app  # Preloaded in the master, shared by the workers
+
+    class BankApplication(BaseApplication):
+        def load_config(self):
+            for key, value in gunicorn_options().items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    options = gunicorn_options()
+    logger.info(f"Starting {options['workers']} workers on {options['bind']} "
+                f"(loop={event_loop()}, http={http_protocol()})")
+    BankApplication().run()
+
+
+def serve_development() -> None:
+    import uvicorn
+    uvicorn.run(APP, host=HOST, port=PORT, reload=RELOAD)
+
+
+def main() -> None:
+    check_reload()
+    if is_production():
+        serve_production()
+    else:
+        serve_development()
+
+
+if __name__ == "__main__":
+    main()
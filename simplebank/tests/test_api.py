@@ -9,12 +9,18 @@ from datetime import datetime, timedelta
 import base64
 import json
 
-from simplebank.database import get_db
+from simplebank.database import get_db, RoutingSession, ReplicaRouter, replica_router
 from simplebank.models.models import Base
 from simplebank.models import models
-from simplebank.utils.security_deps import API_KEY, SECURITY_HEADERS, SecurityAudit
+from simplebank.utils.security_deps import API_KEY, SECURITY_HEADERS, SecurityAudit, rate_limits
 from simplebank.main import app
 from simplebank.utils.init_db import init_customers
+from simplebank.utils.cache import summary_cache
+from simplebank.utils.api_keys import api_key_cache, load_api_key
+from simplebank.utils.velocity import velocity_rules
+from simplebank.utils.flow_graph import transfer_graph
+from simplebank.utils.fx import fx_rates
+from simplebank.utils.cache import history_page_cache
 
 
 # Use in-memory SQLite for testing
@@ -24,7 +30,7 @@ engine = create_engine(SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool)
 
-TestingSessionLocal = sessionmaker(bind=engine)
+TestingSessionLocal = sessionmaker(bind=engine, class_=RoutingSession)
 
 # Override the get_db dependency for testing
 def override_get_db():
@@ -49,6 +55,12 @@ def test_db():
     
     # Drop all tables after test
     Base.metadata.drop_all(bind=engine)
+    api_key_cache.invalidate()
+    rate_limits.clear()
+    velocity_rules.clear()
+    transfer_graph.clear()
+    fx_rates.clear()
+    history_page_cache.clear()
 
 @pytest.fixture
 def client(test_db):
@@ -404,3 +416,2060 @@ class TestPaginationFeatures:
         total_items = len(data["items"]) + len(data2["items"])
         assert total_items == 25, f"Expected 25 total items, got {total_items}"
 
+    def test_pages_after_the_first_are_pinned_and_cached(self, client, sample_transactions, monkeypatch):
+        from simplebank.api import transactions as transactions_api
+        from simplebank.utils.partitions import account_history_page
+        account_id = sample_transactions[0].from_account_id
+        headers = {"X-API-Key": API_KEY}
+        url = f"/api/accounts/{account_id}/transactions?limit=10"
+        first = client.get(url, headers=headers)
+        assert first.headers["Cache-Control"] == "private, max-age=30"
+        cursor = first.json()["next_cursor"]
+        assert json.loads(base64.b64decode(cursor))["max_id"] == max(tx.id for tx in sample_transactions)
+
+        # A late transfer falling within the second page is left out of the pinned slice
+        db = TestingSessionLocal()
+        late = models.Transaction(from_account_id=account_id, to_account_id=sample_transactions[0].to_account_id,
+                                  amount=1.0, timestamp=datetime(2024, 1, 1, 12, 0) - timedelta(hours=12, minutes=30))
+        db.add(late)
+        db.commit()
+        late_id = late.id
+        db.close()
+        # Ids below the mark may still be committing: not final yet
+        early = client.get(f"{url}&cursor={cursor}", headers=headers)
+        assert early.headers["Cache-Control"] == "private, max-age=30"
+        monkeypatch.setattr(transactions_api, "HISTORY_PIN_LAG", 0)
+        second = client.get(f"{url}&cursor={cursor}", headers=headers)
+        assert second.headers["Cache-Control"] == "private, max-age=31536000, immutable"
+        assert second.json() == early.json()
+        assert late_id not in [item["id"] for item in second.json()["items"]]
+
+        # Served again from the page cache, without reading the history
+        monkeypatch.setattr(transactions_api, "account_history_page", None)
+        again = client.get(f"{url}&cursor={cursor}", headers=headers)
+        assert again.json() == second.json()
+        revalidated = client.get(f"{url}&cursor={cursor}", headers={**headers, "If-None-Match": second.headers["ETag"]})
+        assert revalidated.status_code == 304
+        monkeypatch.setattr(transactions_api, "account_history_page", account_history_page)
+
+        # A new first page pins a new mark that includes it
+        cursor = client.get(url, headers=headers).json()["next_cursor"]
+        assert late_id in [item["id"] for item in client.get(f"{url}&cursor={cursor}", headers=headers).json()["items"]]
+
+
+    def test_forged_cursors_are_not_pinned(self, client, sample_transactions, monkeypatch):
+        from simplebank.api import transactions as transactions_api
+        monkeypatch.setattr(transactions_api, "HISTORY_PIN_LAG", 0)
+        account_id = sample_transactions[0].from_account_id
+        headers = {"X-API-Key": API_KEY}
+        url = f"/api/accounts/{account_id}/transactions?limit=10"
+        cursor = json.loads(base64.b64decode(client.get(url, headers=headers).json()["next_cursor"]))
+        db = TestingSessionLocal()
+        late = models.Transaction(from_account_id=account_id, to_account_id=sample_transactions[0].to_account_id,
+                                  amount=1.0, timestamp=datetime(2024, 1, 1, 12, 0) - timedelta(hours=12, minutes=30))
+        db.add(late)
+        db.commit()
+        late_id = late.id
+        db.close()
+
+        # A client-made mark (here the old one re-pinned "long ago" without the signature) is ignored
+        forged = {key: value for key, value in cursor.items() if key != "sig"}
+        forged["pinned_at"] = "2020-01-01T00:00:00"
+        page = client.get(f"{url}&cursor={base64.b64encode(json.dumps(forged).encode()).decode()}", headers=headers)
+        assert page.headers["Cache-Control"] == "private, max-age=30"
+        assert late_id in [item["id"] for item in page.json()["items"]]
+        assert len(history_page_cache._entries) == 0
+        tampered = {**cursor, "max_id": cursor["max_id"] - 5}
+        page = client.get(f"{url}&cursor={base64.b64encode(json.dumps(tampered).encode()).decode()}", headers=headers)
+        assert late_id in [item["id"] for item in page.json()["items"]]
+        assert len(history_page_cache._entries) == 0
+
+        # The signed cursor keeps its pinned slice
+        genuine = client.get(f"{url}&cursor={base64.b64encode(json.dumps(cursor).encode()).decode()}",
+                             headers=headers)
+        assert genuine.headers["Cache-Control"] == "private, max-age=31536000, immutable"
+        assert late_id not in [item["id"] for item in genuine.json()["items"]]
+
+    @pytest.mark.parametrize("values", [
+        {"timestamp": "garbage", "id": 3},
+        {"timestamp": "2024-01-01T00:00:00", "id": "3"},
+        [1, 2],
+        "not json",
+    ])
+    def test_malformed_cursors_are_rejected(self, client, sample_transactions, values):
+        account_id = sample_transactions[0].from_account_id
+        raw = values.encode() if isinstance(values, str) else json.dumps(values).encode()
+        response = client.get(f"/api/accounts/{account_id}/transactions?cursor={base64.b64encode(raw).decode()}",
+                              headers={"X-API-Key": API_KEY})
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid cursor"
+
+    def test_malformed_pinned_at_is_rejected(self, client, sample_transactions):
+        from simplebank.utils.pagination import sign_cursor, encode_cursor
+        account_id = sample_transactions[0].from_account_id
+        cursor = encode_cursor(sign_cursor({"timestamp": "2024-01-01T00:00:00", "id": 3, "max_id": 9,
+                                            "pinned_at": "yesterday"}, str(account_id)))
+        response = client.get(f"/api/accounts/{account_id}/transactions?cursor={cursor}",
+                              headers={"X-API-Key": API_KEY})
+        assert response.status_code == 400
+
+class TestAccountSummary:
+    def test_summary_groups_by_day(self, client, sample_transactions):
+        """Test that the summary aggregates inflow/outflow per period"""
+        account_id = sample_transactions[0].from_account_id
+        counterparty_id = sample_transactions[0].to_account_id
+
+        headers = {"X-API-Key": API_KEY}
+        response = client.get(f"/api/accounts/{account_id}/summary?group_by=day", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+
+        # 25 hourly transactions back from 2024-01-01 12:00 span two days
+        assert [p["period"] for p in data["periods"]] == ["2023-12-31", "2024-01-01"]
+        assert data["debit_count"] == 25
+        assert data["credit_count"] == 0
+        assert data["total_outflow"] == sum(100 + i for i in range(25))
+        assert data["net"] == -data["total_outflow"]
+        assert data["top_counterparties"][0]["account_id"] == counterparty_id
+        assert data["top_counterparties"][0]["transaction_count"] == 25
+
+    def test_summary_accepts_timezone_aware_bounds(self, client, sample_transactions):
+        account_id = sample_transactions[0].from_account_id
+        headers = {"X-API-Key": API_KEY}
+        # Both bounds are midnight UTC: the 12 hourly transfers from Dec 31 12:00 fall before it
+        response = client.get(f"/api/accounts/{account_id}/summary?to=2024-01-01T00:00:00Z", headers=headers)
+        assert response.status_code == 200
+        shifted = client.get(f"/api/accounts/{account_id}/summary",
+                             params={"to": "2024-01-01T01:00:00+01:00"}, headers=headers)
+        assert shifted.json() == response.json()
+        assert response.json()["debit_count"] == 12
+
+    def test_summary_closed_period_is_cached(self, client, sample_transactions):
+        """Test that summaries of closed periods are served from the cache"""
+        account_id = sample_transactions[0].to_account_id
+        summary_cache.clear()
+
+        headers = {"X-API-Key": API_KEY}
+        url = f"/api/accounts/{account_id}/summary?from=2024-01-01T00:00:00&to=2024-02-01T00:00:00&group_by=month"
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["periods"][0]["period"] == "2024-01"
+        assert data["credit_count"] == 13
+        assert "max-age=86400" in response.headers["Cache-Control"]
+
+        # A second identical request is answered from the cache
+        with patch('simplebank.api.transactions._period_bucket') as mock_bucket:
+            response2 = client.get(url, headers=headers)
+            mock_bucket.assert_not_called()
+        assert response2.json() == data
+
+        # Conditional request on the cached result
+        response3 = client.get(url, headers={**headers, "If-None-Match": response.headers["ETag"]})
+        assert response3.status_code == 304
+
+    def test_credits_count_in_the_receiving_currency(self, client, test_db):
+        """Test that cross-currency credits are summed and listed at their credited amount"""
+        db = TestingSessionLocal()
+        db.query(models.Transaction).delete()
+        db.add_all([
+            models.Transaction(from_account_id=1, to_account_id=2, amount=100.0, timestamp=datetime(2024, 1, 1),
+                               currency="USD", credited_amount=50.0, fx_rate=0.5, fx_rate_version=1),
+            models.Transaction(from_account_id=2, to_account_id=1, amount=10.0, timestamp=datetime(2024, 1, 2)),
+        ])
+        db.commit()
+        db.close()
+
+        headers = {"X-API-Key": API_KEY}
+        data = client.get("/api/accounts/2/summary", headers=headers).json()
+        assert (data["total_inflow"], data["total_outflow"]) == (50.0, 10.0)
+        assert data["top_counterparties"][0]["total_amount"] == 60.0
+        items = client.get("/api/accounts/2/transactions", headers=headers).json()["items"]
+        assert [(item["amount"], item["is_credit"]) for item in items] == [(10.0, False), (50.0, True)]
+        assert client.get("/api/accounts/1/summary", headers=headers).json()["total_outflow"] == 100.0
+
+class TestCustomerPortfolio:
+    def test_portfolio_returns_accounts_with_recent_transactions(self, client, sample_transactions):
+        """Test the portfolio endpoint returns every account with its latest transactions"""
+        headers = {"X-API-Key": API_KEY}
+        response = client.get("/api/customers/1/portfolio?recent=3", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+
+        assert data["name"] == "Arisha Barron"
+        accounts = {account["id"]: account for account in data["accounts"]}
+        # Customer 1 owns the two seeded accounts plus the first sample account
+        assert set(accounts) == {1, 2, sample_transactions[0].from_account_id}
+
+        recent = accounts[sample_transactions[0].from_account_id]["recent_transactions"]
+        assert len(recent) == 3
+        assert all(not tx["is_credit"] for tx in recent)
+        timestamps = [tx["timestamp"] for tx in recent]
+        assert timestamps == sorted(timestamps, reverse=True)
+
+    def test_portfolio_query_count_is_constant(self, client, sample_transactions):
+        """Test the portfolio costs the same number of queries for any number of accounts"""
+        from sqlalchemy import event
+
+        statements = []
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        headers = {"X-API-Key": API_KEY}
+        event.listen(engine, "before_cursor_execute", count_statement)
+        try:
+            client.get("/api/customers/1/portfolio", headers=headers)
+            single_customer_queries = len(statements)
+            statements.clear()
+            # Customer 4 owns a single account
+            client.get("/api/customers/4/portfolio", headers=headers)
+        finally:
+            event.remove(engine, "before_cursor_execute", count_statement)
+        assert len(statements) == single_customer_queries == 3
+
+    def test_portfolio_missing_customer(self, client):
+        response = client.get("/api/customers/999/portfolio", headers={"X-API-Key": API_KEY})
+        assert response.status_code == 404
+
+class TestBatchLookup:
+    def test_batch_get_accounts_keeps_request_order(self, client):
+        """Test batch lookup returns results in request order with not-found markers"""
+        response = client.post(
+            "/api/accounts:batchGet",
+            json={"ids": [3, 999, 1, 3]}, headers={"X-API-Key": API_KEY}
+        )
+        assert response.status_code == 200
+        items = response.json()["items"]
+        assert [item["id"] for item in items] == [3, 999, 1, 3]
+        assert [item["found"] for item in items] == [True, False, True, True]
+        assert items[0]["account"]["balance"] == 2500.0
+        assert items[1]["account"] is None
+
+    def test_batch_get_balances(self, client):
+        response = client.post(
+            "/api/accounts/balances:batchGet",
+            json={"ids": [5, 42]}, headers={"X-API-Key": API_KEY}
+        )
+        assert response.status_code == 200
+        assert response.json()["items"] == [
+            {"account_id": 5, "found": True, "balance": 15000.0},
+            {"account_id": 42, "found": False, "balance": None},
+        ]
+
+    def test_batch_get_rejects_too_many_ids(self, client):
+        from simplebank.models.schemas import BATCH_GET_MAX
+        response = client.post(
+            "/api/accounts:batchGet",
+            json={"ids": list(range(BATCH_GET_MAX + 1))}, headers={"X-API-Key": API_KEY}
+        )
+        assert response.status_code == 422
+
+class TestAuditPipeline:
+    class ListSink:
+        def __init__(self):
+            self.batches = []
+        def write(self, records):
+            self.batches.append(list(records))
+        def close(self):
+            pass
+
+    def test_records_are_batched_and_flushed_on_stop(self):
+        from simplebank.utils.audit_log import AuditPipeline
+        sink = self.ListSink()
+        pipeline = AuditPipeline(sink, maxsize=100, batch_size=10, flush_interval=0.01)
+        for i in range(25):
+            pipeline.emit({"event": "request", "seq": i})
+        pipeline.stop()
+
+        records = [record for batch in sink.batches for record in batch]
+        assert [record["seq"] for record in records] == list(range(25))
+        assert all(len(batch) <= 10 for batch in sink.batches)
+        assert pipeline.written == 25 and pipeline.dropped == 0
+
+    def test_drop_policy_when_queue_is_full(self):
+        from simplebank.utils.audit_log import AuditPipeline
+        pipeline = AuditPipeline(self.ListSink(), maxsize=2, policy="drop")
+        pipeline._thread = MagicMock()  # Keep the writer from draining the queue
+        for i in range(5):
+            pipeline.emit({"seq": i})
+        assert pipeline.dropped == 3
+
+    def test_json_lines_file_sink_rotates(self, tmp_path):
+        from simplebank.utils.audit_log import JsonLinesFileSink
+        path = tmp_path / "audit.log"
+        sink = JsonLinesFileSink(str(path), max_bytes=50, backup_count=2)
+        for i in range(4):
+            sink.write([{"event": "request", "seq": i, "path": "/api/customers"}])
+        sink.close()
+
+        assert (tmp_path / "audit.log.1").exists()
+        assert (tmp_path / "audit.log.2").exists()
+        assert json.loads((tmp_path / "audit.log.1").read_text().splitlines()[0])["seq"] == 3
+
+    def test_json_lines_file_sink_per_process(self, tmp_path):
+        import os
+        from simplebank.utils.audit_log import JsonLinesFileSink
+        sink = JsonLinesFileSink(str(tmp_path / "audit.log"), max_bytes=50, backup_count=1, per_process=True)
+        for i in range(2):
+            sink.write([{"event": "request", "seq": i, "path": "/api/customers"}])
+        sink.close()
+
+        assert not (tmp_path / "audit.log").exists()
+        assert (tmp_path / f"audit.{os.getpid()}.log.1").exists()
+
+    def test_request_is_queued_for_audit(self, client):
+        with patch('simplebank.utils.security_deps.audit_pipeline') as mock_pipeline:
+            client.get("/api/customers/1", headers={"X-API-Key": "invalid_key"})
+            client.get("/api/customers/1", headers={"X-API-Key": API_KEY})
+        events = [call.args[0]["event"] for call in mock_pipeline.emit.call_args_list]
+        assert events == ["invalid_api_key", "request"]
+
+class TestBalanceChangeAudit:
+    def test_create_account_records_initial_deposit(self, client):
+        headers = {"X-API-Key": API_KEY, "X-Request-ID": "req-123"}
+        response = client.post("/api/accounts", json={"customer_id": 1, "initial_deposit": 250.0}, headers=headers)
+        assert response.status_code == 200
+
+        db = TestingSessionLocal()
+        account_id = db.query(models.Account).order_by(models.Account.id.desc()).first().id
+        db.close()
+
+        response = client.get(f"/api/accounts/{account_id}/balance-changes", headers=headers)
+        assert response.status_code == 200
+        items = response.json()["items"]
+        assert len(items) == 1
+        assert items[0]["balance_before"] == 0.0
+        assert items[0]["balance_after"] == 250.0
+        assert items[0]["request_id"] == "req-123"
+        assert items[0]["api_key_id"] is not None
+        assert items[0]["transaction_id"] is None
+
+    def test_balance_changes_range_scan_paginates(self, client):
+        headers = {"X-API-Key": API_KEY}
+        db = TestingSessionLocal()
+        base_time = datetime(2024, 1, 1)
+        db.add_all([
+            models.BalanceChange(
+                day=(base_time + timedelta(days=i)).date(), timestamp=base_time + timedelta(days=i),
+                account_id=1, balance_before=100.0 * i, balance_after=100.0 * (i + 1)
+            )
+            for i in range(5)
+        ])
+        db.commit()
+        db.close()
+
+        url = "/api/accounts/1/balance-changes?from=2024-01-02T00:00:00&to=2024-01-05T00:00:00&limit=2"
+        data = client.get(url, headers=headers).json()
+        assert [item["balance_after"] for item in data["items"]] == [200.0, 300.0]
+        data2 = client.get(f"{url}&cursor={data['next_cursor']}", headers=headers).json()
+        assert [item["balance_after"] for item in data2["items"]] == [400.0]
+        assert data2["next_cursor"] is None
+
+    def test_balance_changes_span_day_partitions(self, client):
+        from datetime import date
+        from simplebank.utils import partitions
+        headers = {"X-API-Key": API_KEY}
+        db = TestingSessionLocal()
+        base_time = datetime(2024, 1, 1, 12)
+        db.add_all([
+            models.BalanceChange(
+                day=(base_time + timedelta(days=i)).date(), timestamp=base_time + timedelta(days=i),
+                account_id=1, balance_before=100.0 * i, balance_after=100.0 * (i + 1)
+            )
+            for i in range(5)
+        ])
+        db.commit()
+        url = "/api/accounts/1/balance-changes?from=2024-01-02T00:00:00&to=2024-01-06T00:00:00&limit=2"
+        before = client.get(url, headers=headers).json()["items"]
+
+        try:
+            # Everything before 2024-01-04 moves out, one table per day
+            moved = partitions.detach_closed_days(db, now=datetime(2024, 1, 5), hot_days=2)
+            assert moved == [date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 3)]
+            assert db.query(models.BalanceChange).count() == 2
+            with pytest.raises(ValueError):
+                partitions.detach_closed_days(db, now=datetime(2024, 1, 5), hot_days=1)
+
+            pages, cursor = [], None
+            while True:
+                page = client.get(url + (f"&cursor={cursor}" if cursor else ""), headers=headers).json()
+                pages.append(page["items"])
+                cursor = page["next_cursor"]
+                if cursor is None:
+                    break
+            assert pages[0] == before
+            assert [[item["balance_after"] for item in items] for items in pages] == [[200.0, 300.0], [400.0, 500.0]]
+
+            # Ids of detached days are not reused
+            partitions.detach_closed_days(db, now=datetime(2024, 1, 10), hot_days=2)
+            db.add(models.BalanceChange(day=date(2024, 1, 10), timestamp=datetime(2024, 1, 10), account_id=1,
+                                        balance_before=500.0, balance_after=600.0))
+            db.commit()
+            assert db.query(models.BalanceChange).one().id == 6
+        finally:
+            for day in partitions.list_day_partitions(db):
+                partitions.day_partition_table(day).drop(engine)
+            db.close()
+
+class TestClientApiKeys:
+    def issue_key(self, client, **body):
+        response = client.post(
+            "/api/api-keys", json={"name": "client", **body}, headers={"X-API-Key": API_KEY}
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    def test_issued_key_authenticates_and_is_stored_hashed(self, client):
+        created = self.issue_key(client, scopes=["read"])
+        response = client.get("/api/customers/1", headers={"X-API-Key": created["api_key"]})
+        assert response.status_code == 200
+
+        db = TestingSessionLocal()
+        stored = db.get(models.ApiKey, created["id"])
+        db.close()
+        assert stored.key_hash != created["api_key"]
+
+    def test_scopes_are_enforced(self, client):
+        created = self.issue_key(client, scopes=["read"])
+        headers = {"X-API-Key": created["api_key"]}
+        response = client.post("/api/customers", json={"name": "Jane Doe"}, headers=headers)
+        assert response.status_code == 403
+        response = client.get("/api/api-keys", headers=headers)
+        assert response.status_code == 403
+
+    def test_key_lookup_is_cached(self, client):
+        created = self.issue_key(client)
+        headers = {"X-API-Key": created["api_key"]}
+        with patch('simplebank.utils.security_deps.load_api_key', wraps=load_api_key) as mock_load:
+            for _ in range(3):
+                assert client.get("/api/customers/1", headers=headers).status_code == 200
+            for _ in range(3):
+                assert client.get("/api/customers/1", headers={"X-API-Key": "unknown"}).status_code == 401
+        # One miss for the valid key and one negative entry for the unknown key
+        assert mock_load.call_count == 2
+
+    def test_key_lookup_runs_off_the_event_loop(self, client):
+        import asyncio
+        import threading
+        from simplebank.utils.security_deps import resolve_api_key
+        created = self.issue_key(client)
+        threads = []
+
+        def load(raw_key):
+            threads.append(threading.get_ident())
+            return None
+
+        async def resolve():
+            loop_thread = threading.get_ident()
+            await resolve_api_key(created["api_key"], load)
+            await resolve_api_key(created["api_key"], load)  # Negative entry: no second load
+            return loop_thread
+        loop_thread = asyncio.run(resolve())
+        assert len(threads) == 1 and threads[0] != loop_thread
+
+    def test_revoked_key_is_rejected(self, client):
+        created = self.issue_key(client)
+        headers = {"X-API-Key": created["api_key"]}
+        assert client.get("/api/customers/1", headers=headers).status_code == 200
+        response = client.delete(f"/api/api-keys/{created['id']}", headers={"X-API-Key": API_KEY})
+        assert response.status_code == 200
+        assert client.get("/api/customers/1", headers=headers).status_code == 401
+
+    def test_per_key_rate_limit(self, client):
+        created = self.issue_key(client, rate_limit=2)
+        headers = {"X-API-Key": created["api_key"]}
+        statuses = [client.get("/api/customers/1", headers=headers).status_code for _ in range(3)]
+        assert statuses == [200, 200, 429]
+
+class TestSecurityMiddleware:
+    def test_root_gets_security_headers_without_key(self, client):
+        response = client.get("/")
+        assert response.status_code == 200
+        for header, value in SECURITY_HEADERS.items():
+            assert response.headers.get(header) == value
+
+    def test_error_responses_get_security_headers(self, client):
+        response = client.get("/api/customers/1")
+        assert response.status_code == 401
+        assert response.headers["WWW-Authenticate"] == "ApiKey"
+        assert response.headers["X-Frame-Options"] == "DENY"
+
+    def test_handler_cache_control_is_kept(self, client):
+        response = client.get("/api/customers/1/portfolio", headers={"X-API-Key": API_KEY})
+        assert response.headers["Cache-Control"] == "private, max-age=30"
+        assert response.headers["Pragma"] == "no-cache"
+
+    def test_audit_record_names_endpoint(self, client):
+        with patch('simplebank.utils.security_deps.audit_pipeline') as mock_pipeline:
+            client.get("/api/customers/1", headers={"X-API-Key": API_KEY, "X-Request-ID": "abc"})
+        record = mock_pipeline.emit.call_args.args[0]
+        assert record["operation"] == "read_customer"
+        assert record["status"] == 200
+        assert record["path"] == "/api/customers/1"
+
+class TestOutboxEvents:
+    @pytest.fixture(autouse=True)
+    def outbox_settings(self, monkeypatch):
+        from simplebank.utils import outbox
+        monkeypatch.setattr(outbox, "OUTBOX_VISIBILITY_LAG", 0)
+        monkeypatch.setattr(outbox, "OUTBOX_WEBHOOK_HOSTS", {"hooks.local"})
+
+    def add_transfers(self, count):
+        from simplebank.utils.outbox import transaction_created_event
+        db = TestingSessionLocal()
+        for i in range(count):
+            tx = models.Transaction(from_account_id=1, to_account_id=2, amount=10.0 + i)
+            db.add_all([tx, transaction_created_event(tx)])
+        db.commit()
+        db.close()
+
+    def test_read_events_after_offset(self, client):
+        self.add_transfers(3)
+        headers = {"X-API-Key": API_KEY}
+        data = client.get("/api/events?after=0&limit=2", headers=headers).json()
+        assert [event["data"]["amount"] for event in data["items"]] == [10.0, 11.0]
+        assert data["items"][0]["event_type"] == "transaction.created"
+        assert data["items"][0]["transaction_id"] is not None
+
+        data2 = client.get(f"/api/events?after={data['next_after']}", headers=headers).json()
+        assert [event["data"]["amount"] for event in data2["items"]] == [12.0]
+
+    def test_pull_consumer_resumes_from_acknowledged_offset(self, client):
+        self.add_transfers(2)
+        headers = {"X-API-Key": API_KEY}
+        assert client.post("/api/events/consumers", json={"name": "fraud"}, headers=headers).status_code == 200
+
+        batch = client.get("/api/events?consumer=fraud", headers=headers).json()
+        assert len(batch["items"]) == 2
+        # Unacknowledged events are delivered again (at-least-once)
+        assert client.get("/api/events?consumer=fraud", headers=headers).json() == batch
+
+        first_id = batch["items"][0]["id"]
+        client.post("/api/events/consumers/fraud/ack", json={"event_id": first_id}, headers=headers)
+        batch = client.get("/api/events?consumer=fraud", headers=headers).json()
+        assert [event["id"] for event in batch["items"]] == [first_id + 1]
+
+    def test_dispatcher_advances_offset_only_on_success(self, client):
+        import asyncio
+        from simplebank.utils.outbox import OutboxDispatcher
+        self.add_transfers(3)
+        db = TestingSessionLocal()
+        db.add(models.EventConsumer(name="notify", webhook_url="http://hooks.local/notify", offset=0))
+        db.commit()
+        db.close()
+
+        deliveries = []
+        async def failing_post(url, events):
+            return False
+        async def post(url, events):
+            deliveries.append((url, [event.id for event in events]))
+            return True
+
+        dispatcher = OutboxDispatcher(TestingSessionLocal, post=failing_post, batch_size=2)
+        assert asyncio.run(dispatcher.dispatch_once()) == 0
+
+        dispatcher.post = post
+        assert asyncio.run(dispatcher.dispatch_once()) == 2
+        assert asyncio.run(dispatcher.dispatch_once()) == 1
+        assert asyncio.run(dispatcher.dispatch_once()) == 0
+        assert [ids for _, ids in deliveries] == [[1, 2], [3]]
+
+        db = TestingSessionLocal()
+        assert db.get(models.EventConsumer, "notify").offset == 3
+        db.close()
+
+    def test_reading_stops_at_events_that_may_have_committed_out_of_order(self, client):
+        from simplebank.utils.outbox import fetch_events
+        self.add_transfers(3)
+        db = TestingSessionLocal()
+        # The second event drew its id first but is still recent: nothing after it is read yet
+        db.get(models.OutboxEvent, 2).created_at = datetime.utcnow() + timedelta(seconds=10)
+        db.commit()
+        assert [event.id for event in fetch_events(db, 0, lag=0)] == [1]
+        assert fetch_events(db, 0, lag=60) == []
+        assert [event.id for event in fetch_events(db, 0, lag=-60)] == [1, 2, 3]
+        db.close()
+
+    def test_webhook_consumers_need_admin_and_an_allowed_host(self, client):
+        headers = {"X-API-Key": API_KEY}
+        response = client.post("/api/api-keys", json={"name": "reader", "scopes": ["read", "write"]}, headers=headers)
+        limited = {"X-API-Key": response.json()["api_key"]}
+        body = {"name": "notify", "webhook_url": "https://hooks.local/notify"}
+        assert client.post("/api/events/consumers", json=body, headers=limited).status_code == 403
+        for url in ("http://169.254.169.254/latest", "file:///etc/passwd", "https://hooks.local.evil.com/"):
+            response = client.post("/api/events/consumers", json={**body, "webhook_url": url}, headers=headers)
+            assert response.status_code == 400
+        assert client.post("/api/events/consumers", json=body, headers=headers).status_code == 200
+
+class TestBalanceStream:
+    def test_subscriber_keeps_only_latest_update(self):
+        import asyncio
+        from simplebank.utils.pubsub import PubSub
+
+        async def scenario():
+            pubsub = PubSub()
+            subscription = pubsub.subscribe(1)
+            assert pubsub.publish(1, {"event_id": 1, "balance": 10.0}) == 1
+            assert pubsub.publish(1, {"event_id": 2, "balance": 20.0}) == 1
+            assert pubsub.publish(2, {"event_id": 3, "balance": 30.0}) == 0
+            latest = await subscription.next(timeout=0.1)
+            idle = await subscription.next(timeout=0.01)
+            pubsub.unsubscribe(subscription)
+            return latest, idle, pubsub.subscriber_count()
+
+        latest, idle, remaining = asyncio.run(scenario())
+        assert latest == {"event_id": 2, "balance": 20.0}
+        assert idle is None
+        assert remaining == 0
+
+    def test_sse_stream_replays_then_sends_live_updates_and_heartbeats(self):
+        import asyncio
+        from simplebank.utils.pubsub import PubSub, sse_stream
+
+        async def scenario():
+            pubsub = PubSub()
+            subscription = pubsub.subscribe(7)
+            stream = sse_stream(subscription, pubsub, [{"event_id": 4, "balance": 1.0}], heartbeat=0.01)
+            chunks = [await stream.__anext__()]
+            chunks.append(await stream.__anext__())  # Idle: heartbeat
+            pubsub.publish(7, {"event_id": 3, "balance": 0.5})  # Already replayed: skipped
+            chunks.append(await stream.__anext__())
+            pubsub.publish(7, {"event_id": 5, "balance": 2.0})
+            chunks.append(await stream.__anext__())
+            await stream.aclose()
+            return chunks, pubsub.subscriber_count(7)
+
+        chunks, remaining = asyncio.run(scenario())
+        assert chunks[0] == 'id: 4\nevent: balance\ndata: {"event_id":4,"balance":1.0}\n\n'
+        assert chunks[1] == chunks[2] == ": heartbeat\n\n"
+        assert chunks[3].startswith("id: 5\n")
+        assert remaining == 0
+
+    def test_feed_forwards_changes_committed_by_other_workers(self, client):
+        from simplebank.utils.balance_audit import BalanceChangeFeed
+        feed = BalanceChangeFeed([TestingSessionLocal], lag=5)
+        assert feed.poll([1]) == []  # Starts at the latest change
+
+        db = TestingSessionLocal()
+        now = datetime.utcnow()
+        db.add_all([
+            models.BalanceChange(day=now.date(), timestamp=now - timedelta(seconds=10), account_id=1,
+                                 balance_before=5000.0, balance_after=5001.0),
+            models.BalanceChange(day=now.date(), timestamp=now - timedelta(seconds=10), account_id=2,
+                                 balance_before=10000.0, balance_after=9999.0),
+            models.BalanceChange(day=now.date(), timestamp=now, account_id=1,
+                                 balance_before=5001.0, balance_after=5002.0),
+        ])
+        db.commit()
+        db.close()
+        # Only streamed accounts, and not the change young enough to have a late-committing predecessor
+        assert [m["balance"] for m in feed.poll([1])] == [5001.0]
+        feed.lag = 0
+        assert [m["balance"] for m in feed.poll([1])] == [5002.0]
+        assert feed.poll([1]) == []
+
+    def test_backlog_resumes_after_last_event_id(self, client):
+        from simplebank.api.accounts import _balance_stream_backlog
+        db = TestingSessionLocal()
+        now = datetime.utcnow()
+        db.add_all([
+            models.BalanceChange(day=now.date(), timestamp=now, account_id=1,
+                                 balance_before=5000.0 + i, balance_after=5001.0 + i)
+            for i in range(3)
+        ])
+        db.commit()
+
+        backlog = _balance_stream_backlog(TestingSessionLocal(), 1, last_event_id=1)
+        assert [message["event_id"] for message in backlog] == [2, 3]
+        snapshot = _balance_stream_backlog(TestingSessionLocal(), 1, last_event_id=None)
+        assert snapshot == [{"event_id": 3, "account_id": 1, "balance": 5000.0}]
+        assert _balance_stream_backlog(TestingSessionLocal(), 999, last_event_id=None) is None
+        db.close()
+
+    def test_stream_unknown_account(self, client):
+        from simplebank.utils.pubsub import balance_updates
+        response = client.get("/api/accounts/999/stream", headers={"X-API-Key": API_KEY})
+        assert response.status_code == 404
+        assert balance_updates.subscriber_count(999) == 0
+
+class TestScheduledTransfers:
+    def test_cron_next_after(self):
+        from simplebank.utils.cron import CronSchedule
+        month_start = CronSchedule("0 9 1 * *")
+        assert month_start.next_after(datetime(2024, 1, 15, 10, 0)) == datetime(2024, 2, 1, 9, 0)
+        assert month_start.next_after(datetime(2024, 2, 1, 8, 59, 30)) == datetime(2024, 2, 1, 9, 0)
+        weekdays = CronSchedule("*/30 8-9 * * 1-5")
+        # Saturday 2024-01-06 -> Monday 08:00
+        assert weekdays.next_after(datetime(2024, 1, 6, 12, 0)) == datetime(2024, 1, 8, 8, 0)
+        with pytest.raises(ValueError):
+            CronSchedule("61 * * * *")
+
+    def test_create_scheduled_transfer_validation(self, client):
+        headers = {"X-API-Key": API_KEY}
+        body = {"from_account_id": 1, "to_account_id": 2, "amount": 10.0}
+        assert client.post("/api/scheduled-transfers", json=body, headers=headers).status_code == 422
+        response = client.post("/api/scheduled-transfers", json={**body, "cron": "0 0 1 * *"}, headers=headers)
+        assert response.status_code == 200
+        assert response.json()["next_run_at"].endswith("-01T00:00:00")
+
+    def test_due_transfers_run_in_chunks(self, client):
+        import asyncio
+        from simplebank.utils.scheduler import TransferScheduler
+        due_at = datetime(2024, 1, 1)
+        db = TestingSessionLocal()
+        db.add_all([
+            models.ScheduledTransfer(from_account_id=5, to_account_id=1 + i % 4, amount=100.0,
+                                     interval_seconds=86400, next_run_at=due_at)
+            for i in range(7)
+        ])
+        # Account 3 only holds 2500.0
+        db.add(models.ScheduledTransfer(from_account_id=3, to_account_id=1, amount=9999.0,
+                                        cron="0 0 1 * *", next_run_at=due_at))
+        db.commit()
+        db.close()
+
+        scheduler = TransferScheduler(TestingSessionLocal, chunk_size=3)
+        assert asyncio.run(scheduler.run_due(now=due_at)) == 8
+        assert asyncio.run(scheduler.run_due(now=due_at)) == 0
+
+        db = TestingSessionLocal()
+        assert db.get(models.Account, 5).balance == 15000.0 - 700.0
+        assert db.query(models.Transaction).filter(models.Transaction.timestamp == due_at).count() == 7
+        schedules = db.query(models.ScheduledTransfer).order_by(models.ScheduledTransfer.id).all()
+        assert {s.last_status for s in schedules[:7]} == {"ok"}
+        assert schedules[7].last_status == "failed: insufficient funds"
+        assert schedules[0].next_run_at == datetime(2024, 1, 2)
+        assert schedules[7].next_run_at == datetime(2024, 2, 1)
+        db.close()
+
+    def test_due_chunk_holds_the_sqlite_write_lock(self, tmp_path):
+        from sqlalchemy.exc import OperationalError
+        from simplebank.database import begin_write
+        from simplebank.utils.scheduler import run_due_chunk
+        file_engine = create_engine(f"sqlite:///{tmp_path}/bank.db", connect_args={"timeout": 0.1})
+        Base.metadata.create_all(bind=file_engine)
+        Session = sessionmaker(bind=file_engine)
+        scheduler_db, transfer_db = Session(), Session()
+        scheduler_db.add_all([models.Account(id=1, customer_id=1, balance=100.0),
+                              models.Account(id=2, customer_id=1, balance=0.0)])
+        scheduler_db.add(models.ScheduledTransfer(from_account_id=1, to_account_id=2, amount=80.0,
+                                                  interval_seconds=60, next_run_at=datetime(2024, 1, 1)))
+        scheduler_db.commit()
+        original_flush = scheduler_db.flush
+
+        def flush_while_a_transfer_checks_the_balance(*args, **kwargs):
+            # A transfer reading the balance now would have to wait for the chunk to commit
+            with pytest.raises(OperationalError):
+                begin_write(transfer_db)
+            transfer_db.rollback()
+            return original_flush(*args, **kwargs)
+        scheduler_db.flush = flush_while_a_transfer_checks_the_balance
+        assert run_due_chunk(scheduler_db, datetime(2024, 1, 1))[0] == 1
+        assert transfer_db.get(models.Account, 1).balance == 20.0
+        scheduler_db.close()
+        transfer_db.close()
+        file_engine.dispose()
+
+    def test_lease_is_exclusive(self, client):
+        from simplebank.utils.scheduler import acquire_lease, release_lease
+        db = TestingSessionLocal()
+        assert acquire_lease(db, "job", "worker-a", ttl=30)
+        assert not acquire_lease(db, "job", "worker-b", ttl=30)
+        assert acquire_lease(db, "job", "worker-a", ttl=30)  # Renewal
+        release_lease(db, "job", "worker-a")
+        assert acquire_lease(db, "job", "worker-b", ttl=30)
+        db.close()
+
+    def test_singleton_jobs_only_run_in_the_lease_holder(self, client):
+        import asyncio
+        from simplebank.utils.outbox import OutboxDispatcher
+        first, second = OutboxDispatcher(TestingSessionLocal), OutboxDispatcher(TestingSessionLocal)
+        rounds = []
+        for dispatcher in (first, second):
+            async def dispatch_once(dispatcher=dispatcher):
+                rounds.append(dispatcher)
+                raise asyncio.CancelledError
+
+            dispatcher.dispatch_once = dispatch_once
+        assert first.lease.held()
+        with pytest.raises(asyncio.TimeoutError):  # Waits for the lease, never dispatches
+            asyncio.run(asyncio.wait_for(second.run(), timeout=0.2))
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(first.run())
+        assert rounds == [first]
+        first.lease.release()
+        assert second.lease.held()
+        second.lease.release()
+
+class TestAccruals:
+    @pytest.fixture(autouse=True)
+    def use_test_sessions(self, monkeypatch):
+        from simplebank.api import accruals
+        monkeypatch.setattr(accruals, "accrual_session_factory", TestingSessionLocal)
+
+    def test_dry_run_reports_totals_without_writing(self, client):
+        headers = {"X-API-Key": API_KEY}
+        body = {"kind": "interest", "rate": 0.01, "house_account_id": 5, "dry_run": True}
+        response = client.post("/api/accruals", json=body, headers=headers)
+        assert response.status_code == 200
+        # Accounts 1-4 hold 5000 + 10000 + 2500 + 7500
+        assert response.json() == {"kind": "interest", "accounts": 4, "total_amount": 250.0}
+
+        db = TestingSessionLocal()
+        assert db.get(models.Account, 1).balance == 5000.0
+        db.close()
+
+    def test_interest_run_posts_transactions_in_chunks(self, client):
+        headers = {"X-API-Key": API_KEY}
+        body = {"kind": "interest", "rate": 0.01, "house_account_id": 5}
+        run = client.post("/api/accruals", json=body, headers=headers).json()
+
+        run = client.get(f"/api/accruals/{run['id']}", headers=headers).json()
+        assert run["status"] == "completed"
+        assert run["accounts_posted"] == 4
+        assert run["total_amount"] == 250.0
+
+        db = TestingSessionLocal()
+        balances = {account.id: account.balance for account in db.query(models.Account).all()}
+        assert balances == {1: 5050.0, 2: 10100.0, 3: 2525.0, 4: 7575.0, 5: 14750.0}
+        postings = db.query(models.Transaction).filter(models.Transaction.from_account_id == 5).all()
+        assert len([tx for tx in postings if tx.amount in (50.0, 100.0, 25.0, 75.0)]) == 4
+        changes = db.query(models.BalanceChange).filter(models.BalanceChange.request_id == f"accrual:{run['id']}").all()
+        assert {(c.account_id, c.balance_before, c.balance_after) for c in changes} == {
+            (1, 5000.0, 5050.0), (2, 10000.0, 10100.0), (3, 2500.0, 2525.0), (4, 7500.0, 7575.0)
+        }
+        db.close()
+
+    def test_fee_run_resumes_from_checkpoint(self, client):
+        from simplebank.utils.accrual import run_accrual_chunk, run_accrual
+        db = TestingSessionLocal()
+        run = models.AccrualRun(kind="fee", amount=3000.0, house_account_id=1)
+        db.add(run)
+        db.commit()
+        # First chunk commits, then the process "crashes"
+        assert run_accrual_chunk(db, run, chunk_size=2)
+        assert run.last_account_id == 2
+        run_id = run.id
+        db.close()
+
+        run_accrual(TestingSessionLocal, run_id, chunk_size=2)
+        db = TestingSessionLocal()
+        run = db.get(models.AccrualRun, run_id)
+        assert run.status == "completed"
+        # Accounts 2, 4 and 5 can cover the fee; account 3 (2500.0) is skipped
+        assert run.accounts_posted == 3
+        assert db.get(models.Account, 1).balance == 5000.0 + 9000.0
+        assert db.get(models.Account, 3).balance == 2500.0
+        db.close()
+
+    def test_running_run_is_claimed_once(self, client):
+        from simplebank.utils.accrual import claim_accrual_run, run_accrual_chunk, AccrualRunTakenOver
+        headers = {"X-API-Key": API_KEY}
+        db = TestingSessionLocal()
+        run = models.AccrualRun(kind="interest", rate=0.01, house_account_id=5)
+        db.add(run)
+        db.commit()
+        assert claim_accrual_run(db, run.id, "worker-a")
+        # A live run cannot be resumed (or claimed) a second time
+        assert client.post(f"/api/accruals/{run.id}/resume", headers=headers).status_code == 409
+        assert not claim_accrual_run(db, run.id, "worker-b")
+        other = TestingSessionLocal()
+        stale = other.get(models.AccrualRun, run.id)
+        assert stale.owner == "worker-a"
+
+        # Once its heartbeat lapses another worker takes it over; the old owner posts nothing more
+        db.query(models.AccrualRun).filter(models.AccrualRun.id == run.id).update(
+            {models.AccrualRun.heartbeat_at: datetime.utcnow() - timedelta(hours=1)})
+        db.commit()
+        assert claim_accrual_run(db, run.id, "worker-b")
+        with pytest.raises(AccrualRunTakenOver):
+            run_accrual_chunk(other, stale, chunk_size=2)
+        other.close()
+        assert db.query(models.Transaction).filter(models.Transaction.accrual_run_id == run.id).count() == 0
+
+        db.refresh(run)
+        assert run_accrual_chunk(db, run, chunk_size=2)
+        postings = db.query(models.Transaction).filter(models.Transaction.accrual_run_id == run.id).all()
+        assert sorted(tx.to_account_id for tx in postings) == [1, 2]
+        db.close()
+
+class TestLedger:
+    def check(self, client):
+        response = client.get("/api/ledger/check?chunk_size=100", headers={"X-API-Key": API_KEY})
+        assert response.status_code == 200
+        return response.json()
+
+    def test_seeded_and_new_accounts_are_consistent(self, client):
+        client.post("/api/accounts", json={"customer_id": 2, "initial_deposit": 42.0}, headers={"X-API-Key": API_KEY})
+        report = self.check(client)
+        assert report["accounts_checked"] == 6
+        assert report["accounts_drifted"] == 0
+        assert report["unbalanced_total"] == 0
+
+    def test_scheduled_and_accrual_postings_keep_ledger_consistent(self, client):
+        import asyncio
+        from simplebank.utils.scheduler import TransferScheduler
+        from simplebank.utils.accrual import run_accrual
+        db = TestingSessionLocal()
+        db.add(models.ScheduledTransfer(from_account_id=2, to_account_id=3, amount=123.45,
+                                        interval_seconds=3600, next_run_at=datetime(2024, 1, 1)))
+        run = models.AccrualRun(kind="interest", rate=0.015, house_account_id=5)
+        db.add(run)
+        db.commit()
+        run_id = run.id
+        db.close()
+
+        asyncio.run(TransferScheduler(TestingSessionLocal).run_due(now=datetime(2024, 1, 1)))
+        run_accrual(TestingSessionLocal, run_id, chunk_size=2)
+        report = self.check(client)
+        assert report["accounts_drifted"] == 0
+        assert report["unbalanced_total"] == 0
+
+    def test_drift_is_reported(self, client):
+        db = TestingSessionLocal()
+        db.get(models.Account, 3).balance += 10.0
+        db.commit()
+        db.close()
+        report = self.check(client)
+        assert report["accounts_drifted"] == 1
+        assert report["drifted"][0]["account_id"] == 3
+        assert report["drifted"][0]["drift"] == 10.0
+
+class TestReadReplicas:
+    @pytest.fixture
+    def replica(self, monkeypatch):
+        """A second database standing in for a lagging replica: same rows, stale customer name"""
+        replica_engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False},
+                                       poolclass=StaticPool)
+        Base.metadata.create_all(bind=replica_engine)
+        db = sessionmaker(bind=replica_engine)()
+        init_customers(db)
+        db.get(models.Customer, 1).name = "Replica Name"
+        db.commit()
+        db.close()
+        monkeypatch.setattr(replica_router, "replicas", [replica_engine])
+        monkeypatch.setattr(replica_router, "_healthy", [replica_engine])
+        monkeypatch.setattr(replica_router, "_recent_writes", {})
+        yield replica_engine
+        replica_engine.dispose()
+
+    def test_get_endpoints_read_from_replica(self, client, replica):
+        response = client.get("/api/customers/1", headers={"X-API-Key": API_KEY})
+        assert response.status_code == 200
+        assert response.json()["name"] == "Replica Name"
+
+    def test_writes_and_locking_reads_use_primary(self, client, replica):
+        db = TestingSessionLocal()
+        db.info["replica_router"] = replica_router
+        assert db.get(models.Customer, 1).name == "Replica Name"
+        locked = db.query(models.Customer).filter(models.Customer.id == 1).with_for_update().one()
+        assert locked.name != "Replica Name"
+        db.add(models.Customer(name="Primary Only"))
+        db.commit()
+        db.close()
+        db = sessionmaker(bind=replica)()
+        assert db.query(models.Customer).filter(models.Customer.name == "Primary Only").count() == 0
+        db.close()
+
+    def test_client_reads_its_own_writes(self, client, replica):
+        headers = {"X-API-Key": API_KEY}
+        response = client.post("/api/accounts", json={"customer_id": 1, "initial_deposit": 10.0}, headers=headers)
+        assert response.status_code == 200
+        # The new account (id 6) only exists on the primary
+        response = client.get("/api/accounts/6/balance", headers=headers)
+        assert response.status_code == 200
+        assert client.get("/api/customers/1", headers=headers).json()["name"] != "Replica Name"
+
+    def test_session_keeps_one_replica(self, client, replica):
+        second = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+        Base.metadata.create_all(bind=second)  # Empty: a replica far behind
+        router = ReplicaRouter([replica, second], health_check_interval=3600)
+        db = TestingSessionLocal()
+        db.info["replica_router"] = router
+        with patch.object(router, "choose", wraps=router.choose) as choose:
+            names = [db.get(models.Customer, 1).name for _ in range(2)]
+            db.expire_all()
+            assert db.query(models.Account).count() == 5
+        db.close()
+        second.dispose()
+        assert names == ["Replica Name", "Replica Name"] and choose.call_count == 1
+
+    def test_unhealthy_replica_falls_back_to_primary(self, test_db):
+        broken = create_engine("sqlite:////nonexistent/directory/replica.db")
+        router = ReplicaRouter([broken], health_check_interval=0)
+        assert router.choose() is None
+        db = TestingSessionLocal()
+        db.info["replica_router"] = router
+        assert db.get(models.Customer, 1) is not None
+        db.close()
+
+class TestSharding:
+    @pytest.fixture
+    def shards(self, tmp_path, monkeypatch):
+        """Three SQLite files behind the application's shard router"""
+        from simplebank.utils.sharding import ShardRouter, shard_router
+        router = ShardRouter.from_urls(f"sqlite:///{tmp_path}/shard{i}.db" for i in range(3))
+        router.create_all()
+        monkeypatch.setattr(shard_router, "engines", router.engines)
+        monkeypatch.setattr(shard_router, "sessions", router.sessions)
+        monkeypatch.setattr(shard_router, "_pool", None)
+        yield shard_router
+        for engine in router.engines:
+            engine.dispose()
+
+    def open_accounts(self, client):
+        headers = {"X-API-Key": API_KEY}
+        # Customers 1 and 4 share shard 1; customer 2 lives on shard 2 and customer 3 on shard 0
+        for customer_id in (1, 4, 2, 3):
+            response = client.post("/api/accounts", json={"customer_id": customer_id, "initial_deposit": 1000.0},
+                                   headers=headers)
+            assert response.status_code == 200
+
+    def balance(self, client, account_id):
+        return client.get(f"/api/accounts/{account_id}/balance", headers={"X-API-Key": API_KEY}).json()["balance"]
+
+    def test_accounts_are_placed_by_customer_and_listed_merged(self, client, shards):
+        self.open_accounts(client)
+        accounts = client.get("/api/accounts", headers={"X-API-Key": API_KEY}).json()
+        assert [(a["id"], a["customer_id"]) for a in accounts] == [(1, 1), (2, 2), (3, 3), (4, 4)]
+        assert all(shards.shard_of(a["id"]) == a["customer_id"] % 3 for a in accounts)
+        page = client.get("/api/accounts?skip=1&limit=2", headers={"X-API-Key": API_KEY}).json()
+        assert [a["id"] for a in page] == [2, 3]
+
+    def test_account_reads_go_to_the_account_shard(self, client, shards):
+        self.open_accounts(client)
+        headers = {"X-API-Key": API_KEY}
+        response = client.get("/api/accounts/4", headers=headers).json()
+        assert (response["balance"], response["customer_id"]) == (1000.0, 4)
+        assert client.get("/api/accounts/9", headers=headers).status_code == 404
+        items = client.post("/api/accounts/balances:batchGet", json={"ids": [3, 9, 1]}, headers=headers).json()["items"]
+        assert [(item["account_id"], item["found"]) for item in items] == [(3, True), (9, False), (1, True)]
+        assert [a["id"] for a in client.get("/api/customers/4/accounts", headers=headers).json()] == [4]
+        portfolio = client.get("/api/customers/2/portfolio", headers=headers).json()
+        assert [a["id"] for a in portfolio["accounts"]] == [2]
+        assert client.get("/api/accounts/9/stream", headers=headers).status_code == 404
+
+    def test_scheduler_ledger_check_and_accruals_with_shards(self, client, shards):
+        import asyncio
+        from simplebank.utils.scheduler import TransferScheduler
+        self.open_accounts(client)
+        headers = {"X-API-Key": API_KEY}
+        due_at = datetime(2024, 1, 1)
+        body = {"from_account_id": 1, "to_account_id": 2, "amount": 100.0, "interval_seconds": 86400,
+                "start_at": due_at.isoformat()}
+        assert client.post("/api/scheduled-transfers", json={**body, "to_account_id": 9},
+                           headers=headers).status_code == 404
+        assert client.post("/api/scheduled-transfers", json=body, headers=headers).status_code == 200
+        assert client.post("/api/scheduled-transfers", json={**body, "amount": 5000.0}, headers=headers).status_code == 200
+
+        assert asyncio.run(TransferScheduler(TestingSessionLocal).run_due(now=due_at)) == 2
+        assert (self.balance(client, 1), self.balance(client, 2)) == (900.0, 1100.0)
+        statuses = [s["last_status"] for s in client.get("/api/scheduled-transfers", headers=headers).json()]
+        assert statuses == ["ok", "failed: insufficient funds"]
+
+        report = client.get("/api/ledger/check", headers=headers).json()
+        assert (report["accounts_checked"], report["accounts_drifted"], report["unbalanced_total"]) == (4, 0, 0)
+        response = client.post("/api/accruals", json={"kind": "fee", "amount": 1.0, "house_account_id": 1},
+                               headers=headers)
+        assert response.status_code == 501
+
+    def test_single_and_cross_shard_transfers(self, client, shards):
+        from simplebank.utils.ledger import check_ledger
+        self.open_accounts(client)
+        headers = {"X-API-Key": API_KEY}
+        for from_id, to_id in ((1, 4), (1, 2)):  # Same shard, then shard 1 -> shard 2
+            response = client.post("/api/transactions", json={
+                "from_account_id": from_id, "to_account_id": to_id, "amount": 100.0
+            }, headers=headers)
+            assert response.json() == {"message": "Transaction created successfully"}
+        assert [self.balance(client, i) for i in (1, 2, 4)] == [800.0, 1100.0, 1100.0]
+
+        # Mirrored on the destination shard for its history, but listed once
+        transactions = client.get("/api/transactions", headers=headers).json()
+        assert [(t["from_account_id"], t["to_account_id"]) for t in transactions] == [(1, 4), (1, 2)]
+        history = client.get("/api/accounts/2/transactions", headers=headers).json()["items"]
+        assert [t["is_credit"] for t in history] == [True]
+        for shard in range(shards.count):
+            db = shards.session(shard)
+            report = check_ledger(db)
+            assert report.accounts_drifted == 0
+            assert report.unbalanced_total == 0
+            db.close()
+
+    def test_failed_credit_is_completed_by_relay(self, client, shards, monkeypatch):
+        from simplebank.utils.sharding import ShardRouter
+        self.open_accounts(client)
+
+        def unavailable(self, source, transaction_id):
+            raise ConnectionError("shard 2 unavailable")
+        with monkeypatch.context() as patched:
+            patched.setattr(ShardRouter, "apply_credit", unavailable)
+            response = client.post("/api/transactions", json={
+                "from_account_id": 1, "to_account_id": 2, "amount": 250.0
+            }, headers={"X-API-Key": API_KEY})
+        assert response.json() == {"message": "Transaction accepted, credit pending"}
+        assert (self.balance(client, 1), self.balance(client, 2)) == (750.0, 1000.0)
+
+        assert shards.relay(1) == []  # Held back until older than the outbox visibility lag
+        assert (self.balance(client, 1), self.balance(client, 2)) == (750.0, 1000.0)
+        assert len(shards.relay(1, lag=0)) == 1
+        assert shards.relay(1, lag=0) == []  # Offset moved on: nothing is credited twice
+        assert shards.apply_credit(1, 1) == []  # Idempotent on the mirror's primary key
+        assert (self.balance(client, 1), self.balance(client, 2)) == (750.0, 1250.0)
+
+    def test_missing_destination_is_compensated(self, client, shards, monkeypatch):
+        from simplebank.utils.sharding import ShardRouter
+        self.open_accounts(client)
+        with monkeypatch.context() as patched:  # Debit only
+            patched.setattr(ShardRouter, "apply_credit", lambda self, source, transaction_id: [])
+            client.post("/api/transactions", json={"from_account_id": 1, "to_account_id": 2, "amount": 250.0},
+                        headers={"X-API-Key": API_KEY})
+        db = shards.session(2)
+        db.delete(db.get(models.Account, 2))
+        db.commit()
+        db.close()
+
+        shards.relay(1, lag=0)
+        assert self.balance(client, 1) == 1000.0
+
+    def test_concurrent_transfers_cannot_overdraw(self, client, shards):
+        from concurrent.futures import ThreadPoolExecutor
+        from simplebank.utils.ledger import check_ledger
+        self.open_accounts(client)
+
+        def transfer(to_id):
+            try:
+                shards.transfer(1, to_id, 80.0)
+                return True
+            except ValueError:
+                return False
+        # Account 1 holds 1000.0: only 12 of 16 transfers fit, same-shard (4) and cross-shard (2) alike
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            assert sum(pool.map(transfer, [4, 2] * 8)) == 12
+        assert self.balance(client, 1) == 40.0
+        assert self.balance(client, 2) + self.balance(client, 4) == 2000.0 + 960.0
+        for shard in range(shards.count):
+            db = shards.session(shard)
+            report = check_ledger(db)
+            assert report.accounts_drifted == 0 and report.unbalanced_total == 0
+            db.close()
+
+    def test_concurrent_compensations_refund_once(self, client, shards, monkeypatch):
+        from concurrent.futures import ThreadPoolExecutor
+        from simplebank.utils.sharding import ShardRouter
+        self.open_accounts(client)
+        with monkeypatch.context() as patched:  # Debit only
+            patched.setattr(ShardRouter, "apply_credit", lambda self, source, transaction_id: [])
+            client.post("/api/transactions", json={"from_account_id": 1, "to_account_id": 2, "amount": 250.0},
+                        headers={"X-API-Key": API_KEY})
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            refunds = list(pool.map(lambda _: shards._compensate(1, 1), range(4)))
+        assert sum(len(messages) for messages in refunds) == 1
+        assert self.balance(client, 1) == 1000.0
+
+    def test_workers_reserve_disjoint_id_blocks(self, client, shards, monkeypatch):
+        from simplebank.utils import sharding
+        monkeypatch.setattr(sharding, "SHARD_ID_BLOCK_SIZE", 2)
+        self.open_accounts(client)  # Accounts 1 and 4 take this worker's first block of shard 1
+        other = sharding.ShardRouter(shards.engines)  # A second worker on the same shards
+        ids = [other._next_id(models.Account, 1), shards._next_id(models.Account, 1),
+               other._next_id(models.Account, 1), shards._next_id(models.Account, 1)]
+        assert ids == [7, 13, 10, 16]  # Slots 2-3 go to the other worker, 4-5 to this one
+        assert all(shards.shard_of(i) == 1 for i in ids)
+
+    def test_transfer_errors(self, client, shards):
+        self.open_accounts(client)
+        headers = {"X-API-Key": API_KEY}
+        response = client.post("/api/transactions", json={"from_account_id": 1, "to_account_id": 2, "amount": 5000.0},
+                               headers=headers)
+        assert response.status_code == 400
+        response = client.post("/api/transactions", json={"from_account_id": 1, "to_account_id": 8, "amount": 5.0},
+                               headers=headers)
+        assert response.status_code == 404
+
+class TestTransactionPartitions:
+    @pytest.fixture(autouse=True)
+    def archive_dir(self, tmp_path, monkeypatch):
+        from simplebank.utils import partitions
+        monkeypatch.setattr(partitions, "TRANSACTION_ARCHIVE_DIR", str(tmp_path))
+        yield str(tmp_path)
+        # Partition tables are not part of Base.metadata
+        db = TestingSessionLocal()
+        for month in partitions.list_partitions(db):
+            partitions.partition_table(month).drop(engine)
+        db.close()
+
+    def history(self, client, account_id, limit=10):
+        headers = {"X-API-Key": API_KEY}
+        items, cursor = [], None
+        while True:
+            url = f"/api/accounts/{account_id}/transactions?limit={limit}" + (f"&cursor={cursor}" if cursor else "")
+            page = client.get(url, headers=headers).json()
+            items += page["items"]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return items
+
+    def test_history_spans_live_table_and_partitions(self, client, sample_transactions):
+        from simplebank.utils.partitions import detach_closed_months, list_partitions
+        account_id = sample_transactions[0].from_account_id
+        before = self.history(client, account_id)
+
+        db = TestingSessionLocal()
+        moved = detach_closed_months(db, now=datetime(2024, 3, 15), hot_months=2)
+        # Sample history runs from 2023-12-31 12:00 to 2024-01-01 12:00
+        assert [m.isoformat() for m in moved] == ["2023-12-01", "2024-01-01"]
+        assert [m.isoformat() for m in list_partitions(db)] == ["2024-01-01", "2023-12-01"]
+        assert db.query(models.Transaction).filter(models.Transaction.from_account_id == account_id).count() == 0
+        db.close()
+
+        after = self.history(client, account_id)
+        assert len(after) == 25
+        assert after == before
+
+    def test_ids_of_detached_rows_are_not_reused(self, client, sample_transactions):
+        from simplebank.utils.partitions import detach_closed_months, history_high_water
+        db = TestingSessionLocal()
+        detach_closed_months(db, now=datetime(2024, 3, 15), hot_months=2)
+        high_water = history_high_water(db)
+        transaction = models.Transaction(from_account_id=1, to_account_id=2, amount=1.0)
+        db.add(transaction)
+        db.commit()
+        assert transaction.id == high_water + 1
+        db.close()
+
+    def test_detach_keeps_dependent_rows_with_foreign_keys_enforced(self, client, sample_transactions):
+        from sqlalchemy import text
+        from simplebank.utils.partitions import detach_closed_months
+        db = TestingSessionLocal()
+        transaction = db.query(models.Transaction).filter(models.Transaction.timestamp < datetime(2024, 2, 1)).first()
+        transaction_id = transaction.id
+        db.add(models.LedgerEntry(account_id=transaction.from_account_id, transaction_id=transaction_id,
+                                  amount=-transaction.amount, kind="transfer"))
+        db.commit()
+        db.execute(text("PRAGMA foreign_keys=ON"))
+        try:
+            assert detach_closed_months(db, now=datetime(2024, 3, 15), hot_months=2)
+        finally:
+            db.execute(text("PRAGMA foreign_keys=OFF"))
+        assert db.query(models.LedgerEntry).filter(models.LedgerEntry.transaction_id == transaction_id).count() == 1
+        db.close()
+
+    def test_archived_months_stay_in_statement(self, client, sample_transactions, archive_dir):
+        from simplebank.utils.partitions import detach_closed_months, archive_closed_partitions, list_partitions
+        account_id = sample_transactions[0].to_account_id
+        db = TestingSessionLocal()
+        detach_closed_months(db, now=datetime(2024, 3, 15), hot_months=2)
+        paths = archive_closed_partitions(db, now=datetime(2024, 3, 15), after_months=2, directory=archive_dir)
+        assert [p.name for p in paths] == ["transactions_2023_12.ndjson.gz"]
+        assert len(list_partitions(db)) == 1
+        db.close()
+
+        headers = {"X-API-Key": API_KEY}
+        response = client.get(f"/api/accounts/{account_id}/statement", headers=headers)
+        assert response.status_code == 200
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert len(rows) == 25
+        assert all(row["is_credit"] for row in rows)
+        assert [row["timestamp"] for row in rows] == sorted(row["timestamp"] for row in rows)
+
+        response = client.get(
+            f"/api/accounts/{account_id}/statement?format=csv&from=2023-12-31T20:00:00&to=2024-01-01T00:00:00",
+            headers=headers
+        )
+        lines = response.text.splitlines()
+        assert lines[0] == "id,timestamp,from_account_id,to_account_id,amount,is_credit"
+        assert len(lines) == 1 + 4  # 20:00, 21:00, 22:00 and 23:00 on Dec 31, read from the archive
+
+    def test_summary_and_reconcile_read_detached_and_archived_months(self, client, sample_transactions, archive_dir):
+        from simplebank.utils.partitions import detach_closed_months, archive_closed_partitions
+        from simplebank.utils.reconcile import ExternalRecord, reconcile
+        account_id = sample_transactions[0].from_account_id
+        headers = {"X-API-Key": API_KEY}
+        url = f"/api/accounts/{account_id}/summary?from=2023-12-01T00:00:00&to=2024-02-01T00:00:00"
+        before = client.get(url, headers=headers).json()
+        summary_cache.clear()
+
+        db = TestingSessionLocal()
+        with pytest.raises(ValueError):
+            detach_closed_months(db, now=datetime(2024, 3, 15), hot_months=1)
+        detach_closed_months(db, now=datetime(2024, 3, 15), hot_months=2)
+        # December goes to a file, January stays a partition
+        archive_closed_partitions(db, now=datetime(2024, 3, 15), after_months=2, directory=archive_dir)
+
+        after = client.get(url, headers=headers).json()
+        assert after == before
+        assert [p["period"] for p in after["periods"]] == ["2023-12-31", "2024-01-01"]
+        assert after["debit_count"] == 25
+
+        records = [ExternalRecord(i, account_id, -(100.0 + i), datetime(2024, 1, 1, 12) - timedelta(hours=i), None)
+                   for i in range(25)]
+        results = list(reconcile(records, [db], tolerance=30, account_ids=[account_id]))
+        db.close()
+        assert results[-1] == {"status": "summary", "matched": 25, "missing": 0, "extra": 0, "invalid": 0}
+
+    def test_pricing_survives_detach_and_archive(self, client, archive_dir):
+        from sqlalchemy import Table, Column, Integer, Float, DateTime, MetaData, inspect
+        from simplebank.utils.partitions import (
+            detach_closed_months, archive_closed_partitions, ensure_transaction_columns
+        )
+        db = TestingSessionLocal()
+        db.query(models.Transaction).delete()
+        for day in (datetime(2023, 11, 5), datetime(2023, 12, 5)):
+            db.add(models.Transaction(from_account_id=1, to_account_id=2, amount=100.0, timestamp=day,
+                                      currency="USD", credited_amount=50.0, fx_rate=0.5, fx_rate_version=1))
+        db.commit()
+        # A partition detached before transactions carried their pricing
+        Table("transactions_2023_10", MetaData(), Column("id", Integer, primary_key=True),
+              Column("from_account_id", Integer), Column("to_account_id", Integer),
+              Column("amount", Float), Column("timestamp", DateTime)).create(engine)
+        ensure_transaction_columns(engine)
+        assert {"currency", "credited_amount", "fx_rate", "fx_rate_version"} <= {
+            column["name"] for column in inspect(engine).get_columns("transactions_2023_10")
+        }
+
+        detach_closed_months(db, now=datetime(2024, 2, 15), hot_months=2)
+        archive_closed_partitions(db, now=datetime(2024, 2, 15), after_months=2, directory=archive_dir)
+        db.close()
+
+        response = client.get("/api/accounts/2/statement", headers={"X-API-Key": API_KEY})
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        # November from the archive, December from its partition
+        assert [(row["currency"], row["credited_amount"], row["fx_rate"], row["fx_rate_version"])
+                for row in rows] == [("USD", 50.0, 0.5, 1)] * 2
+
+    def test_databases_without_currency_columns_are_upgraded(self, tmp_path):
+        from sqlalchemy import inspect
+        from simplebank.utils.fx import ensure_account_currency
+        from simplebank.utils.partitions import ensure_transaction_columns
+        old_engine = create_engine(f"sqlite:///{tmp_path}/bank.db")
+        with old_engine.begin() as connection:
+            connection.exec_driver_sql("CREATE TABLE accounts (id INTEGER PRIMARY KEY, customer_id INTEGER, "
+                                       "balance FLOAT, created_at DATETIME)")
+            connection.exec_driver_sql("CREATE TABLE transactions (id INTEGER PRIMARY KEY, from_account_id INTEGER, "
+                                       "to_account_id INTEGER, amount FLOAT, timestamp DATETIME)")
+            connection.exec_driver_sql("INSERT INTO accounts VALUES (1, 1, 100.0, '2024-01-01 00:00:00')")
+            connection.exec_driver_sql("INSERT INTO transactions VALUES (1, 1, 1, 5.0, '2024-01-01 00:00:00')")
+        ensure_account_currency(old_engine)
+        ensure_transaction_columns(old_engine)
+        ensure_account_currency(old_engine)  # Idempotent
+
+        assert {"currency", "credited_amount", "fx_rate", "fx_rate_version", "accrual_run_id"} <= {
+            column["name"] for column in inspect(old_engine).get_columns("transactions")
+        }
+        db = sessionmaker(bind=old_engine)()
+        assert db.get(models.Account, 1).currency == "USD"
+        assert db.get(models.Transaction, 1).credited_amount is None
+        db.close()
+        old_engine.dispose()
+
+class TestServerLauncher:
+    def test_workers_follow_cores_unless_configured(self, monkeypatch):
+        from simplebank import server
+        monkeypatch.delenv("WEB_CONCURRENCY", raising=False)
+        assert server.worker_count() >= 1
+        monkeypatch.setenv("WEB_CONCURRENCY", "3")
+        assert server.worker_count() == 3
+        options = server.gunicorn_options()
+        assert options["workers"] == 3
+        assert options["preload_app"] is True
+        assert options["worker_class"] == "simplebank.server.BankWorker"
+
+    def test_schema_is_initialized_once_in_the_master(self, monkeypatch):
+        from simplebank import server
+        from simplebank.utils import init_db as init_module
+        calls = []
+        monkeypatch.setattr(init_module, "init_db", lambda: calls.append("schema"))
+        monkeypatch.setattr(init_module, "init_customers", lambda db: (calls.append("seed"), db.close()))
+        monkeypatch.setattr(init_module, "_bootstrapped", False)
+        assert server.gunicorn_options()["on_starting"] is server.on_starting
+        server.on_starting(None)
+        # Forked workers inherit the flag; their lifespan does not run it again
+        init_module.bootstrap()
+        assert calls == ["schema", "seed"]
+
+    def test_reload_is_refused_in_production(self):
+        from simplebank.server import check_reload
+        with pytest.raises(SystemExit):
+            check_reload(env="production", reload=True)
+        check_reload(env="production", reload=False)
+        check_reload(env="development", reload=True)
+
+class TestSingleFlight:
+    def make_app(self, calls):
+        import asyncio
+
+        async def slow_app(scope, receive, send):
+            calls.append(scope["path"])
+            await asyncio.sleep(0.05)
+            await send({"type": "http.response.start", "status": 200, "headers": [(b"etag", b"abc")]})
+            await send({"type": "http.response.body", "body": f"account {len(calls)}".encode()})
+        return slow_app
+
+    def request(self, middleware, path, query=b""):
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": query,
+                 "headers": [], "client": ("10.0.0.1", 1234), "state": {}}
+        sent = []
+
+        async def receive():
+            return {"type": "http.request"}
+
+        async def send(message):
+            sent.append(message)
+
+        async def run():
+            await middleware(scope, receive, send)
+            return sent
+        return run()
+
+    def test_concurrent_identical_reads_run_once(self):
+        import asyncio
+        from simplebank.utils.single_flight import SingleFlightMiddleware, SingleFlightStats
+        calls, stats = [], SingleFlightStats()
+        middleware = SingleFlightMiddleware(self.make_app(calls), stats=stats)
+
+        async def herd():
+            return await asyncio.gather(*(
+                self.request(middleware, "/api/accounts/1", b"expand=customer&detail_level=full")
+                for _ in range(9)
+            ), self.request(middleware, "/api/accounts/1", b"detail_level=full&expand=customer"))
+        responses = asyncio.run(herd())
+
+        assert calls == ["/api/accounts/1"]
+        assert all(sent[1]["body"] == b"account 1" for sent in responses)
+        assert all(sent[0]["headers"] == [(b"etag", b"abc")] for sent in responses)
+        assert stats.snapshot() == {"leaders": 1, "followers": 9, "bypassed": 0, "coalescing_ratio": 0.9}
+
+    def test_other_keys_and_routes_are_not_coalesced(self):
+        import asyncio
+        from simplebank.utils.single_flight import SingleFlightMiddleware, SingleFlightStats
+        calls, stats = [], SingleFlightStats()
+        middleware = SingleFlightMiddleware(self.make_app(calls), stats=stats)
+
+        async def mixed():
+            await asyncio.gather(
+                self.request(middleware, "/api/accounts/1"),
+                self.request(middleware, "/api/accounts/2"),
+                self.request(middleware, "/api/accounts/1/stream"),
+                self.request(middleware, "/api/accounts/1/stream"),
+            )
+        asyncio.run(mixed())
+        assert len(calls) == 4
+        assert stats.leaders == 2
+
+        # Sequential requests never share: nothing outlives the leader
+        asyncio.run(self.request(middleware, "/api/accounts/1"))
+        assert len(calls) == 5
+
+    def test_metrics_endpoint(self, client):
+        response = client.get("/api/metrics", headers={"X-API-Key": API_KEY})
+        assert response.status_code == 200
+        assert set(response.json()["single_flight"]) == {"leaders", "followers", "bypassed", "coalescing_ratio"}
+
+class TestAdmissionControl:
+    SLOW_QUERY = ("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+                  "SELECT count(*) FROM n")
+
+    def controller(self, **overrides):
+        from simplebank.utils.admission import AdmissionController
+        settings = dict(max_concurrency=1, limits={"write": 1, "read": 1, "bulk": 1},
+                        queue_sizes={"write": 2, "read": 2, "bulk": 1},
+                        queue_timeouts={"write": 1.0, "read": 1.0, "bulk": 0.05})
+        settings.update(overrides)
+        return AdmissionController(**settings)
+
+    def test_writes_are_admitted_before_bulk_reads(self):
+        import asyncio
+        controller = self.controller()
+        order = []
+
+        async def request(name):
+            if await controller.acquire(name):
+                order.append(name)
+                await asyncio.sleep(0.01)
+                controller.release(name)
+
+        async def scenario():
+            assert await controller.acquire("read")  # Occupies the only slot
+            waiting = [asyncio.ensure_future(request("bulk")), asyncio.ensure_future(request("write"))]
+            await asyncio.sleep(0.01)
+            controller.release("read")
+            await asyncio.gather(*waiting)
+        controller.classes["bulk"].queue_timeout = 1.0
+        asyncio.run(scenario())
+        assert order == ["write", "bulk"]
+
+    def test_full_queue_and_queue_deadline_shed_requests(self):
+        import asyncio
+        controller = self.controller()
+
+        async def scenario():
+            assert await controller.acquire("read")
+            queued = asyncio.ensure_future(controller.acquire("bulk"))
+            await asyncio.sleep(0)
+            assert not await controller.acquire("bulk")  # Queue of one is full
+            assert not await queued  # Waited past the 50ms deadline
+        asyncio.run(scenario())
+        assert controller.snapshot()["bulk"] == {"active": 0, "queued": 0, "admitted": 0, "rejected": 1, "timed_out": 1}
+
+    def test_overload_returns_503_with_retry_after(self, client, monkeypatch):
+        from simplebank.utils.admission import admission_controller
+        monkeypatch.setattr(admission_controller, "max_concurrency", 0)
+        monkeypatch.setattr(admission_controller.classes["read"], "queue_size", 0)
+        response = client.get("/api/accounts/1/balance", headers={"X-API-Key": API_KEY})
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert admission_controller.snapshot()["read"]["rejected"] >= 1
+
+    def test_metrics_report_admission_classes(self, client):
+        response = client.get("/api/metrics", headers={"X-API-Key": API_KEY})
+        assert response.status_code == 200
+        assert set(response.json()["admission"]) == {"write", "read", "bulk"}
+
+    def slow_app(self, query_engine):
+        from starlette.concurrency import run_in_threadpool
+        from sqlalchemy import text
+
+        def slow_query():
+            with query_engine.connect() as connection:
+                return connection.execute(text(self.SLOW_QUERY)).scalar()
+
+        async def app(scope, receive, send):
+            await run_in_threadpool(slow_query)
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b"done"})
+        return app
+
+    def run(self, middleware, receive):
+        import asyncio
+        scope = {"type": "http", "method": "GET", "path": "/api/accounts/1", "headers": [], "query_string": b""}
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+        asyncio.run(middleware(scope, receive, send))
+        return sent
+
+    def test_statement_timeout_is_enforced_in_sqlite(self):
+        from simplebank.database import install_statement_timeout
+        from simplebank.utils.admission import AdmissionMiddleware
+        query_engine = create_engine("sqlite:///:memory:")
+        install_statement_timeout(query_engine)
+        middleware = AdmissionMiddleware(self.slow_app(query_engine), self.controller(), statement_timeout=0.05)
+
+        async def receive():
+            import asyncio
+            await asyncio.sleep(10)
+        started = time.monotonic()
+        sent = self.run(middleware, receive)
+        assert time.monotonic() - started < 5
+        assert sent[0]["status"] == 503
+
+    def test_client_disconnect_cancels_running_query(self):
+        from simplebank.database import install_statement_timeout
+        from simplebank.utils.admission import AdmissionMiddleware
+        query_engine = create_engine("sqlite:///:memory:")
+        install_statement_timeout(query_engine)
+        controller = self.controller()
+        middleware = AdmissionMiddleware(self.slow_app(query_engine), controller, statement_timeout=0)
+
+        async def receive():
+            import asyncio
+            await asyncio.sleep(0.05)
+            return {"type": "http.disconnect"}
+        started = time.monotonic()
+        assert self.run(middleware, receive) == []
+        assert time.monotonic() - started < 5
+        assert controller.active == 0
+
+    def test_postgres_timeout_is_set_per_request_transaction(self):
+        from unittest.mock import MagicMock
+        from simplebank.database import QueryBudget, current_query_budget, _set_local_statement_timeout
+        conn = MagicMock()
+        _set_local_statement_timeout(conn)  # Background job: no budget, no limit
+        token = current_query_budget.set(QueryBudget(2.5))
+        try:
+            _set_local_statement_timeout(conn)
+        finally:
+            current_query_budget.reset(token)
+        conn.exec_driver_sql.assert_called_once_with("SET LOCAL statement_timeout = 2500")
+
+class TestCustomerSearch:
+    def add_customers(self, *names):
+        db = TestingSessionLocal()
+        try:
+            db.add_all(models.Customer(name=name) for name in names)
+            db.commit()
+        finally:
+            db.close()
+
+    def search(self, client, **params):
+        response = client.get("/api/customers/search", params=params, headers={"X-API-Key": API_KEY})
+        assert response.status_code == 200
+        return response.json()
+
+    def test_prefix_search_matches_word_prefixes(self, client):
+        self.add_customers("Brandon Gibbs")
+        names = [item["name"] for item in self.search(client, q="bra gib")["items"]]
+        assert sorted(names) == ["Branden Gibson", "Brandon Gibbs"]
+        assert self.search(client, q="zzz")["items"] == []
+
+    def test_postgres_prefix_search_anchors_each_word(self):
+        from simplebank.utils.search import search_customers
+        db = MagicMock()
+        db.get_bind.return_value.dialect.name = "postgresql"
+        db.execute.return_value.all.return_value = []
+        assert search_customers(db, "bra gib") == []
+        statement, params = db.execute.call_args.args
+        assert "name ~* ('\\m' || :word_0) AND name ~* ('\\m' || :word_1)" in str(statement)
+        assert (params["word_0"], params["word_1"]) == ("bra", "gib")
+        assert search_customers(db, "%%") == []
+        assert db.execute.call_count == 1
+
+    def test_index_follows_created_and_renamed_customers(self, client):
+        response = client.post("/api/customers", json={"name": "Zelda Quartermaine"}, headers={"X-API-Key": API_KEY})
+        assert response.status_code == 200
+        assert [item["name"] for item in self.search(client, q="quarter")["items"]] == ["Zelda Quartermaine"]
+
+        db = TestingSessionLocal()
+        customer = db.query(models.Customer).filter(models.Customer.name == "Zelda Quartermaine").one()
+        customer.name = "Zelda Moon"
+        db.commit()
+        db.close()
+        assert self.search(client, q="quarter")["items"] == []
+        assert len(self.search(client, q="moon")["items"]) == 1
+
+    def test_fuzzy_search_tolerates_typos(self, client):
+        items = self.search(client, q="Rhnda Curch", fuzzy=True)["items"]
+        assert items[0]["name"] == "Rhonda Church"
+
+    def test_results_are_keyset_paginated(self, client):
+        self.add_customers(*(f"Pagination Person{i}" for i in range(7)))
+        seen, cursor = [], None
+        while True:
+            params = {"q": "pagination", "limit": 3}
+            if cursor:
+                params["cursor"] = cursor
+            page = self.search(client, **params)
+            seen += [item["id"] for item in page["items"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert len(seen) == 7 and len(set(seen)) == 7
+
+    def test_search_route_does_not_shadow_customer_lookup(self, client):
+        response = client.get("/api/customers/1", headers={"X-API-Key": API_KEY})
+        assert response.json()["name"] == "Arisha Barron"
+        assert client.get("/api/customers/search", headers={"X-API-Key": API_KEY}).status_code == 422
+
+class TestVelocityRules:
+    def rules(self, **overrides):
+        from simplebank.utils.velocity import VelocityRules
+        settings = dict(limits={"minute": (3, 1000.0), "hour": (0, 1500.0), "day": (0, 0.0)},
+                        mean_multiplier=5, min_history=3)
+        settings.update(overrides)
+        return VelocityRules(**settings)
+
+    def test_count_and_amount_limits_per_window(self):
+        from simplebank.utils.velocity import TransferRejected
+        rules, now = self.rules(mean_multiplier=0), datetime(2026, 1, 1, 12, 0, 0)
+        for second in range(3):
+            rules.admit(1, 100.0, now + timedelta(seconds=second))
+        with pytest.raises(TransferRejected) as rejected:
+            rules.admit(1, 100.0, now + timedelta(seconds=3))
+        assert rejected.value.rule == "minute_count" and rejected.value.status_code == 429
+        # The minute window has moved on, the hour still holds the first transfers
+        rules.admit(1, 900.0, now + timedelta(minutes=2))
+        with pytest.raises(TransferRejected) as rejected:
+            rules.admit(1, 500.0, now + timedelta(minutes=4))
+        assert rejected.value.rule == "hour_amount"
+        rules.admit(1, 500.0, now + timedelta(hours=2))
+        rules.admit(2, 100.0, now)  # Other accounts are unaffected
+
+    def test_amount_far_above_rolling_mean_is_blocked(self):
+        from simplebank.utils.velocity import TransferRejected
+        rules, now = self.rules(limits={}), datetime(2026, 1, 1, 12, 0, 0)
+        rules.admit(1, 5000.0, now)  # Too little history to judge
+        rules.hydrate(2, [(now - timedelta(hours=hours), 20.0) for hours in range(1, 4)])
+        with pytest.raises(TransferRejected) as rejected:
+            rules.admit(2, 101.0, now)
+        assert rejected.value.rule == "amount_anomaly" and rejected.value.status_code == 403
+        rules.admit(2, 99.0, now)
+
+    def test_cancelled_reservations_do_not_count(self):
+        rules, now = self.rules(mean_multiplier=0), datetime(2026, 1, 1, 12, 0, 0)
+        for _ in range(10):
+            rules.cancel(rules.admit(1, 400.0, now))
+        assert rules._accounts[1].windows["minute"].totals((now - datetime(1970, 1, 1)).total_seconds()) == (0, 0.0)
+
+    def test_hydrates_from_recent_transactions(self, test_db):
+        from simplebank.utils.velocity import load_recent_transfers
+        db = TestingSessionLocal()
+        now = datetime.utcnow()
+        db.add_all([
+            models.Transaction(from_account_id=1, to_account_id=2, amount=300.0, timestamp=now - timedelta(seconds=5)),
+            models.Transaction(from_account_id=1, to_account_id=2, amount=300.0, timestamp=now - timedelta(days=2)),
+        ])
+        db.commit()
+        transfers = load_recent_transfers(db, 1)
+        db.close()
+        assert sorted(amount for _, amount in transfers) == [250.0, 300.0]  # Seeded transfer and the recent one
+        rules = self.rules(mean_multiplier=0)
+        rules.hydrate(1, transfers)
+        from simplebank.utils.velocity import TransferRejected
+        with pytest.raises(TransferRejected):
+            rules.admit(1, 500.0)  # 550 already sent within the minute
+
+    def test_check_costs_well_under_a_millisecond(self):
+        rules = self.rules(limits={"minute": (0, 0.0), "hour": (0, 0.0), "day": (0, 0.0)})
+        started = time.perf_counter()
+        for i in range(1000):
+            rules.admit(i % 50, 10.0)
+        assert (time.perf_counter() - started) / 1000 < 0.001
+
+    def test_transfer_endpoint_enforces_rules(self, client, tmp_path, monkeypatch):
+        from simplebank.utils.sharding import ShardRouter, shard_router
+        router = ShardRouter.from_urls([f"sqlite:///{tmp_path}/shard0.db"])
+        router.create_all()
+        monkeypatch.setattr(shard_router, "engines", router.engines)
+        monkeypatch.setattr(shard_router, "sessions", router.sessions)
+        monkeypatch.setattr(shard_router, "_pool", None)
+        monkeypatch.setattr(velocity_rules, "limits", {"minute": (2, 0.0)})
+        headers = {"X-API-Key": API_KEY}
+        for customer_id in (1, 2):
+            client.post("/api/accounts", json={"customer_id": customer_id, "initial_deposit": 1000.0}, headers=headers)
+
+        def transfer(amount):
+            return client.post("/api/transactions", json={"from_account_id": 1, "to_account_id": 2, "amount": amount},
+                               headers=headers)
+        assert transfer(5000.0).status_code == 400  # Insufficient funds: not counted
+        assert transfer(10.0).status_code == 200
+        assert transfer(10.0).status_code == 200
+        response = transfer(10.0)
+        assert response.status_code == 429
+        assert "2 transfers per minute" in response.json()["detail"]
+        router.engines[0].dispose()
+
+class TestMoneyFlowTrace:
+    DAY = datetime(2026, 3, 2)
+
+    @pytest.fixture
+    def transfers(self, test_db):
+        """1 -> 2 -> 3 -> 5 -> 1, plus a transfer 2 -> 4 made before account 2 received anything"""
+        db = TestingSessionLocal()
+        db.query(models.Transaction).delete()
+        for from_id, to_id, amount, hour in ((1, 2, 100.0, 10), (2, 3, 60.0, 11), (2, 4, 500.0, 9),
+                                             (3, 5, 30.0, 12), (5, 1, 10.0, 13)):
+            db.add(models.Transaction(from_account_id=from_id, to_account_id=to_id, amount=amount,
+                                      timestamp=self.DAY.replace(hour=hour)))
+        db.commit()
+        db.close()
+
+    def trace(self, client, account_id, **params):
+        # What the background refresher does between requests
+        transfer_graph.refresh_sources([(None, TestingSessionLocal, None)])
+        return client.get(f"/api/accounts/{account_id}/trace", params=params, headers={"X-API-Key": API_KEY})
+
+    def test_follows_funds_forward_in_time(self, client, transfers):
+        trace = self.trace(client, 1, hops=3).json()
+        assert {node["account_id"]: node["hop"] for node in trace["nodes"]} == {1: 0, 2: 1, 3: 2, 5: 3}
+        assert [(e["from_account_id"], e["to_account_id"], e["amount"]) for e in trace["edges"]] == [
+            (1, 2, 100.0), (2, 3, 60.0), (3, 5, 30.0)
+        ]
+        assert trace["nodes"][1]["first_reached"] == "2026-03-02T10:00:00"
+        assert not trace["truncated"]
+        assert [n["account_id"] for n in self.trace(client, 1, hops=1).json()["nodes"]] == [1, 2]
+        assert len(self.trace(client, 1, hops=3, since="2026-03-02T10:30:00").json()["nodes"]) == 1
+
+    def test_new_transfers_are_indexed_incrementally(self, client, transfers):
+        assert len(self.trace(client, 3, hops=2).json()["edges"]) == 2
+        db = TestingSessionLocal()
+        db.add(models.Transaction(from_account_id=1, to_account_id=4, amount=5.0, timestamp=self.DAY.replace(hour=14)))
+        db.commit()
+        db.close()
+        trace = self.trace(client, 3, hops=2).json()
+        assert [e["to_account_id"] for e in trace["edges"]] == [5, 1]
+        assert [e["to_account_id"] for e in self.trace(client, 3, hops=3).json()["edges"]] == [5, 1, 4]
+
+    def test_compaction_keeps_edges_sorted(self):
+        from simplebank.utils.flow_graph import TransferGraph
+        graph = TransferGraph(compact_edges=1)
+        db = TestingSessionLocal()
+        try:
+            Base.metadata.create_all(bind=engine)
+            db.add(models.Transaction(from_account_id=7, to_account_id=8, amount=1.0, timestamp=self.DAY))
+            db.commit()
+            graph.refresh(db)
+            db.add(models.Transaction(from_account_id=7, to_account_id=9, amount=2.0, timestamp=self.DAY.replace(hour=1)))
+            db.add(models.Transaction(from_account_id=1, to_account_id=7, amount=3.0, timestamp=self.DAY.replace(hour=2)))
+            db.commit()
+            graph.refresh(db)
+        finally:
+            db.close()
+            Base.metadata.drop_all(bind=engine)
+        assert graph.pending == {}
+        assert [edge[1] for edge in graph.csr.edges_from(7, 0.0)] == [8, 9]
+        assert [node["account_id"] for node in graph.trace(1, hops=2)["nodes"]] == [1, 7]
+
+    def test_trace_waits_for_the_background_load(self, client, transfers):
+        import asyncio
+        from simplebank.utils.flow_graph import TransferGraphRefresher
+        response = client.get("/api/accounts/1/trace", headers={"X-API-Key": API_KEY})
+        assert response.status_code == 503 and "Retry-After" in response.headers
+
+        async def one_round():
+            refresher = TransferGraphRefresher(lambda: [(None, TestingSessionLocal, None)])
+            refresher.start()
+            while not transfer_graph.ready:
+                await asyncio.sleep(0.01)
+            await refresher.stop()
+        asyncio.run(one_round())
+        response = client.get("/api/accounts/1/trace", headers={"X-API-Key": API_KEY})
+        assert len(response.json()["nodes"]) == 4
+
+    def test_edge_limit_and_unknown_account(self, client, transfers):
+        from simplebank.utils.flow_graph import TransferGraph
+        assert self.trace(client, 999).status_code == 404
+        graph = TransferGraph()
+        graph.csr = graph.csr.from_sorted([(i, 1, i + 10, 1.0, float(i)) for i in range(50)])
+        trace = graph.trace(1, hops=2, max_edges=20)
+        assert trace["truncated"] and len(trace["edges"]) == 20
+
+    def test_multi_hop_trace_over_large_graph_is_fast(self):
+        import random
+        from simplebank.utils.flow_graph import CSRGraph, TransferGraph
+        rng = random.Random(7)
+        accounts, edges = 50000, 500000
+        rows = sorted(((i, rng.randrange(accounts), rng.randrange(accounts), 1.0, rng.random() * 1e6)
+                       for i in range(edges)), key=lambda row: (row[1], row[4]))
+        graph = TransferGraph()
+        graph.csr = CSRGraph.from_sorted(rows)
+        started = time.perf_counter()
+        trace = graph.trace(rows[0][1], hops=4)
+        assert time.perf_counter() - started < 1.0
+        assert len(trace["nodes"]) > 1
+
+class TestAnalytics:
+    DAY = datetime(2026, 3, 2)
+
+    @pytest.fixture
+    def snapshot_dir(self, test_db, tmp_path):
+        from simplebank.api.analytics import get_snapshot
+        from simplebank.utils import columnar
+        directory = str(tmp_path / "analytics")
+        app.dependency_overrides[get_snapshot] = lambda: columnar.current_snapshot(directory) or get_snapshot()
+        db = TestingSessionLocal()
+        db.query(models.Transaction).delete()
+        db.commit()
+        db.close()
+        yield directory
+        del app.dependency_overrides[get_snapshot]
+
+    def add_transfers(self, *transfers):
+        db = TestingSessionLocal()
+        for from_id, to_id, amount, day in transfers:
+            db.add(models.Transaction(from_account_id=from_id, to_account_id=to_id, amount=amount,
+                                      timestamp=self.DAY + timedelta(days=day, hours=1)))
+        db.commit()
+        db.close()
+
+    def export(self, directory, **options):
+        from simplebank.utils.columnar import export_snapshot
+        return export_snapshot([("primary", TestingSessionLocal, None)], directory, **options)
+
+    def get(self, client, path, **params):
+        return client.get(f"/api/analytics/{path}", params=params, headers={"X-API-Key": API_KEY})
+
+    def test_reports_from_snapshot(self, client, snapshot_dir):
+        self.add_transfers((1, 2, 100.0, 0), (1, 3, 50.0, 0), (2, 3, 10.0, 1), (3, 1, 5.0, 2))
+        assert self.export(snapshot_dir) == 4
+
+        top = self.get(client, "top-accounts").json()
+        assert top["snapshot"]["rows"] == 4
+        assert [(a["account_id"], a["total_amount"], a["transaction_count"]) for a in top["items"]] == [
+            (1, 150.0, 2), (2, 10.0, 1), (3, 5.0, 1)
+        ]
+        received = self.get(client, "top-accounts", direction="in", by="count", limit=1).json()["items"]
+        assert [(a["account_id"], a["transaction_count"]) for a in received] == [(3, 2)]
+
+        daily = self.get(client, "daily-totals", **{"from": "2026-03-03T00:00:00"}).json()["items"]
+        assert daily == [
+            {"day": "2026-03-03", "total_amount": 10.0, "transaction_count": 1},
+            {"day": "2026-03-04", "total_amount": 5.0, "transaction_count": 1},
+        ]
+
+        distribution = self.get(client, "amount-distribution", percentiles=[50, 100], bins=4).json()
+        assert distribution["count"] == 4 and distribution["total"] == 165.0
+        assert distribution["percentiles"] == {"p50": 30.0, "p100": 100.0}
+        assert sum(b["count"] for b in distribution["histogram"]) == 4
+        assert distribution["histogram"][0]["lower"] == 5.0
+
+    def test_exports_append_segments_and_merge(self, client, snapshot_dir):
+        from simplebank.utils.columnar import read_manifest, current_snapshot
+        self.add_transfers((1, 2, 1.0, 0))
+        assert self.export(snapshot_dir, max_segments=2) == 1
+        assert self.export(snapshot_dir, max_segments=2) == 0  # Nothing new
+        self.add_transfers((1, 2, 2.0, 0))
+        assert self.export(snapshot_dir, max_segments=2) == 1
+        assert len(read_manifest(snapshot_dir)["segments"]) == 2
+        assert self.get(client, "top-accounts").json()["items"][0]["total_amount"] == 3.0
+        self.add_transfers((1, 2, 4.0, 0))
+        assert self.export(snapshot_dir, max_segments=2) == 1
+        manifest = read_manifest(snapshot_dir)
+        assert len(manifest["segments"]) == 1 and manifest["rows"] == 3
+        assert list(current_snapshot(snapshot_dir).columns["amount"]) == [1.0, 2.0, 4.0]
+        assert self.get(client, "top-accounts").json()["items"][0]["total_amount"] == 7.0
+
+    def test_unavailable_until_first_export(self, client, snapshot_dir):
+        response = self.get(client, "daily-totals")
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+        self.add_transfers((1, 2, 1.0, 0))
+        self.export(snapshot_dir)
+        assert self.get(client, "daily-totals").status_code == 200
+        assert self.get(client, "amount-distribution", percentiles=[150]).status_code == 422
+
+class TestReconciliation:
+    DAY = datetime(2026, 3, 2, 12, 0, 0)
+
+    @pytest.fixture
+    def transfers(self, test_db):
+        db = TestingSessionLocal()
+        db.query(models.Transaction).delete()
+        for from_id, to_id, amount, minutes in ((1, 3, 250.0, 0), (3, 4, 100.0, 10), (2, 5, 500.0, 20),
+                                                (4, 1, 75.5, 30)):
+            db.add(models.Transaction(from_account_id=from_id, to_account_id=to_id, amount=amount,
+                                      timestamp=self.DAY + timedelta(minutes=minutes)))
+        db.commit()
+        db.close()
+
+    def at(self, minutes, seconds=0):
+        return (self.DAY + timedelta(minutes=minutes, seconds=seconds)).isoformat()
+
+    def post(self, client, body, content_type="application/x-ndjson", **params):
+        response = client.post("/api/reconcile", content=body, params=params,
+                               headers={"X-API-Key": API_KEY, "Content-Type": content_type})
+        assert response.status_code == 200
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    def test_matches_within_tolerance_and_reports_differences(self, client, transfers):
+        records = [
+            {"account_id": 1, "amount": -250.0, "timestamp": self.at(1), "reference": "A"},  # Debit leg, 60s late
+            {"account_id": 3, "amount": 250.0, "timestamp": self.at(0, 30), "reference": "B"},  # Credit leg
+            {"account_id": 4, "amount": 100.0, "timestamp": self.at(30), "reference": "C"},  # Outside tolerance
+            {"account_id": 5, "amount": 500.0, "timestamp": self.at(20), "reference": "D"},
+            {"account_id": 5, "amount": 500.0, "timestamp": self.at(20), "reference": "E"},  # Already matched
+        ]
+        results = self.post(client, "\n".join(json.dumps(record) for record in records), tolerance=120)
+        by_reference = {r["reference"]: r for r in results if "reference" in r}
+        assert by_reference["A"]["status"] == "matched" and by_reference["A"]["delta_seconds"] == 60.0
+        assert by_reference["B"]["status"] == "matched"
+        assert by_reference["C"]["status"] == "missing"
+        assert by_reference["D"]["status"] == "matched" and by_reference["E"]["status"] == "missing"
+        extra = sorted((r["account_id"], r["amount"]) for r in results if r["status"] == "extra")
+        # Legs of the window without an external record (up to 32 minutes)
+        assert extra == [(1, 75.5), (2, -500.0), (3, -100.0), (4, -75.5), (4, 100.0)]
+        assert results[-1] == {"status": "summary", "matched": 3, "missing": 2, "extra": 5, "invalid": 0}
+
+    def test_csv_upload_with_account_filter_and_invalid_lines(self, client, transfers):
+        body = "account_id,amount,timestamp,reference\n" \
+               f"3,250.0,{self.at(0)},X1\n" \
+               "3,not-a-number,2026-03-02T12:00:00,X2\n" \
+               f"3,-100.0,{self.at(10)},X3\n"
+        results = self.post(client, body, content_type="text/csv", account_id=3, tolerance=0)
+        assert [r["status"] for r in results] == ["invalid", "matched", "matched", "summary"]
+        assert results[0]["line"] == 3
+        assert results[-1]["extra"] == 0
+
+    def test_records_out_of_order_within_a_chunk_still_match(self, test_db):
+        from simplebank.utils.reconcile import ExternalRecord, reconcile
+        db = TestingSessionLocal()
+        db.query(models.Transaction).delete()
+        db.add_all(models.Transaction(from_account_id=1, to_account_id=2, amount=1.0,
+                                      timestamp=self.DAY + timedelta(minutes=i)) for i in range(200))
+        db.commit()
+        records = [ExternalRecord(i, 2, 1.0, self.DAY + timedelta(minutes=i), str(i)) for i in range(200)]
+        for start in range(0, 200, 10):  # Reversed within each chunk of 10
+            records[start:start + 10] = reversed(records[start:start + 10])
+        results = list(reconcile(records, [db], tolerance=30, account_ids=[2], chunk_size=10))
+        db.close()
+        assert results[-1] == {"status": "summary", "matched": 200, "missing": 0, "extra": 0, "invalid": 0}
+
+    def test_file_sorted_by_account_is_merged_from_sorted_runs(self, test_db):
+        from simplebank.utils.reconcile import ExternalRecord, reconcile
+        db = TestingSessionLocal()
+        db.query(models.Transaction).delete()
+        db.add_all(models.Transaction(from_account_id=3, to_account_id=2 - i % 2, amount=1.0,
+                                      timestamp=self.DAY + timedelta(minutes=i)) for i in range(100))
+        db.commit()
+        # Every account 1 credit, then every account 2 credit: 10 runs, merged 3 at a time
+        records = [ExternalRecord(i, 2 - i % 2, 1.0, self.DAY + timedelta(minutes=i), str(i))
+                   for i in sorted(range(100), key=lambda i: (i % 2 == 0, i))]
+        results = list(reconcile(records, [db], tolerance=30, account_ids=[1, 2], chunk_size=10, fan_in=3))
+        db.close()
+        assert results[-1] == {"status": "summary", "matched": 100, "missing": 0, "extra": 0, "invalid": 0}
+
+class TestFXRates:
+    @pytest.fixture
+    def shards(self, test_db, tmp_path, monkeypatch):
+        from simplebank.utils.sharding import ShardRouter, shard_router
+        router = ShardRouter.from_urls(f"sqlite:///{tmp_path}/shard{i}.db" for i in range(3))
+        router.create_all()
+        monkeypatch.setattr(shard_router, "engines", router.engines)
+        monkeypatch.setattr(shard_router, "sessions", router.sessions)
+        monkeypatch.setattr(shard_router, "_pool", None)
+        yield shard_router
+        for engine in router.engines:
+            engine.dispose()
+
+    def test_published_tables_are_versioned_copies(self, test_db):
+        from simplebank.utils.fx import FXRateCache, RateUnavailable
+        cache = FXRateCache("USD")
+        builtin = cache.current
+        assert builtin.version is None and builtin.convert(10.0, "USD", "USD").amount == 10.0
+        db = TestingSessionLocal()
+        first = cache.publish(db, "USD", {"EUR": 0.5, "GBP": 0.8})
+        assert first.version == 1 and first.convert(100.0, "EUR", "GBP") == (1.6, 160.0, 1)
+        assert cache.publish(db, "usd", {"eur": 0.5, "gbp": 0.8}) is first  # Same rates: same version
+        second = cache.publish(db, "USD", {"EUR": 0.25})
+        assert second.version == 2 and cache.current is second
+        # A transfer still holding the old table prices from it unchanged
+        assert first.rate("USD", "EUR") == 0.5 and builtin.rates == {"USD": 1.0}
+        with pytest.raises(RateUnavailable):
+            second.rate("USD", "GBP")
+        with pytest.raises(ValueError):
+            cache.publish(db, "USD", {"EUR": -1.0})
+        # Another worker adopts the latest stored version
+        assert FXRateCache("USD").restore(db).version == 2
+        db.close()
+
+    def test_cross_currency_transfers_record_their_rate_version(self, client, shards):
+        from simplebank.utils.ledger import check_ledger
+        headers = {"X-API-Key": API_KEY}
+
+        def open_account(customer_id, currency):
+            return client.post("/api/accounts", json={"customer_id": customer_id, "initial_deposit": 1000.0,
+                                                      "currency": currency}, headers=headers)
+        assert open_account(1, "EUR").status_code == 400  # Not in the built-in table
+        response = client.post("/api/fx/rates", json={"base": "USD", "rates": {"EUR": 0.5}}, headers=headers)
+        assert response.json()["version"] == 1
+        # Account 1 (USD) and 4 (EUR) share shard 1, account 2 (EUR) is on shard 2
+        for customer_id, currency in ((1, "USD"), (4, "EUR"), (2, "EUR")):
+            assert open_account(customer_id, currency).status_code == 200
+        for to_id in (4, 2):
+            response = client.post("/api/transactions", json={"from_account_id": 1, "to_account_id": to_id,
+                                                              "amount": 100.0}, headers=headers)
+            assert response.json() == {"message": "Transaction created successfully"}
+
+        balances = {}
+        for shard in range(shards.count):
+            db = shards.session(shard)
+            balances.update({account.id: (account.balance, account.currency)
+                             for account in db.query(models.Account)})
+            for transaction in db.query(models.Transaction):
+                assert (transaction.currency, transaction.credited_amount, transaction.fx_rate,
+                        transaction.fx_rate_version) == ("USD", 50.0, 0.5, 1)
+            report = check_ledger(db)
+            assert report.accounts_drifted == 0 and report.unbalanced_total == 0
+            db.close()
+        assert balances == {1: (800.0, "USD"), 2: (1050.0, "EUR"), 4: (1050.0, "EUR")}
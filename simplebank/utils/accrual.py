@@ -0,0 +1,202 @@
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+from sqlalchemy import select, insert, update, func, cast, literal, and_, or_, Float, Numeric, Date
+from sqlalchemy.orm import Session, sessionmaker
+from simplebank.models import models
+from simplebank.utils.leases import worker_owner
+
+logger = logging.getLogger(__name__)
+
+ACCRUAL_CHUNK_SIZE = int(os.getenv("ACCRUAL_CHUNK_SIZE", "5000"))
+# A running run whose heartbeat is older than this is presumed dead and can be claimed again
+ACCRUAL_LEASE_TTL = float(os.getenv("ACCRUAL_LEASE_TTL", "300"))  # Seconds
+
+
+class AccrualRunTakenOver(RuntimeError):
+    """Another worker claimed the run while this one was executing it"""
+
+
+def claim_accrual_run(db: Session, run_id: int, owner: str, ttl: float = ACCRUAL_LEASE_TTL) -> bool:
+    """
+    Mark the run as running under `owner` in one conditional UPDATE. Fails when the
+    run is completed, or running under another owner whose heartbeat is still fresh,
+    so two workers never execute the same run.
+    """
+    run = models.AccrualRun
+    now = datetime.utcnow()
+    claimed = db.execute(update(run).where(
+        run.id == run_id,
+        run.status != "completed",
+        or_(run.status != "running", run.owner == owner,
+            run.heartbeat_at.is_(None), run.heartbeat_at < now - timedelta(seconds=ttl)),
+    ).values(status="running", owner=owner, heartbeat_at=now, error=None)).rowcount
+    db.commit()
+    return claimed == 1
+
+
+def _posting_amount(kind: str, rate: Optional[float], amount: Optional[float]):
+    """SQL expression for the amount posted to each account, rounded to cents"""
+    if kind == "interest":
+        return cast(func.round(cast(models.Account.balance * rate, Numeric), 2), Float)
+    return literal(amount, Float)
+
+
+def _eligible(kind: str, house_account_id: int, amount: Optional[float]):
+    """Accounts a run posts to: positive balances for interest, balances covering the fee"""
+    account = models.Account
+    condition = account.balance > 0 if kind == "interest" else account.balance >= amount
+    return and_(account.id != house_account_id, condition)
+
+
+def preview_accrual(db: Session, kind: str, house_account_id: int,
+                    rate: Optional[float] = None, amount: Optional[float] = None) -> Tuple[int, float]:
+    """Dry run: number of accounts and total amount a run would post, without writing"""
+    posting = _posting_amount(kind, rate, amount)
+    count, total = db.execute(
+        select(func.count(), func.coalesce(func.sum(posting), 0.0))
+        .select_from(models.Account)
+        .where(_eligible(kind, house_account_id, amount))
+    ).one()
+    return count, total
+
+
+def run_accrual_chunk(db: Session, run: models.AccrualRun, chunk_size: int = ACCRUAL_CHUNK_SIZE) -> bool:
+    """
+    Post the next chunk of accounts (by id, after the checkpoint) with set-based statements:
+    INSERT ... SELECT the transactions, balance changes and ledger entries, then one UPDATE
+    of the balances.
+    The checkpoint moves in the same commit, so a crashed run resumes exactly where it stopped.
+    The checkpoint only moves if the run is still owned by `run.owner` and still at the
+    checkpoint this chunk started from; otherwise the chunk is rolled back and
+    AccrualRunTakenOver is raised. Returns False when there are no accounts left.
+    """
+    account = models.Account
+    transaction = models.Transaction
+
+    chunk = select(account.id).where(account.id > run.last_account_id).order_by(account.id).limit(chunk_size).subquery()
+    upper = db.scalar(select(func.max(chunk.c.id)))
+    if upper is None:
+        return False
+
+    in_chunk = and_(
+        account.id > run.last_account_id,
+        account.id <= upper,
+        _eligible(run.kind, run.house_account_id, run.amount),
+    )
+    posting = _posting_amount(run.kind, run.rate, run.amount)
+    is_interest = run.kind == "interest"
+    house = literal(run.house_account_id)
+
+    # 1. One transaction per account: house -> account for interest, account -> house for fees
+    db.execute(insert(transaction).from_select(
+        ["from_account_id", "to_account_id", "amount", "timestamp", "accrual_run_id"],
+        select(
+            house if is_interest else account.id,
+            account.id if is_interest else house,
+            posting,
+            literal(run.posted_at),
+            literal(run.id),
+        ).where(in_chunk)
+    ))
+
+    # 2. Balance change audit rows, joined back to the postings of this run (balances not yet updated)
+    if is_interest:
+        posted_to_account = and_(transaction.to_account_id == account.id, transaction.from_account_id == run.house_account_id)
+        balance_after = account.balance + transaction.amount
+    else:
+        posted_to_account = and_(transaction.from_account_id == account.id, transaction.to_account_id == run.house_account_id)
+        balance_after = account.balance - transaction.amount
+    chunk_postings = and_(
+        transaction.accrual_run_id == run.id,
+        posted_to_account,
+        account.id > run.last_account_id,
+        account.id <= upper,
+    )
+    db.execute(insert(models.BalanceChange).from_select(
+        ["day", "timestamp", "account_id", "transaction_id", "balance_before", "balance_after", "request_id"],
+        select(
+            literal(run.posted_at.date(), Date),
+            literal(run.posted_at),
+            account.id,
+            transaction.id,
+            account.balance,
+            balance_after,
+            literal(f"accrual:{run.id}"),
+        ).select_from(account).join(transaction, posted_to_account).where(chunk_postings)
+    ))
+
+    # Ledger: the account side and the house side of every posting of the chunk
+    postings = select(
+        account.id.label("account_id"), transaction.id.label("transaction_id"), transaction.amount
+    ).select_from(account).join(transaction, posted_to_account).where(chunk_postings).subquery()
+    sign = 1 if is_interest else -1
+    for entry_account, entry_sign in ((postings.c.account_id, sign), (house, -sign)):
+        db.execute(insert(models.LedgerEntry).from_select(
+            ["account_id", "transaction_id", "amount", "kind", "timestamp"],
+            select(entry_account, postings.c.transaction_id, entry_sign * postings.c.amount,
+                   literal("accrual"), literal(run.posted_at))
+        ))
+
+    count, total = db.execute(
+        select(func.count(), func.coalesce(func.sum(transaction.amount), 0.0))
+        .select_from(account).join(transaction, posted_to_account).where(chunk_postings)
+    ).one()
+
+    # 3. Apply all postings of the chunk in one statement, then the house account's counterpart
+    db.execute(update(account).where(in_chunk).values(balance=account.balance + sign * posting))
+    db.execute(update(account).where(account.id == run.house_account_id).values(balance=account.balance - sign * total))
+
+    # Compare-and-set on owner and checkpoint: a worker that lost the run posts nothing
+    runs = models.AccrualRun
+    advanced = db.execute(update(runs).where(
+        runs.id == run.id,
+        runs.owner == run.owner,
+        runs.last_account_id == run.last_account_id,
+    ).values(
+        last_account_id=upper,
+        accounts_posted=runs.accounts_posted + count,
+        total_amount=runs.total_amount + total,
+        heartbeat_at=datetime.utcnow(),
+    ).execution_options(synchronize_session=False)).rowcount
+    if advanced != 1:
+        db.rollback()
+        raise AccrualRunTakenOver(f"Accrual run {run.id} was claimed by another worker")
+    db.commit()
+    db.refresh(run)
+    return True
+
+
+def run_accrual(session_factory: sessionmaker, run_id: int, chunk_size: int = ACCRUAL_CHUNK_SIZE,
+                owner: Optional[str] = None) -> None:
+    """
+    Run (or resume) an accrual run to completion, one committed chunk at a time.
+    Does nothing unless the run can be claimed for `owner` (this worker by default).
+    """
+    owner = owner or worker_owner()
+    db = session_factory()
+    try:
+        if not claim_accrual_run(db, run_id, owner):
+            return
+        run = db.get(models.AccrualRun, run_id)
+        try:
+            while run_accrual_chunk(db, run, chunk_size):
+                pass
+        except AccrualRunTakenOver as e:
+            logger.warning(str(e))
+            return
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Accrual run {run_id} failed after account {run.last_account_id}: {e}")
+            db.execute(update(models.AccrualRun).where(
+                models.AccrualRun.id == run_id, models.AccrualRun.owner == owner
+            ).values(status="failed", error=str(e)))
+            db.commit()
+            return
+        db.execute(update(models.AccrualRun).where(
+            models.AccrualRun.id == run_id, models.AccrualRun.owner == owner
+        ).values(status="completed", finished_at=datetime.utcnow()))
+        db.commit()
+    finally:
+        db.close()
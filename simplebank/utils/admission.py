@@ -0,0 +1,278 @@
+import os
+import re
+import math
+import bisect
+import asyncio
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from sqlalchemy.exc import OperationalError
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from simplebank.database import QueryBudget, current_query_budget, DB_STATEMENT_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+def _class_settings(name: str, default: str, cast=int) -> Dict[str, Any]:
+    """Parse "write=64,read=48,bulk=4" style settings"""
+    settings = {}
+    for item in os.getenv(name, default).split(","):
+        key, _, value = item.partition("=")
+        if key.strip():
+            settings[key.strip()] = cast(value)
+    return settings
+
+
+# Admitted requests per worker across all classes; keep it under the threadpool size (40)
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "32"))
+ADMISSION_LIMITS = _class_settings("ADMISSION_LIMITS", "write=32,read=24,bulk=4")
+ADMISSION_QUEUE_SIZES = _class_settings("ADMISSION_QUEUE_SIZES", "write=256,read=128,bulk=8")
+ADMISSION_QUEUE_TIMEOUTS = _class_settings("ADMISSION_QUEUE_TIMEOUTS", "write=5,read=1,bulk=2", float)  # Seconds
+# Lower value = served first when a slot frees up
+ADMISSION_PRIORITIES = {"write": 0, "read": 1, "bulk": 2}
+
+# Expensive reads (exports, unbounded lists, full scans), whatever the method
+BULK_PATHS = [re.compile(pattern) for pattern in (
+    r"^/api/accounts/\d+/statement$",
+    r"^/api/accounts/\d+/summary$",
+    r"^/api/accounts/\d+/trace$",
+    r"^/api/transactions$",
+    r"^/api/accounts$",
+    r"^/api/customers$",
+    r"^/api/ledger/",
+    r"^/api/analytics/",
+    r"^/api/reconcile$",
+    r":batchGet$",
+)]
+# Long-lived connections mostly waiting on events; they would pin slots for minutes
+EXEMPT_PATHS = [re.compile(pattern) for pattern in (
+    r"^/api/accounts/\d+/stream$",
+    r"^/api/events$",
+)]
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """Admission class of a request, or None when it is not admission-controlled"""
+    if any(pattern.match(path) for pattern in EXEMPT_PATHS):
+        return None
+    if any(pattern.search(path) for pattern in BULK_PATHS):
+        return "bulk"
+    return "read" if method in READ_METHODS else "write"
+
+
+@dataclass
+class ClassState:
+    limit: int
+    queue_size: int
+    queue_timeout: float
+    priority: int
+    active: int = 0
+    queued: int = 0
+    admitted: int = 0
+    rejected: int = 0
+    timed_out: int = 0
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    sequence: int
+    route_class: str = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class AdmissionController:
+    """
+    Per-class concurrency limits under one worker-wide cap, with bounded wait queues.
+    When a slot frees up, waiting writes are admitted before reads and reads before
+    bulk requests (FIFO within a class). A request that finds its queue full, or
+    waits longer than its class's queue timeout, is rejected.
+    """
+    def __init__(self, max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+                 limits: Dict[str, int] = ADMISSION_LIMITS,
+                 queue_sizes: Dict[str, int] = ADMISSION_QUEUE_SIZES,
+                 queue_timeouts: Dict[str, float] = ADMISSION_QUEUE_TIMEOUTS,
+                 priorities: Dict[str, int] = ADMISSION_PRIORITIES):
+        self.max_concurrency = max_concurrency
+        self.classes = {
+            name: ClassState(limit=limits[name], queue_size=queue_sizes[name],
+                             queue_timeout=queue_timeouts[name], priority=priorities[name])
+            for name in priorities
+        }
+        self.active = 0
+        self._waiters: List[_Waiter] = []  # Sorted by (priority, arrival)
+        self._sequence = itertools.count()
+
+    def _has_room(self, state: ClassState) -> bool:
+        return self.active < self.max_concurrency and state.active < state.limit
+
+    def _admit(self, state: ClassState) -> None:
+        self.active += 1
+        state.active += 1
+        state.admitted += 1
+
+    async def acquire(self, name: str) -> bool:
+        """Wait for a slot of class `name`; False when the request must be shed"""
+        state = self.classes[name]
+        # Nobody ahead with equal or higher priority: take a free slot right away
+        if self._has_room(state) and not any(w.priority <= state.priority for w in self._waiters):
+            self._admit(state)
+            return True
+        if state.queued >= state.queue_size:
+            state.rejected += 1
+            return False
+
+        waiter = _Waiter(state.priority, next(self._sequence), name, asyncio.get_running_loop().create_future())
+        bisect.insort(self._waiters, waiter)
+        state.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), state.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.future.done():  # Admitted just as the deadline passed
+                return True
+            state.timed_out += 1
+            return False
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release(name)  # Admitted, but the request went away before using the slot
+            raise
+        finally:
+            state.queued -= 1
+            if not waiter.future.done():
+                waiter.future.cancel()
+                self._waiters.remove(waiter)
+
+    def release(self, name: str) -> None:
+        self.active -= 1
+        self.classes[name].active -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        for waiter in list(self._waiters):
+            if self.active >= self.max_concurrency:
+                break
+            state = self.classes[waiter.route_class]
+            if self._has_room(state):
+                self._waiters.remove(waiter)
+                self._admit(state)
+                waiter.future.set_result(True)
+
+    def retry_after(self, name: str) -> int:
+        return max(1, math.ceil(self.classes[name].queue_timeout))
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {
+                "active": state.active, "queued": state.queued, "admitted": state.admitted,
+                "rejected": state.rejected, "timed_out": state.timed_out,
+            }
+            for name, state in self.classes.items()
+        }
+
+
+admission_controller = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """
+    Load shedding in front of the handlers.
+
+    Requests are classified (write, read, bulk) and admitted by the
+    AdmissionController; shed requests get 503 with Retry-After instead of
+    queueing without bound. Every admitted request carries a QueryBudget so its
+    database statements are limited to DB_STATEMENT_TIMEOUT, and a GET whose
+    client disconnects is cancelled along with its running SQLite statement.
+    """
+    def __init__(self, app: ASGIApp, controller: AdmissionController = admission_controller,
+                 statement_timeout: float = DB_STATEMENT_TIMEOUT):
+        self.app = app
+        self.controller = controller
+        self.statement_timeout = statement_timeout
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        name = route_class(scope["method"], scope["path"])
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.controller.acquire(name):
+            await self._overloaded(name, scope, receive, send)
+            return
+
+        budget = QueryBudget(self.statement_timeout)
+        token = current_query_budget.set(budget)
+        started = False
+
+        async def track_send(message: Message) -> None:
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                # Streamed bodies (exports, reconciliation) may query for as long as the client reads
+                budget.timeout = 0
+            await send(message)
+
+        try:
+            if scope["method"] in READ_METHODS:
+                await self._run_cancellable(scope, receive, track_send, budget)
+            else:
+                # Writes are never cancelled half-way by a disconnect
+                await self.app(scope, receive, track_send)
+        except OperationalError as e:
+            if "interrupted" not in str(e) or started or budget.cancelled.is_set():
+                raise
+            logger.warning(f"Statement timeout on {scope['method']} {scope['path']}")
+            await self._overloaded(name, scope, receive, send)
+        finally:
+            current_query_budget.reset(token)
+            self.controller.release(name)
+
+    async def _overloaded(self, name: str, scope: Scope, receive: Receive, send: Send) -> None:
+        response = JSONResponse(
+            {"detail": "Server is overloaded, please retry later"},
+            status_code=503,
+            headers={"Retry-After": str(self.controller.retry_after(name))},
+        )
+        await response(scope, receive, send)
+
+    async def _run_cancellable(self, scope: Scope, receive: Receive, send: Send, budget: QueryBudget) -> None:
+        """
+        Run the app while watching for http.disconnect. A disconnect before the response
+        is complete cancels the request; servers also report one once the response is
+        sent, which must not interrupt the handler's cleanup.
+        """
+        messages: asyncio.Queue = asyncio.Queue()
+        completed = False
+
+        async def track_completion(message: Message) -> None:
+            nonlocal completed
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                completed = True
+            await send(message)
+
+        app_task = asyncio.ensure_future(self.app(scope, messages.get, track_completion))
+
+        async def watch() -> None:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    if not completed:
+                        budget.cancelled.set()  # Aborts the SQLite statement in the worker thread
+                        app_task.cancel()
+                    return
+                await messages.put(message)
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            if not budget.cancelled.is_set():
+                raise  # Cancelled from outside (e.g. shutdown), not by the client
+        finally:
+            watcher.cancel()
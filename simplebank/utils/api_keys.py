@@ -0,0 +1,116 @@
+import os
+import time
+import hashlib
+import secrets
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, Optional, Tuple
+from sqlalchemy.orm import Session
+from simplebank.models import models
+
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", "60"))  # Seconds
+API_KEY_NEGATIVE_CACHE_TTL = float(os.getenv("API_KEY_NEGATIVE_CACHE_TTL", "10"))  # Seconds
+API_KEY_CACHE_SIZE = int(os.getenv("API_KEY_CACHE_SIZE", "10000"))
+
+ALL_SCOPES = frozenset({"read", "write", "admin"})
+
+
+@dataclass(frozen=True)
+class ApiKeyIdentity:
+    """Resolved caller of a request"""
+    key_id: str
+    scopes: FrozenSet[str]
+    rate_limit: Optional[int] = None
+
+
+def hash_api_key(raw_key: str) -> str:
+    return hashlib.sha256(raw_key.encode()).hexdigest()
+
+
+def generate_api_key() -> str:
+    """Generate a secure API key"""
+    return secrets.token_urlsafe(32)
+
+
+class ApiKeyCache:
+    """
+    In-process TTL cache from raw API key to its identity.
+    Unknown keys are cached too (negative caching, shorter TTL), so repeated
+    invalid keys do not reach the database either. A hit is a single dict lookup.
+    """
+    def __init__(self, ttl: float = API_KEY_CACHE_TTL, negative_ttl: float = API_KEY_NEGATIVE_CACHE_TTL,
+                 maxsize: int = API_KEY_CACHE_SIZE):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.maxsize = maxsize
+        self._entries: Dict[str, Tuple[float, Optional[ApiKeyIdentity]]] = {}
+
+    def get(self, raw_key: str, loader: Callable[[str], Optional[ApiKeyIdentity]]) -> Optional[ApiKeyIdentity]:
+        hit, identity = self.lookup(raw_key)
+        if hit:
+            return identity
+        identity = loader(raw_key)
+        self.store(raw_key, identity)
+        return identity
+
+    def lookup(self, raw_key: str) -> Tuple[bool, Optional[ApiKeyIdentity]]:
+        """(hit, identity) without loading; for callers that load the key off the event loop"""
+        entry = self._entries.get(raw_key)
+        if entry is not None and entry[0] > time.monotonic():
+            return True, entry[1]
+        return False, None
+
+    def store(self, raw_key: str, identity: Optional[ApiKeyIdentity]) -> None:
+        now = time.monotonic()
+        if len(self._entries) >= self.maxsize:
+            self._evict(now)
+        ttl = self.ttl if identity is not None else self.negative_ttl
+        self._entries[raw_key] = (now + ttl, identity)
+
+    def _evict(self, now: float) -> None:
+        expired = [key for key, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        # Still full: drop the oldest insertions
+        while len(self._entries) >= self.maxsize:
+            del self._entries[next(iter(self._entries))]
+
+    def invalidate(self, key_id: Optional[str] = None) -> None:
+        """Forget one key (by id) or everything, e.g. after a revocation"""
+        if key_id is None:
+            self._entries.clear()
+            return
+        for key in [k for k, (_, identity) in self._entries.items() if identity and identity.key_id == key_id]:
+            del self._entries[key]
+
+
+api_key_cache = ApiKeyCache()
+
+
+def load_api_key(db: Session, raw_key: str) -> Optional[ApiKeyIdentity]:
+    """Look up an active client key by hash (cache miss path)"""
+    api_key = db.query(models.ApiKey).filter(
+        models.ApiKey.key_hash == hash_api_key(raw_key),
+        models.ApiKey.active.is_(True)
+    ).first()
+    if api_key is None:
+        return None
+    return ApiKeyIdentity(
+        key_id=str(api_key.id),
+        scopes=frozenset(scope for scope in (api_key.scopes or "").split(",") if scope),
+        rate_limit=api_key.rate_limit,
+    )
+
+
+def create_api_key(db: Session, name: str, scopes=("read",), rate_limit: Optional[int] = None) -> Tuple[models.ApiKey, str]:
+    """Store a new client key and return it with its raw value (never stored)"""
+    raw_key = generate_api_key()
+    api_key = models.ApiKey(
+        name=name,
+        key_hash=hash_api_key(raw_key),
+        scopes=",".join(sorted(set(scopes))),
+        rate_limit=rate_limit,
+    )
+    db.add(api_key)
+    db.commit()
+    db.refresh(api_key)
+    return api_key, raw_key
@@ -0,0 +1,194 @@
+import os
+import json
+import queue
+import sqlite3
+import threading
+import logging
+from typing import Dict, List, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_QUEUE_POLICY = os.getenv("AUDIT_QUEUE_POLICY", "drop")  # "drop" or "block"
+AUDIT_BLOCK_TIMEOUT = float(os.getenv("AUDIT_BLOCK_TIMEOUT", "0.05"))  # Seconds, block policy only
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "0.5"))  # Seconds
+AUDIT_LOG_BACKEND = os.getenv("AUDIT_LOG_BACKEND", "file")  # "file" or "sqlite"
+AUDIT_LOG_PATH = os.getenv("AUDIT_LOG_PATH", "audit.log")
+AUDIT_LOG_MAX_BYTES = int(os.getenv("AUDIT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+AUDIT_LOG_BACKUP_COUNT = int(os.getenv("AUDIT_LOG_BACKUP_COUNT", "5"))
+# One file per process (audit.<pid>.log): rotation is not safe with several writers. On in production.
+AUDIT_LOG_PER_PROCESS = os.getenv("AUDIT_LOG_PER_PROCESS", "0").lower() in ("1", "true", "yes")
+
+
+class JsonLinesFileSink:
+    """
+    Append batches of records as JSON lines to a size-rotated file.
+    Rotation renames files without any lock, so only one process may write a file:
+    with `per_process` the pid of the writing process is added to the name when
+    the file is first opened (after the fork, in each worker).
+    """
+    def __init__(self, path: str, max_bytes: int = AUDIT_LOG_MAX_BYTES, backup_count: int = AUDIT_LOG_BACKUP_COUNT,
+                 per_process: bool = AUDIT_LOG_PER_PROCESS):
+        self.base_path = path
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.per_process = per_process
+        self._file = None
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        if self._file is None:
+            if self.per_process:
+                root, ext = os.path.splitext(self.base_path)
+                self.path = f"{root}.{os.getpid()}{ext}"
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+        self._file.flush()
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self) -> None:
+        self._file.close()
+        self._file = None
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SQLiteSink:
+    """Insert batches of records into an `audit_log` table of a SQLite file"""
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+
+    def write(self, records: List[Dict[str, Any]]) -> None:
+        # The connection is created lazily so it belongs to the writer thread
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS audit_log ("
+                "ts REAL, event TEXT, operation TEXT, method TEXT, path TEXT, "
+                "status INTEGER, client TEXT, duration REAL, record TEXT)"
+            )
+        self._conn.executemany(
+            "INSERT INTO audit_log VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    record.get("ts"), record.get("event"), record.get("operation"),
+                    record.get("method"), record.get("path"), record.get("status"),
+                    record.get("client"), record.get("duration"),
+                    json.dumps(record, separators=(",", ":")),
+                )
+                for record in records
+            ],
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class AuditPipeline:
+    """
+    Non-blocking audit log pipeline.
+    Request handlers only push a record dict onto a bounded queue; a background
+    thread drains it in batches and hands each batch to the sink. When the queue
+    is full records are dropped (counted in `dropped`) or, with the "block"
+    policy, the caller waits up to `block_timeout` before dropping.
+    """
+    def __init__(
+        self,
+        sink,
+        maxsize: int = AUDIT_QUEUE_SIZE,
+        policy: str = AUDIT_QUEUE_POLICY,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL,
+        block_timeout: float = AUDIT_BLOCK_TIMEOUT,
+    ):
+        if policy not in ("drop", "block"):
+            raise ValueError(f"Unknown audit queue policy: {policy}")
+        self.sink = sink
+        self.policy = policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self.dropped = 0
+        self.written = 0
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        """Queue a record without doing any I/O on the caller's thread"""
+        if self._thread is None:
+            self.start()
+        try:
+            if self.policy == "block":
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self) -> None:
+        """Flush queued records and stop the writer thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)  # Sentinel: drain and exit
+            thread.join()
+        self.sink.close()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            while True:
+                if record is None:
+                    stopping = True
+                else:
+                    batch.append(record)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                try:
+                    self.sink.write(batch)
+                    self.written += len(batch)
+                except Exception as e:
+                    logger.error(f"Failed to write {len(batch)} audit records: {e}")
+
+
+def create_sink(backend: str = AUDIT_LOG_BACKEND, path: str = AUDIT_LOG_PATH):
+    if backend == "sqlite":
+        return SQLiteSink(path)
+    return JsonLinesFileSink(path)
+
+
+audit_pipeline = AuditPipeline(create_sink())
@@ -0,0 +1,123 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+from fastapi import Request
+from sqlalchemy import func
+from sqlalchemy.orm import sessionmaker
+from simplebank.models import models
+from simplebank.utils.pubsub import PubSub, balance_updates
+
+logger = logging.getLogger(__name__)
+
+# How often each worker reads the balance changes committed by other workers for its live streams
+BALANCE_FEED_INTERVAL = float(os.getenv("BALANCE_FEED_INTERVAL", "1.0"))  # Seconds; 0 disables
+# Changes are forwarded once they are this old: one can commit after a higher id if it drew its id first
+BALANCE_FEED_LAG = float(os.getenv("BALANCE_FEED_LAG", "2.0"))  # Seconds
+BALANCE_FEED_BATCH_SIZE = 1000
+
+
+def balance_change(
+    request: Optional[Request],
+    account: models.Account,
+    balance_before: float,
+    transaction: Optional[models.Transaction] = None,
+    timestamp: Optional[datetime] = None,
+    request_id: Optional[str] = None
+) -> models.BalanceChange:
+    """
+    Build the audit row for a balance change of `account`.
+    The row is added to the caller's session so it is written in the same commit,
+    and the account/transaction ids are resolved by the ORM at flush time.
+    Background jobs pass no request and identify themselves with `request_id`.
+    """
+    timestamp = timestamp or datetime.utcnow()
+    state = getattr(request, "state", None)
+    return models.BalanceChange(
+        day=timestamp.date(),
+        timestamp=timestamp,
+        account=account,
+        transaction=transaction,
+        balance_before=balance_before,
+        balance_after=account.balance,
+        request_id=request_id or getattr(state, "request_id", None),
+        api_key_id=getattr(state, "api_key_id", None),
+    )
+
+
+def balance_update_message(change: models.BalanceChange) -> Dict[str, Any]:
+    """Live balance update published for a committed balance change"""
+    return {
+        "event_id": change.id,
+        "account_id": change.account_id,
+        "balance": change.balance_after,
+        "transaction_id": change.transaction_id,
+        "timestamp": change.timestamp.isoformat(),
+    }
+
+
+class BalanceChangeFeed:
+    """
+    Background task forwarding balance changes committed by any worker to the live
+    streams of this one. Every worker publishes its own transfers at once; the
+    feed reads `balance_changes` after the last id seen, for the accounts streamed
+    here, and publishes them too. Streams drop what they already sent by event id.
+    A change is forwarded once it is BALANCE_FEED_LAG seconds old, so the feed never
+    moves past one that commits late. `session_factories` are the primary, or
+    every shard.
+    """
+    def __init__(self, session_factories: Sequence[sessionmaker], pubsub: PubSub = balance_updates,
+                 interval: float = BALANCE_FEED_INTERVAL, lag: float = BALANCE_FEED_LAG):
+        self.session_factories = session_factories
+        self.pubsub = pubsub
+        self.interval = interval
+        self.lag = lag
+        self._last_ids: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def poll(self, accounts: List[int]) -> List[Dict[str, Any]]:
+        """Changes of `accounts` since the last poll; with no accounts, skip ahead to the latest id"""
+        change = models.BalanceChange
+        cutoff = datetime.utcnow() - timedelta(seconds=self.lag)
+        messages = []
+        for source, session_factory in enumerate(self.session_factories):
+            db = session_factory()
+            try:
+                if not accounts or source not in self._last_ids:
+                    self._last_ids[source] = db.query(func.max(change.id)).scalar() or 0
+                    continue
+                rows = db.query(change).filter(
+                    change.id > self._last_ids[source], change.account_id.in_(accounts)
+                ).order_by(change.id).limit(BALANCE_FEED_BATCH_SIZE).all()
+                for row in rows:
+                    if row.timestamp > cutoff:
+                        break
+                    self._last_ids[source] = row.id
+                    messages.append(balance_update_message(row))
+            finally:
+                db.close()
+        return messages
+
+    async def run(self) -> None:
+        while True:
+            try:
+                messages = await asyncio.to_thread(self.poll, self.pubsub.topics())
+                for message in messages:
+                    self.pubsub.publish(message["account_id"], message)
+            except Exception as e:
+                logger.error(f"Balance change feed failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -2,9 +2,11 @@ from fastapi import Request, Response
 from datetime import datetime
 from pydantic import BaseModel
 
+import os
 import json
 import hashlib
-from typing import Any
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
 
 
 
@@ -51,3 +53,43 @@ def check_conditional_request(request: Request, response: Response, data: Any):
         return True
     
     return False
+
+
+class ClosedPeriodCache:
+    """
+    Small in-process LRU for results over closed time periods.
+    A period whose end lies in the past can no longer change, so its
+    results are cached without any invalidation. The same holds for
+    history pages pinned below a transaction id high-water mark.
+    """
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:  # Caching disabled
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+# Cache for account summaries over closed periods (0 disables it)
+summary_cache = ClosedPeriodCache(maxsize=int(os.getenv("SUMMARY_CACHE_SIZE", "1024")))
+
+# Cache for history pages after the first, pinned to a high-water mark (0 disables it)
+history_page_cache = ClosedPeriodCache(maxsize=int(os.getenv("HISTORY_PAGE_CACHE_SIZE", "4096")))
+# Lifetime given to responses that can never change
+IMMUTABLE_MAX_AGE = int(os.getenv("IMMUTABLE_MAX_AGE", "31536000"))  # Seconds
+# Longest a transaction can stay uncommitted after its id is drawn: pinned pages are final this long after pinning
+HISTORY_PIN_LAG = float(os.getenv("HISTORY_PIN_LAG", "60"))  # Seconds
@@ -0,0 +1,363 @@
+"""
+Columnar snapshot of the transactions table for analytics.
+
+The exporter copies transactions into NumPy arrays stored as `.npy` files, one
+file per column, in immutable segment directories listed by `manifest.json`.
+Each export only reads rows above the id high-water mark of the previous one
+and writes them as a new segment; once there are more than
+ANALYTICS_MAX_SEGMENTS segments they are merged into one. Readers memory-map
+the segments, so reports never touch the OLTP database and share the page
+cache across workers.
+
+Usage: python -m simplebank.utils.columnar
+"""
+import os
+import json
+import shutil
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from simplebank.utils.partitions import all_transactions
+from simplebank.utils.leases import JobLease
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single exporter is assumed
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_SNAPSHOT_DIR = os.getenv("ANALYTICS_SNAPSHOT_DIR", "./analytics")
+# Seconds between exports; 0 disables the background exporter
+ANALYTICS_SNAPSHOT_INTERVAL = float(os.getenv("ANALYTICS_SNAPSHOT_INTERVAL", "300"))
+ANALYTICS_MAX_SEGMENTS = int(os.getenv("ANALYTICS_MAX_SEGMENTS", "8"))
+# Ids below the high-water mark re-read on export, for transactions committed out of id order
+ANALYTICS_ID_OVERLAP = int(os.getenv("ANALYTICS_ID_OVERLAP", "200"))
+EXPORT_BATCH_SIZE = 100000
+
+COLUMNS = {
+    "id": np.int64,
+    "from_account_id": np.int64,
+    "to_account_id": np.int64,
+    "amount": np.float64,
+    "timestamp": np.dtype("datetime64[us]"),
+}
+MANIFEST = "manifest.json"
+
+# (source name, session factory, (shard count, shard) or None)
+Source = Tuple[str, Callable[[], Session], Optional[Tuple[int, int]]]
+
+
+def _empty_manifest() -> Dict[str, Any]:
+    return {"version": 0, "segments": [], "high_water": {}, "rows": 0, "built_at": None}
+
+
+def read_manifest(directory: str = ANALYTICS_SNAPSHOT_DIR) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding="utf-8") as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return _empty_manifest()
+
+
+def _write_manifest(directory: str, manifest: Dict[str, Any]) -> None:
+    temporary = os.path.join(directory, MANIFEST + ".tmp")
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(manifest, file)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+
+
+def _write_segment(directory: str, name: str, columns: Dict[str, np.ndarray]) -> None:
+    """Columns go to a temporary directory renamed into place, so segments are never seen half-written"""
+    temporary = os.path.join(directory, name + ".tmp")
+    os.makedirs(temporary, exist_ok=True)
+    for column, values in columns.items():
+        np.save(os.path.join(temporary, f"{column}.npy"), values)
+    os.replace(temporary, os.path.join(directory, name))
+
+
+def _load_segment(directory: str, name: str) -> Dict[str, np.ndarray]:
+    return {column: np.load(os.path.join(directory, name, f"{column}.npy"), mmap_mode="r") for column in COLUMNS}
+
+
+@contextmanager
+def _export_lock(directory: str) -> Iterator[bool]:
+    """Only one exporter at a time across workers; the others skip their turn"""
+    if fcntl is None:
+        yield True
+        return
+    with open(os.path.join(directory, ".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _read_new_rows(db: Session, after_id: int, owned: Optional[Tuple[int, int]]) -> Dict[str, np.ndarray]:
+    tx = all_transactions(db).c  # Live table and month partitions
+    query = select(tx.id, tx.from_account_id, tx.to_account_id, tx.amount, tx.timestamp).where(tx.id > after_id)
+    if owned is not None:
+        query = query.where(tx.id % owned[0] == owned[1])  # Cross-shard mirrors come from their source shard
+    batches: Dict[str, List[np.ndarray]] = {column: [] for column in COLUMNS}
+    result = db.execute(query.order_by(tx.id).execution_options(yield_per=EXPORT_BATCH_SIZE))
+    for rows in result.partitions():
+        for position, (column, dtype) in enumerate(COLUMNS.items()):
+            batches[column].append(np.array([row[position] for row in rows], dtype=dtype))
+    return {column: np.concatenate(parts) if parts else np.empty(0, dtype=COLUMNS[column])
+            for column, parts in batches.items()}
+
+
+def export_snapshot(sources: Sequence[Source], directory: str = ANALYTICS_SNAPSHOT_DIR,
+                    max_segments: int = ANALYTICS_MAX_SEGMENTS, id_overlap: int = ANALYTICS_ID_OVERLAP) -> int:
+    """Append the transactions added since the last export as a new segment; returns the rows added"""
+    os.makedirs(directory, exist_ok=True)
+    with _export_lock(directory) as locked:
+        if not locked:
+            return 0
+        manifest = read_manifest(directory)
+        segment_ids = [_load_segment(directory, name)["id"] for name in manifest["segments"]]
+        ids = np.concatenate(segment_ids) if segment_ids else np.empty(0, dtype=np.int64)
+        parts: Dict[str, List[np.ndarray]] = {column: [] for column in COLUMNS}
+        for name, session_factory, owned in sources:
+            high_water = manifest["high_water"].get(name, 0)
+            floor = max(high_water - id_overlap, 0)
+            db = session_factory()
+            try:
+                rows = _read_new_rows(db, floor, owned)
+            finally:
+                db.close()
+            fresh = ~np.isin(rows["id"], ids[ids > floor])
+            for column in COLUMNS:
+                parts[column].append(rows[column][fresh])
+            if len(rows["id"]):
+                manifest["high_water"][name] = max(high_water, int(rows["id"].max()))
+
+        new_rows = {column: np.concatenate(values) for column, values in parts.items()}
+        added = len(new_rows["id"])
+        if added == 0:
+            return 0
+        manifest["version"] += 1
+        segment = f"segment_{manifest['version']:08d}"
+        _write_segment(directory, segment, new_rows)
+        manifest["segments"].append(segment)
+        manifest["rows"] += added
+        manifest["built_at"] = datetime.utcnow().isoformat()
+
+        retired: List[str] = []
+        if len(manifest["segments"]) > max_segments:
+            merged = ColumnarSnapshot.open(directory, manifest).columns
+            retired = manifest["segments"]
+            manifest["version"] += 1
+            segment = f"segment_{manifest['version']:08d}"
+            _write_segment(directory, segment, {column: np.ascontiguousarray(merged[column]) for column in COLUMNS})
+            manifest["segments"] = [segment]
+        _write_manifest(directory, manifest)
+        # Readers that still map the old files keep them until they close them
+        for name in retired:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        return added
+
+
+class ColumnarSnapshot:
+    """All segments of a manifest as one set of arrays (memory-mapped when there is a single segment)"""
+    def __init__(self, manifest: Dict[str, Any], columns: Dict[str, np.ndarray]):
+        self.manifest = manifest
+        self.columns = columns
+
+    @classmethod
+    def open(cls, directory: str = ANALYTICS_SNAPSHOT_DIR, manifest: Optional[Dict[str, Any]] = None) -> "ColumnarSnapshot":
+        manifest = manifest if manifest is not None else read_manifest(directory)
+        segments = [_load_segment(directory, name) for name in manifest["segments"]]
+        if len(segments) == 1:
+            columns = segments[0]
+        elif segments:
+            columns = {column: np.concatenate([segment[column] for segment in segments]) for column in COLUMNS}
+        else:
+            columns = {column: np.empty(0, dtype=dtype) for column, dtype in COLUMNS.items()}
+        return cls(manifest, columns)
+
+    @property
+    def rows(self) -> int:
+        return len(self.columns["id"])
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "rows": self.rows,
+            "version": self.manifest["version"],
+            "built_at": self.manifest["built_at"],
+        }
+
+    def window(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> np.ndarray:
+        """Boolean mask of the rows with start <= timestamp < end"""
+        timestamps = self.columns["timestamp"]
+        mask = np.ones(len(timestamps), dtype=bool)
+        if start is not None:
+            mask &= timestamps >= _utc(start)
+        if end is not None:
+            mask &= timestamps < _utc(end)
+        return mask
+
+
+def _utc(moment: datetime) -> np.datetime64:
+    """Timestamps are stored as naive UTC, like the database columns"""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(moment, "us")
+
+
+_current: Dict[str, ColumnarSnapshot] = {}
+_current_lock = threading.Lock()
+
+
+def current_snapshot(directory: str = ANALYTICS_SNAPSHOT_DIR) -> Optional[ColumnarSnapshot]:
+    """The latest exported snapshot, reopened only when the manifest changed; None before the first export"""
+    manifest = read_manifest(directory)
+    if not manifest["segments"]:
+        return None
+    with _current_lock:
+        snapshot = _current.get(directory)
+        if snapshot is None or snapshot.manifest["version"] != manifest["version"]:
+            try:
+                snapshot = ColumnarSnapshot.open(directory, manifest)
+            except FileNotFoundError:  # Segments merged away since the manifest was read
+                snapshot = ColumnarSnapshot.open(directory)
+            _current[directory] = snapshot
+        return snapshot
+
+
+# Reports
+
+def top_accounts(snapshot: ColumnarSnapshot, by: str = "amount", direction: str = "out", limit: int = 10,
+                 start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Accounts with the most money (or transfers) sent, received, or both"""
+    mask = snapshot.window(start, end)
+    amounts = snapshot.columns["amount"][mask]
+    sides = {"out": ["from_account_id"], "in": ["to_account_id"], "both": ["from_account_id", "to_account_id"]}[direction]
+    accounts = np.concatenate([snapshot.columns[side][mask] for side in sides])
+    amounts = np.tile(amounts, len(sides))
+    if len(accounts) == 0:
+        return []
+    account_ids, groups = np.unique(accounts, return_inverse=True)
+    totals = np.bincount(groups, weights=amounts, minlength=len(account_ids))
+    counts = np.bincount(groups, minlength=len(account_ids))
+    ranking = totals if by == "amount" else counts
+    limit = min(limit, len(account_ids))
+    top = np.argpartition(-ranking, limit - 1)[:limit]
+    top = top[np.lexsort((account_ids[top], -ranking[top]))]
+    return [
+        {"account_id": int(account_ids[i]), "total_amount": round(float(totals[i]), 2),
+         "transaction_count": int(counts[i])}
+        for i in top
+    ]
+
+
+def amount_distribution(snapshot: ColumnarSnapshot, percentiles: Sequence[float] = (50, 90, 95, 99),
+                        bins: int = 20, start: Optional[datetime] = None,
+                        end: Optional[datetime] = None) -> Dict[str, Any]:
+    """Percentiles of transfer amounts and a histogram over log-spaced bins"""
+    amounts = snapshot.columns["amount"][snapshot.window(start, end)]
+    if len(amounts) == 0:
+        return {"count": 0, "total": 0.0, "mean": None, "min": None, "max": None, "percentiles": {}, "histogram": []}
+    low, high = float(amounts.min()), float(amounts.max())
+    if low > 0 and high > low:
+        edges = np.geomspace(low, high, bins + 1)
+    else:
+        edges = np.linspace(low, high if high > low else low + 1, bins + 1)
+    counts, edges = np.histogram(amounts, bins=edges)
+    return {
+        "count": int(len(amounts)),
+        "total": round(float(amounts.sum()), 2),
+        "mean": float(amounts.mean()),
+        "min": low,
+        "max": high,
+        "percentiles": {f"p{p:g}": float(value) for p, value in zip(percentiles, np.percentile(amounts, percentiles))},
+        "histogram": [
+            {"lower": float(edges[i]), "upper": float(edges[i + 1]), "count": int(counts[i])}
+            for i in range(len(counts))
+        ],
+    }
+
+
+def daily_totals(snapshot: ColumnarSnapshot, start: Optional[datetime] = None,
+                 end: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """Transfer count and amount per UTC day, oldest first"""
+    mask = snapshot.window(start, end)
+    days = snapshot.columns["timestamp"][mask].astype("datetime64[D]")
+    if len(days) == 0:
+        return []
+    unique_days, groups = np.unique(days, return_inverse=True)
+    totals = np.bincount(groups, weights=snapshot.columns["amount"][mask], minlength=len(unique_days))
+    counts = np.bincount(groups, minlength=len(unique_days))
+    return [
+        {"day": day.item(), "total_amount": round(float(total), 2), "transaction_count": int(count)}
+        for day, total, count in zip(unique_days, totals, counts)
+    ]
+
+
+def default_sources() -> List[Source]:
+    """The primary database, or every shard when sharding is enabled"""
+    from simplebank.database import SessionLocal
+    from simplebank.utils.sharding import shard_router
+    if shard_router.enabled:
+        return [(f"shard{shard}", shard_router.sessions[shard], (shard_router.count, shard))
+                for shard in range(shard_router.count)]
+    return [("primary", SessionLocal, None)]
+
+
+class SnapshotExporter:
+    """
+    Background task refreshing the columnar snapshot every ANALYTICS_SNAPSHOT_INTERVAL seconds.
+    With a `lease`, only the worker holding it exports; the file lock still guards
+    exports run by hand.
+    """
+    def __init__(self, sources: Callable[[], Sequence[Source]] = default_sources,
+                 directory: str = ANALYTICS_SNAPSHOT_DIR, interval: float = ANALYTICS_SNAPSHOT_INTERVAL,
+                 lease: Optional[JobLease] = None):
+        self.sources = sources
+        self.directory = directory
+        self.interval = interval
+        self.lease = lease
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if self.lease is not None and not await asyncio.to_thread(self.lease.held):
+                    added = 0
+                else:
+                    added = await asyncio.to_thread(export_snapshot, self.sources(), self.directory)
+                if added:
+                    logger.info(f"Exported {added} transactions to the analytics snapshot")
+            except Exception as e:
+                logger.error(f"Analytics snapshot export failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            if self.lease is not None:
+                self.lease.release()
+
+
+if __name__ == "__main__":
+    print(f"Exported {export_snapshot(default_sources())} transactions to {ANALYTICS_SNAPSHOT_DIR}")
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+from typing import FrozenSet
+
+
+class CronSchedule:
+    """
+    Minimal five-field cron expression: minute hour day-of-month month day-of-week.
+    Each field accepts `*`, numbers, ranges (`1-5`), lists (`1,15`) and steps (`*/15`, `0-30/10`).
+    Day-of-week uses 0 (or 7) for Sunday. As in cron, when both day fields are
+    restricted a day matches if either of them does.
+    """
+    FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields, got {len(fields)}: {expression!r}")
+        self.expression = expression
+        parsed = [self._parse_field(field, low, high) for field, (low, high) in zip(fields, self.FIELD_RANGES)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self.days_restricted = fields[2] != "*"
+        self.weekdays_restricted = fields[4] != "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> FrozenSet[int]:
+        values = set()
+        for part in field.split(","):
+            part_range, _, step = part.partition("/")
+            step = int(step) if step else 1
+            if part_range == "*":
+                start, end = low, high
+            elif "-" in part_range:
+                start, end = (int(value) for value in part_range.split("-", 1))
+            else:
+                start = end = int(part_range)
+                if step != 1:
+                    end = high
+            if start < low or end > high or start > end or step < 1:
+                raise ValueError(f"Invalid cron field {field!r}")
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def _day_matches(self, day: datetime) -> bool:
+        if day.month not in self.months:
+            return False
+        day_match = day.day in self.days
+        weekday_match = (day.isoweekday() % 7) in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_match or weekday_match
+        if self.days_restricted:
+            return day_match
+        if self.weekdays_restricted:
+            return weekday_match
+        return True
+
+    def next_after(self, after: datetime) -> datetime:
+        """First matching minute strictly after `after`"""
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        # Walk day by day, then hour and minute within a matching day
+        for _ in range(366 * 5):
+            if self._day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = day.replace(hour=hour, minute=minute)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"Cron expression {self.expression!r} never matches")
@@ -0,0 +1,304 @@
+import os
+import bisect
+import asyncio
+import logging
+import threading
+from array import array
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session, sessionmaker
+from simplebank.utils.partitions import all_transactions
+
+logger = logging.getLogger(__name__)
+
+# New edges are kept in per-account lists until there are this many, then merged into the arrays
+FLOW_GRAPH_COMPACT_EDGES = int(os.getenv("FLOW_GRAPH_COMPACT_EDGES", "100000"))
+# Ids below the high-water mark re-read on refresh, for transactions committed out of id order
+FLOW_GRAPH_ID_OVERLAP = int(os.getenv("FLOW_GRAPH_ID_OVERLAP", "200"))
+# How often the background task reads new transactions into the graph
+FLOW_GRAPH_REFRESH_INTERVAL = float(os.getenv("FLOW_GRAPH_REFRESH_INTERVAL", "2"))  # Seconds
+# Edges returned by one trace at most
+FLOW_TRACE_MAX_EDGES = int(os.getenv("FLOW_TRACE_MAX_EDGES", "10000"))
+
+_EPOCH = datetime(1970, 1, 1)
+# (transaction id, to account, amount, timestamp in epoch seconds)
+Edge = Tuple[int, int, float, float]
+# (name, session factory, (shard count, shard) or None)
+Source = Tuple[Any, sessionmaker, Optional[Tuple[int, int]]]
+
+
+def _seconds(moment: datetime) -> float:
+    return (moment - _EPOCH).total_seconds()
+
+
+class CSRGraph:
+    """
+    Outgoing transfers in compressed sparse row form: the edges of account `a`
+    are positions offsets[a]..offsets[a + 1] of the edge arrays, sorted by time.
+    Immutable once built.
+    """
+    def __init__(self):
+        self.offsets = array("q", [0])
+        self.ids = array("q")
+        self.targets = array("q")
+        self.amounts = array("d")
+        self.timestamps = array("d")
+
+    @classmethod
+    def from_sorted(cls, rows: Iterable[Tuple[int, int, int, float, float]]) -> "CSRGraph":
+        """Build from (id, from, to, amount, timestamp) rows sorted by (from, timestamp)"""
+        graph, sources = cls(), array("q")
+        for transaction_id, source, target, amount, timestamp in rows:
+            sources.append(source)
+            graph.ids.append(transaction_id)
+            graph.targets.append(target)
+            graph.amounts.append(amount)
+            graph.timestamps.append(timestamp)
+        graph.offsets = array("q", [0] * ((max(sources) + 2) if sources else 1))
+        for source in sources:
+            graph.offsets[source + 1] += 1
+        for account in range(1, len(graph.offsets)):
+            graph.offsets[account] += graph.offsets[account - 1]
+        return graph
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.ids)
+
+    def edges_from(self, account_id: int, since: float) -> Iterable[Edge]:
+        if account_id + 1 >= len(self.offsets):
+            return
+        start, end = self.offsets[account_id], self.offsets[account_id + 1]
+        for position in range(bisect.bisect_left(self.timestamps, since, start, end), end):
+            yield self.ids[position], self.targets[position], self.amounts[position], self.timestamps[position]
+
+    def merged(self, pending: Dict[int, List[Edge]]) -> "CSRGraph":
+        """New graph with the pending edges added; copies whole slices of the arrays"""
+        graph = CSRGraph()
+        accounts = max(len(self.offsets) - 1, max(pending, default=-1) + 1)
+        graph.offsets = array("q", [0] * (accounts + 1))
+        for account in range(accounts):
+            if account + 1 < len(self.offsets):
+                start, end = self.offsets[account], self.offsets[account + 1]
+                graph.ids.extend(self.ids[start:end])
+                graph.targets.extend(self.targets[start:end])
+                graph.amounts.extend(self.amounts[start:end])
+                graph.timestamps.extend(self.timestamps[start:end])
+            for transaction_id, target, amount, timestamp in sorted(pending.get(account, ()), key=lambda e: e[3]):
+                graph.ids.append(transaction_id)
+                graph.targets.append(target)
+                graph.amounts.append(amount)
+                graph.timestamps.append(timestamp)
+            graph.offsets[account + 1] = len(graph.ids)
+        return graph
+
+
+class TransferGraph:
+    """
+    In-memory index of the transfer graph for money-flow tracing.
+
+    The first refresh loads every transaction of the live table and the month
+    partitions, sorted by (from_account_id, timestamp), into a CSRGraph.
+    Later refreshes only read transactions above the highest id seen and keep
+    them in small per-account lists, merged into a new CSRGraph once there are
+    FLOW_GRAPH_COMPACT_EDGES of them. With sharding each shard is a separate
+    source with its own high-water mark.
+    """
+    def __init__(self, compact_edges: int = FLOW_GRAPH_COMPACT_EDGES, id_overlap: int = FLOW_GRAPH_ID_OVERLAP):
+        self.compact_edges = compact_edges
+        self.id_overlap = id_overlap
+        self.csr = CSRGraph()
+        self.pending: Dict[int, List[Edge]] = {}
+        self.pending_count = 0
+        self._high_water: Dict[Any, int] = {}
+        self._recent_ids: Dict[Any, Set[int]] = {}
+        self.ready = False  # Every source loaded at least once
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self.csr = CSRGraph()
+            self.pending, self.pending_count = {}, 0
+            self._high_water, self._recent_ids = {}, {}
+            self.ready = False
+
+    def refresh(self, db: Session, source: Any = None, owned: Optional[Tuple[int, int]] = None) -> None:
+        """
+        Load the transactions of `db` not indexed yet. `owned` is (shard count, shard)
+        to skip the cross-shard mirrors of transfers indexed from their source shard.
+        Meant for a single refreshing task: rows are read and arrays built outside
+        the lock, which is only held to swap them in, so traces never wait on the
+        database.
+        """
+        tx = all_transactions(db).c  # Live table and month partitions
+        query = select(tx.id, tx.from_account_id, tx.to_account_id, tx.amount, tx.timestamp)
+        if owned is not None:
+            query = query.where(tx.id % owned[0] == owned[1])
+        if source not in self._high_water:
+            rows = db.execute(query.order_by(tx.from_account_id, tx.timestamp, tx.id)
+                              .execution_options(yield_per=10000))
+            self._add_initial(source, rows)
+            return
+        floor = self._high_water[source] - self.id_overlap
+        recent = self._recent_ids[source]
+        rows = db.execute(query.where(tx.id > floor).order_by(tx.id)).all()
+        with self._lock:
+            for row in rows:
+                if row.id in recent:
+                    continue
+                recent.add(row.id)
+                self.pending.setdefault(row.from_account_id, []).append(
+                    (row.id, row.to_account_id, row.amount, _seconds(row.timestamp))
+                )
+                self.pending_count += 1
+                self._high_water[source] = max(self._high_water[source], row.id)
+        floor = self._high_water[source] - self.id_overlap
+        self._recent_ids[source] = {transaction_id for transaction_id in recent if transaction_id > floor}
+        if self.pending_count >= self.compact_edges:
+            self._compact()
+
+    def _add_initial(self, source: Any, rows) -> None:
+        high_water = 0
+
+        def edges():
+            nonlocal high_water
+            for row in rows:
+                high_water = max(high_water, row.id)
+                yield row.id, row.from_account_id, row.to_account_id, row.amount, _seconds(row.timestamp)
+
+        loaded = CSRGraph.from_sorted(edges())
+        floor = high_water - self.id_overlap
+        self._recent_ids[source] = {transaction_id for transaction_id in loaded.ids if transaction_id > floor}
+        if self.csr.edge_count == 0 and not self.pending:
+            with self._lock:
+                self.csr = loaded
+                self._high_water[source] = high_water
+            return
+        # Another shard: merged like newly arrived edges
+        pending: Dict[int, List[Edge]] = {account: list(edges) for account, edges in self.pending.items()}
+        for account in range(len(loaded.offsets) - 1):
+            for position in range(loaded.offsets[account], loaded.offsets[account + 1]):
+                pending.setdefault(account, []).append(
+                    (loaded.ids[position], loaded.targets[position], loaded.amounts[position], loaded.timestamps[position])
+                )
+        merged = self.csr.merged(pending)
+        with self._lock:
+            self.csr, self.pending, self.pending_count = merged, {}, 0
+            self._high_water[source] = high_water
+
+    def _compact(self) -> None:
+        merged = self.csr.merged(self.pending)
+        with self._lock:
+            self.csr = merged
+            self.pending, self.pending_count = {}, 0
+
+    def refresh_sources(self, sources: Sequence[Source]) -> None:
+        for name, session_factory, owned in sources:
+            db = session_factory()
+            try:
+                self.refresh(db, name, owned)
+            finally:
+                db.close()
+        self.ready = True
+
+    def snapshot(self) -> Tuple[CSRGraph, Dict[int, List[Edge]]]:
+        """The arrays and pending lists as of now; compaction replaces both rather than changing them"""
+        with self._lock:
+            return self.csr, self.pending
+
+    @staticmethod
+    def _edges_from(csr: CSRGraph, pending: Dict[int, List[Edge]], account_id: int, since: float) -> List[Edge]:
+        edges = list(csr.edges_from(account_id, since))
+        edges += sorted((edge for edge in pending.get(account_id, ()) if edge[3] >= since), key=lambda e: e[3])
+        return edges
+
+    def trace(self, account_id: int, hops: int, since: Optional[datetime] = None,
+              max_edges: int = FLOW_TRACE_MAX_EDGES) -> Dict[str, Any]:
+        """
+        Breadth-first search over outgoing transfers, at most `hops` deep.
+        Funds are followed forward in time: from an account reached at time t only
+        transfers made at or after t are followed. Returns the reached accounts
+        with their hop, first arrival and total received, the transfers, and
+        whether the edge limit cut the trace short.
+        """
+        csr, pending = self.snapshot()
+        started = _seconds(since) if since is not None else float("-inf")
+        nodes = {account_id: {"account_id": account_id, "hop": 0, "first_reached": started, "received": 0.0}}
+        edges: List[Dict[str, Any]] = []
+        frontier = {account_id: started}
+        truncated = False
+        for hop in range(1, hops + 1):
+            reached: Dict[int, float] = {}
+            for source, arrived in frontier.items():
+                for transaction_id, target, amount, timestamp in self._edges_from(csr, pending, source, arrived):
+                    if len(edges) >= max_edges:
+                        truncated = True
+                        break
+                    edges.append({"transaction_id": transaction_id, "from_account_id": source,
+                                  "to_account_id": target, "amount": amount, "timestamp": timestamp, "hop": hop})
+                    if target not in nodes:
+                        nodes[target] = {"account_id": target, "hop": hop, "first_reached": timestamp, "received": 0.0}
+                        reached[target] = timestamp
+                    elif target in reached:
+                        reached[target] = min(reached[target], timestamp)
+                        nodes[target]["first_reached"] = reached[target]
+                    nodes[target]["received"] += amount
+                if truncated:
+                    break
+            if truncated or not reached:
+                break
+            frontier = reached
+
+        for item in [*nodes.values(), *edges]:
+            key = "first_reached" if "first_reached" in item else "timestamp"
+            item[key] = _EPOCH + timedelta(seconds=round(item[key], 6)) if item[key] != float("-inf") else None
+        return {"nodes": list(nodes.values()), "edges": edges, "truncated": truncated}
+
+
+transfer_graph = TransferGraph()
+
+
+def default_sources() -> List[Source]:
+    """The primary database, or every shard when sharding is enabled"""
+    from simplebank.database import SessionLocal
+    from simplebank.utils.sharding import shard_router
+    if shard_router.enabled:
+        return [(shard, shard_router.sessions[shard], (shard_router.count, shard))
+                for shard in range(shard_router.count)]
+    return [(None, SessionLocal, None)]
+
+
+class TransferGraphRefresher:
+    """
+    Background task loading, then refreshing, the transfer graph every
+    FLOW_GRAPH_REFRESH_INTERVAL seconds. Every worker keeps its own graph; traces
+    only read it, so they never build or refresh it inside a request.
+    """
+    def __init__(self, sources: Callable[[], Sequence[Source]] = default_sources,
+                 graph: TransferGraph = transfer_graph, interval: float = FLOW_GRAPH_REFRESH_INTERVAL):
+        self.sources = sources
+        self.graph = graph
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.graph.refresh_sources, self.sources())
+            except Exception as e:
+                logger.error(f"Transfer graph refresh failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,236 @@
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+import httpx
+from dataclasses import dataclass
+from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, Mapping, NamedTuple, Optional, Tuple
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from simplebank.models import models
+from simplebank.models.models import DEFAULT_CURRENCY
+from simplebank.utils.leases import JobLease
+
+logger = logging.getLogger(__name__)
+
+# JSON rate table {"base": "USD", "rates": {"EUR": 0.92, ...}}: a file path or an http(s) URL; empty disables loading
+FX_RATES_SOURCE = os.getenv("FX_RATES_SOURCE", "")
+FX_REFRESH_INTERVAL = float(os.getenv("FX_REFRESH_INTERVAL", "300"))  # Seconds
+FX_FETCH_TIMEOUT = float(os.getenv("FX_FETCH_TIMEOUT", "5.0"))  # Seconds
+FX_LEASE_NAME = "fx_rates_source"
+
+
+def ensure_account_currency(engine: Engine) -> None:
+    """Add `accounts.currency` to databases created before accounts had one; existing accounts get DEFAULT_CURRENCY"""
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if not inspector.has_table("accounts"):
+            return
+        if "currency" not in {column["name"] for column in inspector.get_columns("accounts")}:
+            default = DEFAULT_CURRENCY.replace("'", "''")
+            connection.exec_driver_sql(
+                f"ALTER TABLE accounts ADD COLUMN currency VARCHAR(3) NOT NULL DEFAULT '{default}'"
+            )
+
+
+class RateUnavailable(ValueError):
+    """No rate between two currencies in the current table"""
+
+
+class Conversion(NamedTuple):
+    rate: float
+    amount: float  # In the destination currency, rounded to cents
+    version: Optional[int]
+
+
+@dataclass(frozen=True)
+class RateTable:
+    """
+    One immutable version of the rate table: units of each currency per unit of
+    `base`. Never changed once published; a new version replaces it whole.
+    Version None is the built-in table holding only DEFAULT_CURRENCY.
+    """
+    version: Optional[int]
+    base: str
+    rates: Mapping[str, float]
+    loaded_at: Optional[datetime] = None
+
+    def supports(self, currency: str) -> bool:
+        return currency in self.rates
+
+    def rate(self, from_currency: str, to_currency: str) -> float:
+        if from_currency == to_currency:
+            return 1.0
+        try:
+            return self.rates[to_currency] / self.rates[from_currency]
+        except KeyError:
+            raise RateUnavailable(f"No FX rate from {from_currency} to {to_currency}")
+
+    def convert(self, amount: float, from_currency: str, to_currency: str) -> Conversion:
+        rate = self.rate(from_currency, to_currency)
+        return Conversion(rate, amount if rate == 1.0 else round(amount * rate, 2), self.version)
+
+
+def pricing(currency: str, conversion: Conversion) -> Dict[str, object]:
+    """Transaction columns recording how a transfer was priced"""
+    return {"currency": currency, "credited_amount": conversion.amount,
+            "fx_rate": conversion.rate, "fx_rate_version": conversion.version}
+
+
+def _normalize(base: str, rates: Mapping[str, float]) -> Dict[str, float]:
+    """Upper-cased codes with the base at 1.0; raises ValueError for bad codes or rates"""
+    if len(base) != 3 or not base.isalpha():
+        raise ValueError(f"Invalid base currency: {base}")
+    normalized = {base.upper(): 1.0}
+    for currency, rate in rates.items():
+        currency, rate = str(currency).upper(), float(rate)
+        if len(currency) != 3 or not currency.isalpha():
+            raise ValueError(f"Invalid currency code: {currency}")
+        if not rate > 0:
+            raise ValueError(f"Invalid rate for {currency}: {rate}")
+        normalized.setdefault(currency, rate)
+    return normalized
+
+
+def _checksum(base: str, rates: Mapping[str, float]) -> str:
+    return hashlib.sha256(json.dumps([base, sorted(rates.items())]).encode()).hexdigest()
+
+
+def _table(row: models.FxRateVersion) -> RateTable:
+    return RateTable(row.id, row.base, MappingProxyType(json.loads(row.rates)), row.loaded_at)
+
+
+class FXRateCache:
+    """
+    In-process, copy-on-write cache of the FX rate table.
+
+    `current` is a single attribute holding an immutable RateTable, so the
+    transfer path reads it without taking any lock: it takes one reference and
+    prices the whole transfer from it. Publishing builds a new table and swaps
+    the reference in one assignment; transfers already holding the old table
+    finish with it. Versions are rows of `fx_rate_versions`, so every worker
+    (and every restart) numbers the same table the same way, and the version
+    recorded on a transaction identifies the exact rates it used.
+    """
+    def __init__(self, default_currency: str = DEFAULT_CURRENCY):
+        self.default_currency = default_currency
+        self.current = self._builtin()
+        self._lock = threading.Lock()  # Serializes writers only
+
+    def _builtin(self) -> RateTable:
+        return RateTable(None, self.default_currency, MappingProxyType({self.default_currency: 1.0}))
+
+    def clear(self) -> None:
+        with self._lock:
+            self.current = self._builtin()
+
+    def _swap(self, table: RateTable) -> RateTable:
+        # Versions only move forward, whichever writer finishes last
+        if self.current.version is None or table.version > self.current.version:
+            self.current = table
+        return self.current
+
+    def restore(self, db: Session) -> RateTable:
+        """Adopt the latest published version, e.g. at startup before the source is read"""
+        row = db.query(models.FxRateVersion).order_by(models.FxRateVersion.id.desc()).first()
+        with self._lock:
+            return self._swap(_table(row)) if row is not None else self.current
+
+    def publish(self, db: Session, base: str, rates: Mapping[str, float]) -> RateTable:
+        """
+        Make `rates` the current table. Rates equal to the latest version reuse it,
+        so workers loading the same source agree on one version.
+        Raises ValueError for invalid codes or rates.
+        """
+        base = base.upper()
+        normalized = _normalize(base, rates)
+        checksum = _checksum(base, normalized)
+        with self._lock:
+            latest = db.query(models.FxRateVersion).order_by(models.FxRateVersion.id.desc()).first()
+            if latest is None or latest.checksum != checksum:
+                latest = models.FxRateVersion(base=base, rates=json.dumps(normalized), checksum=checksum,
+                                              loaded_at=datetime.utcnow())
+                db.add(latest)
+                db.commit()
+            return self._swap(_table(latest))
+
+
+fx_rates = FXRateCache()
+
+
+def load_source(source: str = FX_RATES_SOURCE, timeout: float = FX_FETCH_TIMEOUT) -> Tuple[str, Dict[str, float]]:
+    """Read (base, rates) from a JSON file or an http(s) endpoint"""
+    if source.startswith(("http://", "https://")):
+        response = httpx.get(source, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+    else:
+        with open(source, encoding="utf-8") as f:
+            data = json.load(f)
+    return data["base"], data["rates"]
+
+
+def refresh_rates(session_factory: sessionmaker, source: str = FX_RATES_SOURCE,
+                  cache: FXRateCache = fx_rates) -> RateTable:
+    base, rates = load_source(source)
+    db = session_factory()
+    try:
+        return cache.publish(db, base, rates)
+    finally:
+        db.close()
+
+
+class FXRateRefresher:
+    """
+    Background task refreshing the rate table every FX_REFRESH_INTERVAL seconds:
+    it adopts the latest stored version, then loads FX_RATES_SOURCE if set. A
+    restarted worker therefore prices transfers from the stored rates even while
+    the source is unreachable; a failed load keeps the current table. Every
+    worker adopts stored versions; only the one holding the lease reads the source.
+    """
+    def __init__(self, session_factory: sessionmaker, source: str = FX_RATES_SOURCE,
+                 interval: float = FX_REFRESH_INTERVAL, cache: FXRateCache = fx_rates):
+        self.session_factory = session_factory
+        self.source = source
+        self.interval = interval
+        self.cache = cache
+        self.lease = JobLease(session_factory, FX_LEASE_NAME)
+        self._task: Optional[asyncio.Task] = None
+
+    def _restore(self) -> None:
+        db = self.session_factory()
+        try:
+            self.cache.restore(db)
+        finally:
+            db.close()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                # Versions published by other workers (or the admin endpoint) first
+                await asyncio.to_thread(self._restore)
+                if self.source and await asyncio.to_thread(self.lease.held):
+                    table = await asyncio.to_thread(refresh_rates, self.session_factory, self.source, self.cache)
+                    logger.info(f"FX rates at version {table.version}")
+            except Exception as e:
+                logger.error(f"FX rate refresh failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.lease.release()
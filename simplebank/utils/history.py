@@ -0,0 +1,52 @@
+from typing import Dict, List, Iterable
+from sqlalchemy import select, union_all, literal, func
+from sqlalchemy.orm import Session
+from simplebank.models import models
+from simplebank.models.schemas import TransactionSummary
+
+
+def recent_transactions_by_account(
+    db: Session,
+    account_ids: Iterable[int],
+    limit: int = 5
+) -> Dict[int, List[TransactionSummary]]:
+    """
+    Fetch the latest `limit` transactions of every given account in one query.
+    Each transfer is split into a debit and a credit leg, and the legs are ranked per
+    account with ROW_NUMBER() OVER (PARTITION BY account ...), so the number of
+    queries does not grow with the number of accounts.
+    """
+    account_ids = list(account_ids)
+    results: Dict[int, List[TransactionSummary]] = {account_id: [] for account_id in account_ids}
+    if not account_ids or limit <= 0:
+        return results
+
+    tx = models.Transaction
+    columns = (tx.id, tx.amount, tx.timestamp)
+    legs = union_all(
+        select(*columns, tx.from_account_id.label("account_id"), literal(False).label("is_credit"))
+            .where(tx.from_account_id.in_(account_ids)),
+        select(*columns, tx.to_account_id.label("account_id"), literal(True).label("is_credit"))
+            .where(tx.to_account_id.in_(account_ids)),
+    ).subquery()
+
+    ranked = select(
+        legs,
+        func.row_number().over(
+            partition_by=legs.c.account_id,
+            order_by=(legs.c.timestamp.desc(), legs.c.id.desc())
+        ).label("rn")
+    ).subquery()
+
+    rows = db.execute(
+        select(ranked).where(ranked.c.rn <= limit).order_by(ranked.c.account_id, ranked.c.rn)
+    ).all()
+
+    for row in rows:
+        results[row.account_id].append(TransactionSummary(
+            id=row.id,
+            amount=row.amount,
+            timestamp=row.timestamp,
+            is_credit=bool(row.is_credit)
+        ))
+    return results
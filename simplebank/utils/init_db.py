@@ -2,6 +2,11 @@ from sqlalchemy.orm import Session
 from simplebank.database import engine, SessionLocal
 from simplebank.models.models import Base
 from simplebank.models import models
+from simplebank.utils.ledger import backfill_opening_entries
+from simplebank.utils.search import ensure_customer_search
+from simplebank.utils.partitions import ensure_transaction_columns, drop_transaction_foreign_keys
+from simplebank.utils.fx import ensure_account_currency
+from simplebank.utils.sharding import shard_router
 from datetime import datetime
 initial_customers = [
     {"id": 1, "name": "Arisha Barron"},
@@ -29,6 +34,14 @@ initial_transactions = [
 def init_db():
     # Create tables
     Base.metadata.create_all(bind=engine)
+    # Databases created before the name search index existed
+    ensure_customer_search(engine)
+    # Databases created before accounts had a currency
+    ensure_account_currency(engine)
+    # Transactions and partitions created before transactions carried their pricing and accrual run
+    ensure_transaction_columns(engine)
+    # Databases created while ledger entries, balance changes and outbox events had foreign keys to transactions
+    drop_transaction_foreign_keys(engine)
 
 
 def init_customers(db: Session):
@@ -60,11 +73,31 @@ def init_customers(db: Session):
                 db.add(transaction)
                 db.flush()
             db.commit()
+            # Seeded balances become opening ledger entries
+            backfill_opening_entries(db)
             print("Sample data initialized successfully!")
     finally:
         db.close()
 
-if __name__ == "__main__":
-    db = SessionLocal()
+
+_bootstrapped = False
+
+
+def bootstrap() -> None:
+    """
+    Create the schema (and the shards' schemas) and seed the sample customers.
+    Runs once per process: gunicorn runs it in the master before forking, so the
+    workers inherit `_bootstrapped` and skip it instead of racing each other.
+    """
+    global _bootstrapped
+    if _bootstrapped:
+        return
     init_db()
-    init_customers(db)
\ No newline at end of file
+    if shard_router.enabled:
+        shard_router.create_all()
+    init_customers(SessionLocal())
+    _bootstrapped = True
+
+
+if __name__ == "__main__":
+    bootstrap()
@@ -0,0 +1,76 @@
+import os
+import uuid
+import socket
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+from simplebank.models import models
+
+# Lifetime of the lease of a singleton background job; renewed every round of the job
+JOB_LEASE_TTL = float(os.getenv("JOB_LEASE_TTL", "30"))  # Seconds
+
+
+def worker_owner() -> str:
+    """Lease owner name unique to this worker process"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquire_lease(db: Session, name: str, owner: str, ttl: float) -> bool:
+    """Take or renew the named lease; False if another owner holds an unexpired one"""
+    now = datetime.utcnow()
+    lease = models.SchedulerLease
+    expires_at = now + timedelta(seconds=ttl)
+    updated = db.query(lease).filter(
+        lease.name == name,
+        or_(lease.owner == owner, lease.expires_at.is_(None), lease.expires_at < now)
+    ).update({lease.owner: owner, lease.expires_at: expires_at}, synchronize_session=False)
+    if updated:
+        db.commit()
+        return True
+    if db.get(lease, name) is not None:
+        db.rollback()
+        return False
+    db.add(lease(name=name, owner=owner, expires_at=expires_at))
+    try:
+        db.commit()
+    except IntegrityError:  # Another worker created it first
+        db.rollback()
+        return False
+    return True
+
+
+def release_lease(db: Session, name: str, owner: str) -> None:
+    lease = models.SchedulerLease
+    db.query(lease).filter(lease.name == name, lease.owner == owner).update(
+        {lease.expires_at: None}, synchronize_session=False
+    )
+    db.commit()
+
+
+class JobLease:
+    """
+    The lease of a background job that must run in one worker at a time.
+    Every worker starts the job; each round it calls held(), which takes or
+    renews the lease, and only the holder does the work. If the holder dies,
+    another worker takes over once the lease expires.
+    """
+    def __init__(self, session_factory: sessionmaker, name: str, ttl: float = JOB_LEASE_TTL):
+        self.session_factory = session_factory
+        self.name = name
+        self.ttl = ttl
+        self.owner = worker_owner()
+
+    def held(self) -> bool:
+        db = self.session_factory()
+        try:
+            return acquire_lease(db, self.name, self.owner, self.ttl)
+        finally:
+            db.close()
+
+    def release(self) -> None:
+        db = self.session_factory()
+        try:
+            release_lease(db, self.name, self.owner)
+        finally:
+            db.close()
@@ -0,0 +1,146 @@
+import os
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import select, insert, func, literal, and_, exists
+from sqlalchemy.orm import Session
+from simplebank.models import models
+from simplebank.models.schemas import LedgerDrift, LedgerCheckReport
+
+LEDGER_CHECK_CHUNK_SIZE = int(os.getenv("LEDGER_CHECK_CHUNK_SIZE", "10000"))
+LEDGER_DRIFT_TOLERANCE = 0.005  # Half a cent
+LEDGER_MAX_REPORTED = 100
+
+
+def transfer_entries(transaction: models.Transaction, timestamp: Optional[datetime] = None) -> List[models.LedgerEntry]:
+    """
+    Debit the source and credit the destination of a transfer.
+    A cross-currency transfer also posts the exchange against the outside world
+    (source amount in, credited amount out), so the posting still sums to zero.
+    """
+    timestamp = timestamp or transaction.timestamp or datetime.utcnow()
+    credited = transaction.credited_amount if transaction.credited_amount is not None else transaction.amount
+    entries = [
+        models.LedgerEntry(account_id=transaction.from_account_id, transaction=transaction,
+                           amount=-transaction.amount, kind="transfer", timestamp=timestamp),
+        models.LedgerEntry(account_id=transaction.to_account_id, transaction=transaction,
+                           amount=credited, kind="transfer", timestamp=timestamp),
+    ]
+    if transaction.fx_rate not in (None, 1.0):
+        entries += [
+            models.LedgerEntry(account_id=None, transaction=transaction, amount=transaction.amount,
+                               kind="fx", timestamp=timestamp),
+            models.LedgerEntry(account_id=None, transaction=transaction, amount=-credited,
+                               kind="fx", timestamp=timestamp),
+        ]
+    return entries
+
+
+def deposit_entries(account: models.Account, amount: float, kind: str = "deposit") -> List[models.LedgerEntry]:
+    """Credit an account with money coming from outside the bank"""
+    timestamp = datetime.utcnow()
+    return [
+        models.LedgerEntry(account=account, amount=amount, kind=kind, timestamp=timestamp),
+        models.LedgerEntry(account_id=None, amount=-amount, kind=kind, timestamp=timestamp),
+    ]
+
+
+def backfill_opening_entries(db: Session) -> None:
+    """
+    Give every account without ledger entries an opening entry for its current
+    balance (e.g. accounts created before the ledger existed). Two INSERT ... SELECTs.
+    """
+    account = models.Account
+    entry = models.LedgerEntry
+    unledgered = and_(account.balance != 0, ~exists().where(entry.account_id == account.id))
+    now = literal(datetime.utcnow())
+    # Offsetting external entries first, while the accounts are still unledgered
+    db.execute(insert(entry).from_select(
+        ["account_id", "amount", "kind", "timestamp"],
+        select(literal(None), -account.balance, literal("opening"), now).where(unledgered)
+    ))
+    db.execute(insert(entry).from_select(
+        ["account_id", "amount", "kind", "timestamp"],
+        select(account.id, account.balance, literal("opening"), now).where(unledgered)
+    ))
+    db.commit()
+
+
+def check_ledger(db: Session, chunk_size: int = LEDGER_CHECK_CHUNK_SIZE,
+                 tolerance: float = LEDGER_DRIFT_TOLERANCE, max_reported: int = LEDGER_MAX_REPORTED) -> LedgerCheckReport:
+    """
+    Verify Account.balance against the sum of its ledger entries, chunk by chunk
+    of account ids. Only the grouped sums of one chunk are in memory at a time,
+    and only the first `max_reported` drifted accounts are kept.
+    """
+    account = models.Account
+    entry = models.LedgerEntry
+    ledger_balance = func.coalesce(func.sum(entry.amount), 0.0)
+
+    checked = drifted_count = 0
+    max_drift = 0.0
+    drifted: List[LedgerDrift] = []
+    after = 0
+    while True:
+        chunk = select(account.id).where(account.id > after).order_by(account.id).limit(chunk_size).subquery()
+        bounds = db.execute(select(func.count(), func.max(chunk.c.id))).one()
+        if not bounds[0]:
+            break
+        upper = bounds[1]
+        rows = db.execute(
+            select(account.id, account.balance, ledger_balance)
+            .outerjoin(entry, entry.account_id == account.id)
+            .where(account.id > after, account.id <= upper)
+            .group_by(account.id, account.balance)
+            .having(func.abs(account.balance - ledger_balance) > tolerance)
+        ).all()
+        for account_id, balance, ledger_sum in rows:
+            drift = balance - ledger_sum
+            max_drift = max(max_drift, abs(drift))
+            if len(drifted) < max_reported:
+                drifted.append(LedgerDrift(account_id=account_id, balance=balance,
+                                           ledger_balance=ledger_sum, drift=drift))
+        checked += bounds[0]
+        drifted_count += len(rows)
+        after = upper
+
+    unbalanced_total = db.scalar(select(func.coalesce(func.sum(entry.amount), 0.0)))
+    return LedgerCheckReport(
+        accounts_checked=checked,
+        accounts_drifted=drifted_count,
+        max_drift=max_drift,
+        unbalanced_total=round(unbalanced_total, 6),
+        drifted=drifted,
+    )
+
+
+def merge_reports(reports: List[LedgerCheckReport], max_reported: int = LEDGER_MAX_REPORTED) -> LedgerCheckReport:
+    """One report for several databases (shards), each of whose ledgers balances on its own"""
+    return LedgerCheckReport(
+        accounts_checked=sum(report.accounts_checked for report in reports),
+        accounts_drifted=sum(report.accounts_drifted for report in reports),
+        max_drift=max((report.max_drift for report in reports), default=0.0),
+        unbalanced_total=round(sum(report.unbalanced_total for report in reports), 6),
+        drifted=sorted((drift for report in reports for drift in report.drifted),
+                       key=lambda drift: drift.account_id)[:max_reported],
+    )
+
+
+if __name__ == "__main__":
+    # python -m simplebank.utils.ledger [check|backfill]; every shard when sharding is enabled
+    import sys
+    import json
+    from simplebank.database import SessionLocal
+    from simplebank.utils.sharding import shard_router
+    session_factories = shard_router.sessions if shard_router.enabled else [SessionLocal]
+    reports = []
+    for session_factory in session_factories:
+        db = session_factory()
+        try:
+            if sys.argv[1:] == ["backfill"]:
+                backfill_opening_entries(db)
+            else:
+                reports.append(check_ledger(db))
+        finally:
+            db.close()
+    if reports:
+        print(json.dumps(merge_reports(reports).model_dump(), indent=2))
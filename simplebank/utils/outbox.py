@@ -0,0 +1,185 @@
+import os
+import json
+import asyncio
+import logging
+import httpx
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+from urllib.parse import urlsplit
+from sqlalchemy.orm import Session, sessionmaker
+from simplebank.models import models
+from simplebank.models.schemas import Event
+from simplebank.utils.leases import JobLease
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))  # Seconds
+OUTBOX_WEBHOOK_TIMEOUT = float(os.getenv("OUTBOX_WEBHOOK_TIMEOUT", "5.0"))  # Seconds
+# Events are only read once they are this old: an event can commit after a higher id if it drew its id first
+OUTBOX_VISIBILITY_LAG = float(os.getenv("OUTBOX_VISIBILITY_LAG", "5.0"))  # Seconds
+# Hosts webhook consumers may point at, comma-separated; empty allows no webhooks
+OUTBOX_WEBHOOK_HOSTS = {
+    host.strip().lower() for host in os.getenv("OUTBOX_WEBHOOK_HOSTS", "").split(",") if host.strip()
+}
+
+TRANSACTION_CREATED = "transaction.created"
+OUTBOX_LEASE_NAME = "outbox_dispatcher"
+
+
+def transaction_created_event(transaction: models.Transaction) -> models.OutboxEvent:
+    """
+    Build the outbox row for a new transfer.
+    Added to the caller's session so it is committed atomically with the transfer;
+    the transaction id is resolved by the ORM at flush time.
+    """
+    return models.OutboxEvent(
+        event_type=TRANSACTION_CREATED,
+        transaction=transaction,
+        payload=json.dumps({
+            "from_account_id": transaction.from_account_id,
+            "to_account_id": transaction.to_account_id,
+            "amount": transaction.amount,
+            "currency": transaction.currency,
+            "credited_amount": transaction.credited_amount,
+        }),
+    )
+
+
+def to_event(row: models.OutboxEvent) -> Event:
+    return Event(
+        id=row.id,
+        event_type=row.event_type,
+        transaction_id=row.transaction_id,
+        created_at=row.created_at,
+        data=json.loads(row.payload),
+    )
+
+
+def fetch_events(db: Session, after: int, limit: int = OUTBOX_BATCH_SIZE,
+                 lag: Optional[float] = None) -> List[Event]:
+    """
+    Events with id > `after`, oldest first (keyset scan on the primary key).
+    Stops at the first event younger than `lag` seconds (OUTBOX_VISIBILITY_LAG):
+    by then every lower id has committed, so an offset never moves past an event
+    that commits late.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=OUTBOX_VISIBILITY_LAG if lag is None else lag)
+    rows = db.query(models.OutboxEvent).filter(
+        models.OutboxEvent.id > after
+    ).order_by(models.OutboxEvent.id).limit(limit).all()
+    events = []
+    for row in rows:
+        if row.created_at > cutoff:
+            break
+        events.append(to_event(row))
+    return events
+
+
+def webhook_allowed(url: str) -> bool:
+    """An http(s) URL whose host is listed in OUTBOX_WEBHOOK_HOSTS"""
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return False
+    return parts.scheme in ("http", "https") and (parts.hostname or "") in OUTBOX_WEBHOOK_HOSTS
+
+
+async def post_webhook(url: str, events: List[Event]) -> bool:
+    """Deliver a batch of events to a webhook; any 2xx counts as delivered"""
+    async with httpx.AsyncClient(timeout=OUTBOX_WEBHOOK_TIMEOUT) as client:
+        response = await client.post(
+            url, content=json.dumps({"events": [event.model_dump(mode="json") for event in events]}),
+            headers={"Content-Type": "application/json"},
+        )
+    return response.is_success
+
+
+class OutboxDispatcher:
+    """
+    Background task delivering outbox events to webhook consumers in batches.
+    A consumer's offset is only advanced after its webhook accepted the batch,
+    so delivery is at-least-once: consumers must de-duplicate by event id.
+    Webhooks whose host is no longer in OUTBOX_WEBHOOK_HOSTS are skipped.
+    Only the worker holding the dispatcher's lease delivers.
+    """
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        post: Callable[[str, List[Event]], Awaitable[bool]] = post_webhook,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+    ):
+        self.session_factory = session_factory
+        self.post = post
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = JobLease(session_factory, OUTBOX_LEASE_NAME)
+        self._task: Optional[asyncio.Task] = None
+
+    def _pending(self):
+        """Webhook consumers with their next batch of events"""
+        db = self.session_factory()
+        try:
+            consumers = db.query(models.EventConsumer).filter(
+                models.EventConsumer.active.is_(True),
+                models.EventConsumer.webhook_url.isnot(None)
+            ).all()
+            return [
+                (consumer.name, consumer.webhook_url, events)
+                for consumer in consumers
+                if webhook_allowed(consumer.webhook_url)
+                and (events := fetch_events(db, consumer.offset, self.batch_size))
+            ]
+        finally:
+            db.close()
+
+    def _commit_offset(self, name: str, offset: int) -> None:
+        db = self.session_factory()
+        try:
+            consumer = db.get(models.EventConsumer, name)
+            if consumer is not None and consumer.offset < offset:
+                consumer.offset = offset
+                db.commit()
+        finally:
+            db.close()
+
+    async def dispatch_once(self) -> int:
+        """Deliver one batch to every consumer that is behind; returns events delivered"""
+        delivered = 0
+        for name, url, events in await asyncio.to_thread(self._pending):
+            try:
+                ok = await self.post(url, events)
+            except Exception as e:
+                logger.warning(f"Webhook delivery to consumer {name} failed: {e}")
+                ok = False
+            if ok:
+                await asyncio.to_thread(self._commit_offset, name, events[-1].id)
+                delivered += len(events)
+        return delivered
+
+    async def run(self) -> None:
+        while True:
+            delivered = 0
+            try:
+                if await asyncio.to_thread(self.lease.held):
+                    delivered = await self.dispatch_once()
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {e}")
+            # Keep draining while consumers are behind, otherwise wait for new events
+            if delivered == 0:
+                await asyncio.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.lease.release()
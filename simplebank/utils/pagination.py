@@ -2,13 +2,20 @@ from typing import TypeVar, Tuple, Optional
 from sqlalchemy.orm import Query
 from sqlalchemy import or_, and_
 from base64 import b64encode, b64decode
+import os
+import hmac
 import json
+import hashlib
+import secrets
 from datetime import datetime
 from fastapi import Query
 from simplebank.models.models import Transaction
 
 T = TypeVar('T') # Generic type for the query results
 
+# Key of the HMAC on cursors carrying values the server trusts; set the same key on every worker
+CURSOR_SECRET = os.getenv("CURSOR_SECRET", "") or secrets.token_hex(32)
+
 class PaginationField:
     """Configuration for pagination fields"""
     def __init__(self, field_name: str, is_timestamp: bool = False):
@@ -35,6 +42,23 @@ def decode_cursor(cursor: str) -> dict:
         print(f"Error decoding cursor: {e}")  # Debug print
         return {}
 
+def _cursor_signature(values: dict, scope: str) -> str:
+    message = json.dumps([scope, {k: v for k, v in values.items() if k != "sig"}], default=str, sort_keys=True)
+    return hmac.new(CURSOR_SECRET.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def sign_cursor(values: dict, scope: str) -> dict:
+    """
+    Add an HMAC over `values` and `scope` (e.g. the account paged), so the server can
+    trust the values when the cursor comes back
+    """
+    values = json.loads(json.dumps(values, default=str))  # As they will read once decoded
+    return {**values, "sig": _cursor_signature(values, scope)}
+
+def cursor_signed(values: dict, scope: str) -> bool:
+    """Whether decoded cursor values carry a valid signature for `scope`"""
+    signature = values.get("sig")
+    return isinstance(signature, str) and hmac.compare_digest(signature, _cursor_signature(values, scope))
+
 def cursor_paginate(
     query: Query,
     cursor: Optional[str],
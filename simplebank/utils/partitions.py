@@ -0,0 +1,445 @@
+import os
+import re
+import gzip
+import json
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import (
+    Table, Column, Integer, Float, String, Date, DateTime, Index, MetaData,
+    select, insert, delete, union_all, inspect, func, and_, or_, true
+)
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from simplebank.models import models
+
+# Months kept in the live `transactions` table, the current one included
+TRANSACTION_HOT_MONTHS = int(os.getenv("TRANSACTION_HOT_MONTHS", "2"))
+# Months a closed partition stays in the database before it is archived to a file
+TRANSACTION_ARCHIVE_AFTER_MONTHS = int(os.getenv("TRANSACTION_ARCHIVE_AFTER_MONTHS", "12"))
+TRANSACTION_ARCHIVE_DIR = os.getenv("TRANSACTION_ARCHIVE_DIR", "./archive")
+# Days kept in the live `balance_changes` table, today included
+BALANCE_CHANGE_HOT_DAYS = int(os.getenv("BALANCE_CHANGE_HOT_DAYS", "7"))
+
+_PARTITION_NAME = re.compile(r"^transactions_(\d{4})_(\d{2})$")
+_ARCHIVE_NAME = re.compile(r"^transactions_(\d{4})_(\d{2})\.ndjson\.gz$")
+_DAY_PARTITION_NAME = re.compile(r"^balance_changes_(\d{4})_(\d{2})_(\d{2})$")
+_metadata = MetaData()
+
+# Columns copied into partitions and archives; the pricing ones and accrual_run_id may be null
+TRANSACTION_COLUMNS = ["id", "from_account_id", "to_account_id", "amount", "timestamp",
+                       "currency", "credited_amount", "fx_rate", "fx_rate_version", "accrual_run_id"]
+_ADDED_COLUMNS = {
+    "currency": "VARCHAR(3)", "credited_amount": "FLOAT", "fx_rate": "FLOAT", "fx_rate_version": "INTEGER",
+    "accrual_run_id": "INTEGER",
+}
+
+BALANCE_CHANGE_COLUMNS = ["id", "day", "timestamp", "account_id", "transaction_id", "balance_before",
+                          "balance_after", "request_id", "api_key_id"]
+
+# Tables referencing transactions by id only, so their rows stay valid once a month is detached
+_TRANSACTION_REFERENCES = ["balance_changes", "ledger_entries", "outbox_events"]
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"transactions_{month.year:04d}_{month.month:02d}"
+
+
+def partition_table(month: date) -> Table:
+    """Table of one closed month, with the same columns and history indexes as `transactions`"""
+    name = partition_name(month)
+    if name in _metadata.tables:
+        return _metadata.tables[name]
+    return Table(
+        name, _metadata,
+        Column("id", Integer, primary_key=True),
+        Column("from_account_id", Integer),
+        Column("to_account_id", Integer),
+        Column("amount", Float),
+        Column("timestamp", DateTime),
+        Column("currency", String(3), nullable=True),
+        Column("credited_amount", Float, nullable=True),
+        Column("fx_rate", Float, nullable=True),
+        Column("fx_rate_version", Integer, nullable=True),
+        Column("accrual_run_id", Integer, nullable=True),
+        Index(f"ix_{name}_from_account_timestamp", "from_account_id", "timestamp"),
+        Index(f"ix_{name}_to_account_timestamp", "to_account_id", "timestamp"),
+    )
+
+
+def list_partitions(db: Session) -> List[date]:
+    """Months that have a partition table, newest first"""
+    months = []
+    for name in inspect(db.get_bind()).get_table_names():
+        match = _PARTITION_NAME.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months, reverse=True)
+
+
+def day_partition_name(day: date) -> str:
+    return f"balance_changes_{day.year:04d}_{day.month:02d}_{day.day:02d}"
+
+
+def day_partition_table(day: date) -> Table:
+    """Table of one closed day of balance changes, with the same columns and range-scan index as `balance_changes`"""
+    name = day_partition_name(day)
+    if name in _metadata.tables:
+        return _metadata.tables[name]
+    return Table(
+        name, _metadata,
+        Column("id", Integer, primary_key=True),
+        Column("day", Date, nullable=False),
+        Column("timestamp", DateTime, nullable=False),
+        Column("account_id", Integer, nullable=False),
+        Column("transaction_id", Integer, nullable=True),
+        Column("balance_before", Float, nullable=False),
+        Column("balance_after", Float, nullable=False),
+        Column("request_id", String(64)),
+        Column("api_key_id", String(64)),
+        Index(f"ix_{name}_account_timestamp", "account_id", "timestamp"),
+    )
+
+
+def list_day_partitions(db: Session) -> List[date]:
+    """Days that have a balance change partition table, newest first"""
+    days = []
+    for name in inspect(db.get_bind()).get_table_names():
+        match = _DAY_PARTITION_NAME.match(name)
+        if match:
+            days.append(date(int(match.group(1)), int(match.group(2)), int(match.group(3))))
+    return sorted(days, reverse=True)
+
+
+def ensure_transaction_columns(engine: Engine) -> None:
+    """
+    Add the pricing and accrual columns to the live table and the partitions of
+    databases created before transactions carried them (`create_all` only creates
+    missing tables). The accrual run id is added without its foreign key.
+    """
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for name in inspector.get_table_names():
+            if name != "transactions" and not _PARTITION_NAME.match(name):
+                continue
+            present = {column["name"] for column in inspector.get_columns(name)}
+            for column, type_ in _ADDED_COLUMNS.items():
+                if column not in present:
+                    connection.exec_driver_sql(f"ALTER TABLE {name} ADD COLUMN {column} {type_}")
+
+
+def drop_transaction_foreign_keys(engine: Engine) -> None:
+    """
+    Drop the foreign keys to `transactions` of tables whose rows outlive a detached
+    month (balance changes, ledger entries, outbox events), left by databases created
+    before months could be detached. SQLite cannot drop a constraint in place and
+    only enforces them with `PRAGMA foreign_keys=ON`; such databases are left as is.
+    """
+    if engine.dialect.name == "sqlite":
+        return
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        for name in _TRANSACTION_REFERENCES:
+            if not inspector.has_table(name):
+                continue
+            for foreign_key in inspector.get_foreign_keys(name):
+                if foreign_key["referred_table"] == "transactions" and foreign_key.get("name"):
+                    connection.exec_driver_sql(f'ALTER TABLE {name} DROP CONSTRAINT "{foreign_key["name"]}"')
+
+
+def archive_path(directory: str, month: date) -> Path:
+    return Path(directory) / f"{partition_name(month)}.ndjson.gz"
+
+
+def list_archives(directory: str = TRANSACTION_ARCHIVE_DIR) -> List[date]:
+    """Months archived to files, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    months = []
+    for name in os.listdir(directory):
+        match = _ARCHIVE_NAME.match(name)
+        if match:
+            months.append(date(int(match.group(1)), int(match.group(2)), 1))
+    return sorted(months)
+
+
+# Maintenance
+
+def detach_closed_months(db: Session, now: Optional[datetime] = None,
+                         hot_months: int = TRANSACTION_HOT_MONTHS) -> List[date]:
+    """
+    Move every month older than the hot window out of `transactions` into its own
+    partition table. Each month moves in one commit (INSERT ... SELECT, then DELETE),
+    so a crash leaves it either in the live table or in its partition. Balance
+    changes, ledger entries and outbox events keep their transaction ids: they
+    reference transactions without a foreign key.
+    Returns the months moved. At least the current and the previous month stay
+    live: velocity limits hydrate from the last day of the live table.
+    """
+    if hot_months < 2:
+        raise ValueError("At least two months must stay in the live transactions table")
+    tx = models.Transaction.__table__
+    cutoff = add_months(month_start(now or datetime.utcnow()), -(hot_months - 1))
+    oldest = db.scalar(select(func.min(tx.c.timestamp)).where(tx.c.timestamp < _month_bound(cutoff)))
+    moved = []
+    month = month_start(oldest) if oldest is not None else cutoff
+    while month < cutoff:
+        next_month = add_months(month, 1)
+        in_month = and_(tx.c.timestamp >= _month_bound(month), tx.c.timestamp < _month_bound(next_month))
+        partition = partition_table(month)
+        partition.create(db.connection(), checkfirst=True)
+        db.execute(insert(partition).from_select(
+            TRANSACTION_COLUMNS, select(*(tx.c[column] for column in TRANSACTION_COLUMNS)).where(in_month)
+        ))
+        if db.execute(delete(tx).where(in_month)).rowcount:
+            moved.append(month)
+        db.commit()
+        month = next_month
+    return moved
+
+
+def detach_closed_days(db: Session, now: Optional[datetime] = None,
+                       hot_days: int = BALANCE_CHANGE_HOT_DAYS) -> List[date]:
+    """
+    Move every day of balance changes older than the hot window out of
+    `balance_changes` into its own partition table, one commit per day, like
+    `detach_closed_months`. The days are found and moved through the `day` index.
+    Returns the days moved. At least today and yesterday stay live: balance
+    streams replay missed changes and the balance change feed reads only the
+    live table.
+    """
+    if hot_days < 2:
+        raise ValueError("At least two days must stay in the live balance_changes table")
+    changes = models.BalanceChange.__table__
+    cutoff = (now or datetime.utcnow()).date() - timedelta(days=hot_days - 1)
+    days = db.scalars(select(changes.c.day).where(changes.c.day < cutoff).distinct().order_by(changes.c.day)).all()
+    for day in days:
+        partition = day_partition_table(day)
+        partition.create(db.connection(), checkfirst=True)
+        db.execute(insert(partition).from_select(
+            BALANCE_CHANGE_COLUMNS,
+            select(*(changes.c[column] for column in BALANCE_CHANGE_COLUMNS)).where(changes.c.day == day)
+        ))
+        db.execute(delete(changes).where(changes.c.day == day))
+        db.commit()
+    return list(days)
+
+
+def archive_partition(db: Session, month: date, directory: str = TRANSACTION_ARCHIVE_DIR) -> Path:
+    """
+    Write a partition to a gzip-compressed NDJSON file, then drop the table.
+    The file is written under a temporary name and renamed once complete, so a
+    crash never leaves a truncated archive next to a dropped partition.
+    """
+    partition = partition_table(month)
+    path = archive_path(directory, month)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + ".tmp")
+    rows = db.execute(
+        select(partition).order_by(partition.c.timestamp, partition.c.id).execution_options(yield_per=1000)
+    )
+    with gzip.open(temporary, "wt", encoding="utf-8") as archive:
+        for row in rows:
+            record = {column: getattr(row, column) for column in TRANSACTION_COLUMNS}
+            record["timestamp"] = row.timestamp.isoformat()
+            archive.write(json.dumps(record, separators=(",", ":")) + "\n")
+    os.replace(temporary, path)
+    partition.drop(db.connection())
+    db.commit()
+    return path
+
+
+def archive_closed_partitions(db: Session, now: Optional[datetime] = None,
+                              after_months: int = TRANSACTION_ARCHIVE_AFTER_MONTHS,
+                              directory: str = TRANSACTION_ARCHIVE_DIR) -> List[Path]:
+    cutoff = add_months(month_start(now or datetime.utcnow()), -after_months)
+    return [archive_partition(db, month, directory) for month in list_partitions(db) if month < cutoff]
+
+
+# Reads
+
+def _keyset(table: Table, before: Optional[Tuple[datetime, int]]):
+    if before is None:
+        return true()
+    timestamp, transaction_id = before
+    return or_(table.c.timestamp < timestamp, and_(table.c.timestamp == timestamp, table.c.id < transaction_id))
+
+
+def _account_legs(table: Table, account_id: int, before: Optional[Tuple[datetime, int]], limit: int,
+                  max_id: Optional[int] = None):
+    """
+    Newest `limit` rows of one table touching an account, as a UNION ALL of the
+    debit and credit legs so each side is a range scan on its own index.
+    """
+    ordering = (table.c.timestamp.desc(), table.c.id.desc())
+    pinned = table.c.id <= max_id if max_id is not None else true()
+    legs = [
+        select(table).where(table.c.from_account_id == account_id, _keyset(table, before), pinned)
+            .order_by(*ordering).limit(limit).subquery(),
+        select(table).where(table.c.to_account_id == account_id, table.c.from_account_id != account_id,
+                            _keyset(table, before), pinned)
+            .order_by(*ordering).limit(limit).subquery(),
+    ]
+    combined = union_all(*(select(leg) for leg in legs)).subquery()
+    return select(combined).order_by(combined.c.timestamp.desc(), combined.c.id.desc()).limit(limit)
+
+
+def account_history_page(db: Session, account_id: int, before: Optional[Tuple[datetime, int]],
+                         limit: int, max_id: Optional[int] = None) -> List[Any]:
+    """
+    Up to `limit` transactions of an account older than the keyset position `before`,
+    newest first, leaving out ids above `max_id`. The live table is read first, then
+    the month partitions newest first, skipping partitions newer than the cursor and
+    stopping as soon as the page is full, so deep history is only touched by the
+    pages that reach it.
+    """
+    rows: List[Any] = []
+    rows += db.execute(_account_legs(models.Transaction.__table__, account_id, before, limit, max_id)).all()
+    for month in list_partitions(db):
+        if before is not None and month > month_start(before[0]):
+            continue
+        # Partitions are disjoint months: a full page newer than this one is final
+        if len(rows) >= limit and rows[limit - 1].timestamp >= _month_bound(add_months(month, 1)):
+            break
+        rows += db.execute(_account_legs(partition_table(month), account_id, before, limit, max_id)).all()
+        rows.sort(key=lambda row: (row.timestamp, row.id), reverse=True)
+        del rows[limit:]
+    return rows
+
+
+def history_high_water(db: Session) -> int:
+    """
+    Highest transaction id so far, over the live table and the partitions (backdated
+    rows can be detached with higher ids than live ones). Transactions committed
+    later get higher ids.
+    """
+    tables = [models.Transaction.__table__] + [partition_table(month) for month in list_partitions(db)]
+    return max((db.scalar(select(func.max(table.c.id))) or 0) for table in tables)
+
+
+def _month_bound(month: date) -> datetime:
+    return datetime.combine(month, datetime.min.time())
+
+
+def _statement_row(row: Dict[str, Any], account_id: int) -> Dict[str, Any]:
+    return {**row, "is_credit": row["to_account_id"] == account_id}
+
+
+def _overlaps(month: date, start: Optional[datetime], end: Optional[datetime]) -> bool:
+    return ((start is None or _month_bound(add_months(month, 1)) > start)
+            and (end is None or _month_bound(month) < end))
+
+
+def transaction_tables(db: Session, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Table]:
+    """The partitions of the months overlapping [start, end), oldest first, then the live table"""
+    tables = [partition_table(month) for month in reversed(list_partitions(db)) if _overlaps(month, start, end)]
+    return tables + [models.Transaction.__table__]
+
+
+def all_transactions(db: Session, start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """
+    The live table and the overlapping partitions as one selectable (UNION ALL),
+    with the live table's transaction columns. Filters on it reach each table.
+    """
+    tables = transaction_tables(db, start, end)
+    if len(tables) == 1:
+        return tables[0]
+    return union_all(*(select(*(table.c[column] for column in TRANSACTION_COLUMNS)) for table in tables)).subquery()
+
+
+def archived_transactions(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                          archive_dir: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Transactions of the archive files between `start` (inclusive) and `end`
+    (exclusive), in (timestamp, id) order. Only the overlapping months are opened.
+    """
+    archive_dir = archive_dir or TRANSACTION_ARCHIVE_DIR
+    for month in list_archives(archive_dir):
+        if not _overlaps(month, start, end):
+            continue
+        with gzip.open(archive_path(archive_dir, month), "rt", encoding="utf-8") as archive:
+            for line in archive:
+                row = {column: None for column in TRANSACTION_COLUMNS}  # Archives written before pricing
+                row.update(json.loads(line))
+                row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+                if (start is None or row["timestamp"] >= start) and (end is None or row["timestamp"] < end):
+                    yield row
+
+
+def iter_account_statement(db: Session, account_id: int, start: Optional[datetime] = None,
+                           end: Optional[datetime] = None,
+                           archive_dir: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Every transaction of an account between `start` (inclusive) and `end`
+    (exclusive), oldest first, across archive files, partitions and the live table.
+    Only the archives and partitions of months overlapping the range are opened.
+    """
+    for row in archived_transactions(start, end, archive_dir):
+        if account_id in (row["from_account_id"], row["to_account_id"]):
+            yield _statement_row(row, account_id)
+
+    for table in transaction_tables(db, start, end):
+        query = select(*(table.c[column] for column in TRANSACTION_COLUMNS)).where(
+            or_(table.c.from_account_id == account_id, table.c.to_account_id == account_id)
+        )
+        if start is not None:
+            query = query.where(table.c.timestamp >= start)
+        if end is not None:
+            query = query.where(table.c.timestamp < end)
+        for row in db.execute(query.order_by(table.c.timestamp, table.c.id).execution_options(yield_per=1000)):
+            yield _statement_row(dict(row._mapping), account_id)
+
+
+def account_balance_changes(db: Session, account_id: int, start: Optional[datetime] = None,
+                            end: Optional[datetime] = None, after_id: Optional[int] = None,
+                            limit: int = 100) -> List[Any]:
+    """
+    Up to `limit` balance changes of an account between `start` (inclusive) and
+    `end` (exclusive) with ids above `after_id`, in id order, from the live table
+    and the day partitions overlapping the range (one `UNION ALL`). Accrual runs
+    can be backdated, so ids are merged across days rather than read day by day.
+    """
+    start_day = start.date() if start is not None else None
+    end_day = end.date() if end is not None else None
+    tables = [day_partition_table(day) for day in reversed(list_day_partitions(db))
+              if (start_day is None or day >= start_day) and (end_day is None or day <= end_day)]
+    tables.append(models.BalanceChange.__table__)
+    legs = []
+    for table in tables:
+        query = select(*(table.c[column] for column in BALANCE_CHANGE_COLUMNS)).where(table.c.account_id == account_id)
+        if start is not None:
+            query = query.where(table.c.timestamp >= start)
+        if end is not None:
+            query = query.where(table.c.timestamp < end)
+        if after_id is not None:
+            query = query.where(table.c.id > after_id)
+        legs.append(query.order_by(table.c.id).limit(limit).subquery())
+    combined = union_all(*(select(leg) for leg in legs)).subquery()
+    return db.execute(select(combined).order_by(combined.c.id).limit(limit)).all()
+
+
+if __name__ == "__main__":
+    # python -m simplebank.utils.partitions [detach|archive]; detach also moves closed days of balance changes
+    import sys
+    from simplebank.database import SessionLocal
+    db = SessionLocal()
+    try:
+        if sys.argv[1:] == ["archive"]:
+            for path in archive_closed_partitions(db):
+                print(f"Archived {path}")
+        else:
+            for month in detach_closed_months(db):
+                print(f"Detached {partition_name(month)}")
+            for day in detach_closed_days(db):
+                print(f"Detached {day_partition_name(day)}")
+    finally:
+        db.close()
@@ -0,0 +1,108 @@
+import os
+import json
+import asyncio
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set
+
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))  # Seconds
+
+
+class Subscription:
+    """
+    One subscriber's mailbox.
+    Only the latest message is kept: a balance update supersedes the previous one,
+    so a slow or idle connection costs one slot rather than a growing queue.
+    """
+    __slots__ = ("key", "latest", "_ready")
+
+    def __init__(self, key: Any):
+        self.key = key
+        self.latest: Optional[Dict[str, Any]] = None
+        self._ready = asyncio.Event()
+
+    def deliver(self, message: Dict[str, Any]) -> None:
+        self.latest = message
+        self._ready.set()
+
+    async def next(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Wait for the next message; None when `timeout` elapses first"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._ready.clear()
+        message, self.latest = self.latest, None
+        return message
+
+
+class PubSub:
+    """In-process publish/subscribe keyed by topic (e.g. account id), used from the event loop"""
+    def __init__(self):
+        self._subscribers: Dict[Any, Set[Subscription]] = {}
+
+    def subscribe(self, key: Any) -> Subscription:
+        subscription = Subscription(key)
+        self._subscribers.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(subscription.key)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.key]
+
+    def publish(self, key: Any, message: Dict[str, Any]) -> int:
+        """Deliver to every subscriber of `key`; returns the number of subscribers"""
+        subscribers = self._subscribers.get(key, ())
+        for subscription in subscribers:
+            subscription.deliver(message)
+        return len(subscribers)
+
+    def topics(self) -> List[Any]:
+        """Keys with at least one subscriber"""
+        return list(self._subscribers)
+
+    def subscriber_count(self, key: Any = None) -> int:
+        if key is not None:
+            return len(self._subscribers.get(key, ()))
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+# Balance updates per account id, published by create_transaction after commit
+balance_updates = PubSub()
+
+
+def format_sse(data: Dict[str, Any], event_id: Optional[int] = None, event: str = "balance") -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'), default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def sse_stream(
+    subscription: Subscription,
+    pubsub: PubSub,
+    initial: Iterable[Dict[str, Any]] = (),
+    heartbeat: float = SSE_HEARTBEAT_INTERVAL,
+) -> AsyncIterator[str]:
+    """
+    Server-Sent Events body: replayed/initial messages first, then live ones.
+    A comment line is sent after `heartbeat` idle seconds to keep proxies from
+    closing the connection. Each message carries its `event_id` for Last-Event-ID resume.
+    """
+    last_id = 0
+    try:
+        for message in initial:
+            last_id = max(last_id, message.get("event_id") or 0)
+            yield format_sse(message, message.get("event_id"))
+        while True:
+            message = await subscription.next(timeout=heartbeat)
+            if message is None:
+                yield ": heartbeat\n\n"
+            elif (message.get("event_id") or 0) > last_id:  # Skip what was already replayed
+                last_id = message.get("event_id") or last_id
+                yield format_sse(message, message.get("event_id"))
+    finally:
+        pubsub.unsubscribe(subscription)
@@ -0,0 +1,268 @@
+import os
+import csv
+import json
+import heapq
+import tempfile
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import IO, Any, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+from sqlalchemy import select, or_
+from sqlalchemy.orm import Session
+from simplebank.models import models
+from simplebank.utils.partitions import all_transactions, archived_transactions
+
+# Default matching window between an external record and a transaction
+RECONCILE_TOLERANCE = float(os.getenv("RECONCILE_TOLERANCE", "300"))  # Seconds
+# External records sorted in memory at a time; larger files are sorted in runs on disk
+RECONCILE_CHUNK_SIZE = int(os.getenv("RECONCILE_CHUNK_SIZE", "10000"))
+# Sorted runs merged at once; more runs are first merged in passes
+RECONCILE_MERGE_FAN_IN = int(os.getenv("RECONCILE_MERGE_FAN_IN", "64"))
+
+
+@dataclass
+class ExternalRecord:
+    line: int
+    account_id: int
+    amount: float
+    timestamp: datetime
+    reference: Optional[str]
+
+
+@dataclass
+class Leg:
+    """One side of a transaction: debits are negative, credits positive"""
+    transaction_id: int
+    account_id: int
+    amount: float
+    timestamp: datetime
+    matched: bool = False
+
+
+def _cents(amount: float) -> int:
+    return round(amount * 100)
+
+
+def _naive_utc(moment: datetime) -> datetime:
+    if moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def parse_records(lines: Iterable[str], format: str) -> Iterator[Union[ExternalRecord, Dict[str, Any]]]:
+    """
+    External records from CSV (header with account_id, amount, timestamp, reference)
+    or NDJSON lines. Amounts are signed from the account's point of view: negative
+    for money leaving it. Unparseable lines come out as "invalid" results.
+    """
+    if format == "csv":
+        rows = ((reader.line_num, row) for reader in [csv.DictReader(lines)] for row in reader)
+    else:
+        rows = ((number, line) for number, line in enumerate(lines, start=1) if line.strip())
+    for number, row in rows:
+        try:
+            if format != "csv":
+                row = json.loads(row)
+            yield ExternalRecord(
+                line=number,
+                account_id=int(row["account_id"]),
+                amount=float(row["amount"]),
+                timestamp=_naive_utc(datetime.fromisoformat(str(row["timestamp"]))),
+                reference=row.get("reference") or None,
+            )
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            yield {"status": "invalid", "line": number, "error": f"{type(e).__name__}: {e}"}
+
+
+def _row_legs(row, accounts) -> Iterator[Leg]:
+    """The legs of one transaction on the accounts in `accounts` (all when empty), each in its account's currency"""
+    if not accounts or row.from_account_id in accounts:
+        yield Leg(row.id, row.from_account_id, -row.amount, row.timestamp)
+    if not accounts or row.to_account_id in accounts:
+        credited = row.credited_amount if row.credited_amount is not None else row.amount
+        yield Leg(row.id, row.to_account_id, credited, row.timestamp)
+
+
+def _legs(db: Session, start: datetime, account_ids: Optional[Sequence[int]],
+          owned: Optional[Tuple[int, int]]) -> Iterator[Leg]:
+    """
+    Transaction legs from `start` on, in timestamp order: the archived months from
+    their files, then the live table and the month partitions, streamed in
+    timestamp order over their indexes.
+    """
+    accounts = set(account_ids or ())
+
+    def archived() -> Iterator[Leg]:
+        for row in archived_transactions(start):
+            if owned is not None and row["id"] % owned[0] != owned[1]:
+                continue
+            yield from _row_legs(SimpleNamespace(**row), accounts)
+
+    def stored() -> Iterator[Leg]:
+        tx = all_transactions(db, start).c
+        query = select(tx.id, tx.from_account_id, tx.to_account_id, tx.amount, tx.credited_amount,
+                       tx.timestamp).where(tx.timestamp >= start)
+        if account_ids:
+            query = query.where(or_(tx.from_account_id.in_(account_ids), tx.to_account_id.in_(account_ids)))
+        if owned is not None:
+            query = query.where(tx.id % owned[0] == owned[1])  # Cross-shard mirrors come from their source shard
+        for row in db.execute(query.order_by(tx.timestamp, tx.id).execution_options(yield_per=RECONCILE_CHUNK_SIZE)):
+            yield from _row_legs(row, accounts)
+
+    yield from heapq.merge(archived(), stored(), key=lambda leg: (leg.timestamp, leg.transaction_id))
+
+
+def _record_order(record: ExternalRecord) -> Tuple[datetime, int]:
+    return record.timestamp, record.line
+
+
+def _write_run(records: Iterable[ExternalRecord]) -> IO[str]:
+    run = tempfile.TemporaryFile("w+", encoding="utf-8")
+    for r in records:
+        run.write(json.dumps([r.line, r.account_id, r.amount, r.timestamp.isoformat(), r.reference]) + "\n")
+    run.seek(0)
+    return run
+
+
+def _read_run(run: IO[str]) -> Iterator[ExternalRecord]:
+    for line in run:
+        number, account_id, amount, timestamp, reference = json.loads(line)
+        yield ExternalRecord(number, account_id, amount, datetime.fromisoformat(timestamp), reference)
+
+
+def sort_records(records: Iterable[Union[ExternalRecord, Dict[str, Any]]], chunk_size: int = RECONCILE_CHUNK_SIZE,
+                 fan_in: int = RECONCILE_MERGE_FAN_IN) -> Iterator[Union[ExternalRecord, Dict[str, Any]]]:
+    """
+    External merge sort of the records by timestamp. Chunks of `chunk_size` are
+    sorted in memory and written to temporary files as sorted runs, which are then
+    merged with heapq.merge, `fan_in` at a time. Input that fits in one chunk never
+    touches the disk. Invalid records come out first, as they are read.
+    """
+    runs: List[IO[str]] = []
+    try:
+        chunk: List[ExternalRecord] = []
+        for record in records:
+            if isinstance(record, dict):
+                yield record
+                continue
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                runs.append(_write_run(sorted(chunk, key=_record_order)))
+                chunk = []
+        if not runs:
+            yield from sorted(chunk, key=_record_order)
+            return
+        if chunk:
+            runs.append(_write_run(sorted(chunk, key=_record_order)))
+        while len(runs) > fan_in:
+            merged = []
+            for start in range(0, len(runs), fan_in):
+                group = runs[start:start + fan_in]
+                merged.append(_write_run(heapq.merge(*map(_read_run, group), key=_record_order)))
+                for run in group:
+                    run.close()
+            runs = merged
+        yield from heapq.merge(*map(_read_run, runs), key=_record_order)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def _matched(record: ExternalRecord, leg: Leg) -> Dict[str, Any]:
+    return {
+        "status": "matched", "line": record.line, "reference": record.reference,
+        "account_id": record.account_id, "amount": record.amount, "timestamp": record.timestamp,
+        "transaction_id": leg.transaction_id, "transaction_timestamp": leg.timestamp,
+        "delta_seconds": (record.timestamp - leg.timestamp).total_seconds(),
+    }
+
+
+def _missing(record: ExternalRecord) -> Dict[str, Any]:
+    return {
+        "status": "missing", "line": record.line, "reference": record.reference,
+        "account_id": record.account_id, "amount": record.amount, "timestamp": record.timestamp,
+    }
+
+
+def _extra(leg: Leg) -> Dict[str, Any]:
+    return {
+        "status": "extra", "transaction_id": leg.transaction_id, "account_id": leg.account_id,
+        "amount": leg.amount, "timestamp": leg.timestamp,
+    }
+
+
+def reconcile(records: Iterable[Union[ExternalRecord, Dict[str, Any]]], sessions: Sequence[Session],
+              tolerance: float = RECONCILE_TOLERANCE, account_ids: Optional[Sequence[int]] = None,
+              shards: Optional[int] = None, chunk_size: int = RECONCILE_CHUNK_SIZE,
+              fan_in: int = RECONCILE_MERGE_FAN_IN) -> Iterator[Dict[str, Any]]:
+    """
+    Sorted-merge join of external records with transaction legs, in bounded memory.
+
+    Records are put in timestamp order by an external merge sort (any input order
+    works, e.g. files sorted by account) and the legs are streamed in timestamp
+    order alongside them. Only the legs within `tolerance` seconds of the current
+    record are held, hashed by (account, amount in cents); each record takes the
+    closest unmatched leg. Legs that slide out of the window unmatched are "extra",
+    records without a leg are "missing".
+    `sessions` are the shards when `shards` is set, else a single database.
+    Ends with a summary of the counts.
+    """
+    window_size = timedelta(seconds=tolerance)
+    counts = {"matched": 0, "missing": 0, "extra": 0, "invalid": 0}
+    window: Deque[Leg] = deque()
+    buckets: Dict[Tuple[int, int], Deque[Leg]] = {}
+    legs: Optional[Iterator[Leg]] = None
+    upcoming: Optional[Leg] = None
+
+    def release(before: Optional[datetime]) -> Iterator[Dict[str, Any]]:
+        while window and (before is None or window[0].timestamp < before):
+            leg = window.popleft()
+            bucket = buckets[(leg.account_id, _cents(leg.amount))]
+            bucket.popleft()
+            if not bucket:
+                del buckets[(leg.account_id, _cents(leg.amount))]
+            if not leg.matched:
+                counts["extra"] += 1
+                yield _extra(leg)
+
+    ordered = sort_records(records, chunk_size, fan_in)
+    try:
+        for record in ordered:
+            if isinstance(record, dict):
+                counts["invalid"] += 1
+                yield record
+                continue
+            low, high = record.timestamp - window_size, record.timestamp + window_size
+            if legs is None:
+                streams = [
+                    _legs(db, low, account_ids, (shards, shard) if shards else None)
+                    for shard, db in enumerate(sessions)
+                ]
+                legs = heapq.merge(*streams, key=lambda leg: (leg.timestamp, leg.transaction_id))
+                upcoming = next(legs, None)
+
+            # Load the legs up to the end of this record's window, release those before its start
+            while upcoming is not None and upcoming.timestamp <= high:
+                window.append(upcoming)
+                buckets.setdefault((upcoming.account_id, _cents(upcoming.amount)), deque()).append(upcoming)
+                upcoming = next(legs, None)
+            yield from release(low)
+
+            best = None
+            for leg in buckets.get((record.account_id, _cents(record.amount)), ()):
+                distance = abs((leg.timestamp - record.timestamp).total_seconds())
+                if not leg.matched and distance <= tolerance and (best is None or distance < best[0]):
+                    best = (distance, leg)
+            if best is None:
+                counts["missing"] += 1
+                yield _missing(record)
+            else:
+                best[1].matched = True
+                counts["matched"] += 1
+                yield _matched(record, best[1])
+    finally:
+        ordered.close()
+
+    yield from release(None)
+    yield {"status": "summary", **counts}
@@ -0,0 +1,238 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy.orm import Session, sessionmaker
+from simplebank.database import begin_write
+from simplebank.models import models
+from simplebank.utils.cron import CronSchedule
+from simplebank.utils.balance_audit import balance_change, balance_update_message
+from simplebank.utils.outbox import transaction_created_event
+from simplebank.utils.ledger import transfer_entries
+from simplebank.utils.fx import fx_rates, pricing, RateUnavailable
+from simplebank.utils.pubsub import PubSub, balance_updates
+from simplebank.utils.leases import acquire_lease, release_lease, worker_owner
+from simplebank.utils.sharding import ShardRouter, shard_router
+
+logger = logging.getLogger(__name__)
+
+SCHEDULER_CHUNK_SIZE = int(os.getenv("SCHEDULER_CHUNK_SIZE", "500"))
+SCHEDULER_POLL_INTERVAL = float(os.getenv("SCHEDULER_POLL_INTERVAL", "5"))  # Seconds
+SCHEDULER_LEASE_TTL = float(os.getenv("SCHEDULER_LEASE_TTL", "30"))  # Seconds
+SCHEDULER_CHUNK_PAUSE = float(os.getenv("SCHEDULER_CHUNK_PAUSE", "0"))  # Seconds between chunks
+SCHEDULER_LEASE_NAME = "scheduled_transfers"
+
+
+@lru_cache(maxsize=1024)
+def _cron(expression: str) -> CronSchedule:
+    return CronSchedule(expression)
+
+
+def next_run_time(schedule: models.ScheduledTransfer, after: datetime) -> datetime:
+    """
+    Next run strictly after `after`.
+    Runs missed while the app was down are not replayed one by one: the schedule
+    resumes at its next slot after `after`.
+    """
+    if schedule.cron:
+        return _cron(schedule.cron).next_after(after)
+    interval = timedelta(seconds=schedule.interval_seconds)
+    next_run = schedule.next_run_at or after
+    if next_run <= after:
+        next_run += interval * ((after - next_run) // interval + 1)
+    return next_run
+
+
+def run_due_chunk(db: Session, now: datetime, chunk_size: int = SCHEDULER_CHUNK_SIZE) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Execute up to `chunk_size` due schedules in one DB transaction.
+    All accounts of the chunk are locked with a single SELECT ... FOR UPDATE in
+    ascending id order, so concurrent chunks and transfers cannot deadlock. SQLite
+    ignores FOR UPDATE: there the transaction takes the database write lock before
+    reading anything (`begin_write`), so no transfer can change a balance between
+    the check and the update.
+    A schedule that cannot run (missing account, insufficient funds, no FX rate)
+    records the failure and moves on to its next slot.
+    Returns the number of schedules processed and the balance update messages to publish.
+    """
+    begin_write(db)
+    schedule = models.ScheduledTransfer
+    schedules = db.query(schedule).filter(
+        schedule.active.is_(True), schedule.next_run_at <= now
+    ).order_by(schedule.id).limit(chunk_size).all()
+    if not schedules:
+        db.rollback()
+        return 0, []
+
+    account_ids = sorted({s.from_account_id for s in schedules} | {s.to_account_id for s in schedules})
+    accounts = {
+        account.id: account
+        for account in db.query(models.Account).filter(
+            models.Account.id.in_(account_ids)
+        ).order_by(models.Account.id).with_for_update().all()
+    }
+
+    rates = fx_rates.current
+    rows = []
+    changes = []
+    for due in schedules:
+        from_account = accounts.get(due.from_account_id)
+        to_account = accounts.get(due.to_account_id)
+        conversion = None
+        if from_account is not None and to_account is not None:
+            try:
+                conversion = rates.convert(due.amount, from_account.currency, to_account.currency)
+            except RateUnavailable:
+                pass
+        if from_account is None or to_account is None:
+            status = "failed: account not found"
+        elif from_account.balance < due.amount:
+            status = "failed: insufficient funds"
+        elif conversion is None:
+            status = "failed: no FX rate"
+        else:
+            from_balance_before = from_account.balance
+            to_balance_before = to_account.balance
+            from_account.balance -= due.amount
+            to_account.balance += conversion.amount
+            transaction = models.Transaction(
+                from_account_id=due.from_account_id,
+                to_account_id=due.to_account_id,
+                amount=due.amount,
+                timestamp=now,
+                **pricing(from_account.currency, conversion)
+            )
+            request_id = f"schedule:{due.id}"
+            transfer_changes = [
+                balance_change(None, from_account, from_balance_before, transaction, now, request_id),
+                balance_change(None, to_account, to_balance_before, transaction, now, request_id),
+            ]
+            rows += [
+                transaction, *transfer_entries(transaction, now),
+                *transfer_changes, transaction_created_event(transaction),
+            ]
+            changes += transfer_changes
+            status = "ok"
+        due.last_run_at = now
+        due.last_status = status
+        due.next_run_at = next_run_time(due, now)
+
+    db.add_all(rows)
+    db.flush()  # Assigns ids while the objects are still loaded
+    messages = [balance_update_message(change) for change in changes]
+    db.commit()
+    return len(schedules), messages
+
+
+def run_due_sharded_chunk(db: Session, router: ShardRouter, now: datetime,
+                          chunk_size: int = SCHEDULER_CHUNK_SIZE) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    run_due_chunk with sharding enabled: schedules stay on the primary and each due
+    one runs as a ShardRouter transfer (single-shard or saga). A schedule moves to
+    its next slot and commits before its transfer, so a crash in between skips that
+    run rather than executing it twice.
+    """
+    schedule = models.ScheduledTransfer
+    schedules = db.query(schedule).filter(
+        schedule.active.is_(True), schedule.next_run_at <= now
+    ).order_by(schedule.id).limit(chunk_size).all()
+    messages = []
+    for due in schedules:
+        due.last_run_at = now
+        due.next_run_at = next_run_time(due, now)
+        db.commit()
+        try:
+            messages += router.transfer(due.from_account_id, due.to_account_id, due.amount,
+                                        request_id=f"schedule:{due.id}")[1]
+            due.last_status = "ok"
+        except LookupError:
+            due.last_status = "failed: account not found"
+        except RateUnavailable:
+            due.last_status = "failed: no FX rate"
+        except ValueError:
+            due.last_status = "failed: insufficient funds"
+        db.commit()
+    return len(schedules), messages
+
+
+class TransferScheduler:
+    """
+    Background task executing due scheduled transfers.
+    Workers compete for a lease in the database; only the holder runs due
+    schedules, chunk by chunk, renewing the lease before each chunk.
+    """
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        pubsub: PubSub = balance_updates,
+        chunk_size: int = SCHEDULER_CHUNK_SIZE,
+        poll_interval: float = SCHEDULER_POLL_INTERVAL,
+        lease_ttl: float = SCHEDULER_LEASE_TTL,
+        chunk_pause: float = SCHEDULER_CHUNK_PAUSE,
+    ):
+        self.session_factory = session_factory
+        self.pubsub = pubsub
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.lease_ttl = lease_ttl
+        self.chunk_pause = chunk_pause
+        self.owner = worker_owner()
+        self._task: Optional[asyncio.Task] = None
+
+    def _run_chunk(self, now: datetime) -> Optional[Tuple[int, List[Dict[str, Any]]]]:
+        """Run one chunk if we hold the lease; None when the lease is held elsewhere"""
+        db = self.session_factory()
+        try:
+            if not acquire_lease(db, SCHEDULER_LEASE_NAME, self.owner, self.lease_ttl):
+                return None
+            if shard_router.enabled:
+                return run_due_sharded_chunk(db, shard_router, now, self.chunk_size)
+            return run_due_chunk(db, now, self.chunk_size)
+        finally:
+            db.close()
+
+    async def run_due(self, now: Optional[datetime] = None) -> int:
+        """Execute everything due at `now`; returns the number of schedules processed"""
+        now = now or datetime.utcnow()
+        processed = 0
+        while True:
+            result = await asyncio.to_thread(self._run_chunk, now)
+            if result is None:
+                break
+            count, messages = result
+            processed += count
+            for message in messages:
+                self.pubsub.publish(message["account_id"], message)
+            if count < self.chunk_size:
+                break
+            # Let regular requests through between chunks
+            await asyncio.sleep(self.chunk_pause)
+        return processed
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.run_due()
+            except Exception as e:
+                logger.error(f"Scheduled transfer run failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            db = self.session_factory()
+            try:
+                release_lease(db, SCHEDULER_LEASE_NAME, self.owner)
+            finally:
+                db.close()
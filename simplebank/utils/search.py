@@ -0,0 +1,164 @@
+import re
+from typing import List, Optional, Tuple
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+from simplebank.models import models
+
+# SQLite: two FTS5 indexes over customers.name, kept in sync by triggers.
+# customers_fts holds words with prefix indexes (word-prefix search), customers_trigram
+# holds trigrams (fuzzy search: names sharing the most trigrams with the query rank first).
+_SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS customers_fts USING fts5("
+    "name, content='customers', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS customers_trigram USING fts5("
+    "name, content='customers', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS customers_search_insert AFTER INSERT ON customers BEGIN "
+    "INSERT INTO customers_fts(rowid, name) VALUES (new.id, new.name); "
+    "INSERT INTO customers_trigram(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS customers_search_delete AFTER DELETE ON customers BEGIN "
+    "INSERT INTO customers_fts(customers_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO customers_trigram(customers_trigram, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS customers_search_update AFTER UPDATE OF name ON customers BEGIN "
+    "INSERT INTO customers_fts(customers_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO customers_trigram(customers_trigram, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO customers_fts(rowid, name) VALUES (new.id, new.name); "
+    "INSERT INTO customers_trigram(rowid, name) VALUES (new.id, new.name); END",
+]
+_SQLITE_REBUILD = [
+    "INSERT INTO customers_fts(customers_fts) VALUES ('rebuild')",
+    "INSERT INTO customers_trigram(customers_trigram) VALUES ('rebuild')",
+]
+_SQLITE_DROP = ["DROP TABLE IF EXISTS customers_fts", "DROP TABLE IF EXISTS customers_trigram"]
+
+# PostgreSQL: one trigram GIN index serves substring (ILIKE) and similarity (%) matching
+_POSTGRES_INDEX = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_customers_name_trgm ON customers USING gin (name gin_trgm_ops)",
+]
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def install_customer_search(connection: Connection) -> None:
+    """Create the name search index if it is missing, indexing the existing customers"""
+    if connection.dialect.name == "sqlite":
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'customers_fts'"
+        )).first()
+        for statement in _SQLITE_INDEX:
+            connection.execute(text(statement))
+        if not exists:
+            for statement in _SQLITE_REBUILD:
+                connection.execute(text(statement))
+    elif connection.dialect.name == "postgresql":
+        for statement in _POSTGRES_INDEX:
+            connection.execute(text(statement))
+
+
+def ensure_customer_search(engine: Engine) -> None:
+    with engine.begin() as connection:
+        install_customer_search(connection)
+
+
+@event.listens_for(models.Customer.__table__, "after_create")
+def _create_search_index(target, connection, **kw):
+    install_customer_search(connection)
+
+
+@event.listens_for(models.Customer.__table__, "before_drop")
+def _drop_search_index(target, connection, **kw):
+    if connection.dialect.name == "sqlite":
+        for statement in _SQLITE_DROP:
+            connection.execute(text(statement))
+
+
+def _quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def prefix_query(q: str) -> Optional[str]:
+    """FTS5 query matching names with a word starting with each word of `q`"""
+    words = _WORD.findall(q)
+    return " AND ".join(_quote(word) + "*" for word in words) if words else None
+
+
+def prefix_condition(q: str) -> Tuple[Optional[str], dict]:
+    """
+    PostgreSQL condition matching names with a word starting with each word of `q`,
+    like `prefix_query`: one case-insensitive word-start regex per word, ANDed.
+    The trigram index serves `~*` as it does ILIKE.
+    """
+    words = _WORD.findall(q)
+    if not words:
+        return None, {}
+    # \w+ words hold no regex metacharacters
+    conditions = [f"name ~* ('\\m' || :word_{i})" for i in range(len(words))]
+    return " AND ".join(conditions), {f"word_{i}": word for i, word in enumerate(words)}
+
+
+def trigram_query(q: str) -> Optional[str]:
+    """FTS5 query matching names sharing at least one trigram with `q`"""
+    trigrams = []
+    for word in _WORD.findall(q.lower()):
+        for i in range(len(word) - 2):
+            if word[i:i + 3] not in trigrams:
+                trigrams.append(word[i:i + 3])
+    return " OR ".join(_quote(trigram) for trigram in trigrams) if trigrams else None
+
+
+def search_customers(db: Session, q: str, fuzzy: bool = False, limit: int = 20,
+                     after: Optional[Tuple[float, int]] = None) -> List[Tuple[models.Customer, float]]:
+    """
+    Customers matching `q`, best first, as (customer, score) pairs; lower scores
+    rank higher. `after` is the (score, id) of the last row of the previous page.
+    Only the index entries of the matching names are read, so the cost depends on
+    the number of matches rather than on the number of customers.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return _search_postgres(db, q, fuzzy, limit, after)
+    return _search_sqlite(db, q, fuzzy, limit, after)
+
+
+def _keyset(after: Optional[Tuple[float, int]]) -> Tuple[str, dict]:
+    if after is None:
+        return "", {}
+    return "WHERE score > :score OR (score = :score AND id > :after_id)", {"score": after[0], "after_id": after[1]}
+
+
+def _search_sqlite(db, q, fuzzy, limit, after):
+    table = "customers_trigram" if fuzzy else "customers_fts"
+    match = trigram_query(q) if fuzzy else prefix_query(q)
+    if match is None:
+        return []
+    keyset, params = _keyset(after)
+    rows = db.execute(text(
+        f"SELECT id, score FROM (SELECT rowid AS id, bm25({table}) AS score FROM {table} "
+        f"WHERE {table} MATCH :match) {keyset} ORDER BY score, id LIMIT :limit"
+    ), {"match": match, "limit": limit, **params}).all()
+    return _with_customers(db, rows)
+
+
+def _search_postgres(db, q, fuzzy, limit, after):
+    # Negated similarity, so that lower is better as with bm25
+    if fuzzy:
+        condition, words = "name % :q", {}
+    else:
+        condition, words = prefix_condition(q)
+        if condition is None:
+            return []
+    keyset, params = _keyset(after)
+    rows = db.execute(text(
+        f"SELECT id, score FROM (SELECT id, -similarity(name, :q) AS score FROM customers "
+        f"WHERE {condition}) AS matches {keyset} ORDER BY score, id LIMIT :limit"
+    ), {"q": q, "limit": limit, **words, **params}).all()
+    return _with_customers(db, rows)
+
+
+def _with_customers(db: Session, rows) -> List[Tuple[models.Customer, float]]:
+    customers = {
+        customer.id: customer
+        for customer in db.query(models.Customer).filter(models.Customer.id.in_([row.id for row in rows]))
+    }
+    return [(customers[row.id], row.score) for row in rows if row.id in customers]
@@ -1,15 +1,35 @@
-from fastapi import Request, Response, HTTPException, Header, status
+from fastapi import Request, Response, HTTPException, status
+from starlette.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import os
 import time
 import secrets
-from typing import Dict, Optional
+import hashlib
+import uuid
+from typing import Callable, Dict, Iterable, Optional
 import logging
+from simplebank.database import get_db, replica_router, read_your_writes_key
+from simplebank.utils.audit_log import audit_pipeline
+from simplebank.utils.api_keys import (
+    ApiKeyIdentity, ALL_SCOPES, api_key_cache, load_api_key
+)
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 API_KEY = os.getenv("API_KEY", "dev_api_key")
+# Non-secret identifier of the key, recorded in audit trails instead of the key itself
+API_KEY_ID = hashlib.sha256(API_KEY.encode()).hexdigest()[:16]
+# The environment key is the bootstrap/admin key; client keys live in the api_keys table
+BOOTSTRAP_IDENTITY = ApiKeyIdentity(key_id=API_KEY_ID, scopes=ALL_SCOPES)
+
+# Methods that only need the "read" scope
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Paths served without an API key (still timed, audited and given security headers)
+PUBLIC_PATHS = frozenset(os.getenv("PUBLIC_PATHS", "/,/docs,/redoc,/openapi.json").split(","))
 
 # Simple in-memory rate limiting
 rate_limits: Dict[str, Dict[float, int]] = {}  # {ip: {timestamp: count}}
@@ -25,9 +45,14 @@ SECURITY_HEADERS = {
     "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
     "Pragma": "no-cache"
 }
+# Raw ASGI header pairs, computed once
+SECURITY_HEADER_PAIRS = [
+    (header.lower().encode("latin-1"), value.encode("latin-1"))
+    for header, value in SECURITY_HEADERS.items()
+]
 
-def check_rate_limit(ip: str) -> bool:
-    """Check if IP is within rate limits"""
+def check_rate_limit(ip: str, limit: int = RATE_LIMIT_MAX) -> bool:
+    """Check if IP (or any other caller identity) is within rate limits"""
     now = time.time()
     
     # Initialize if this is the first request from this IP
@@ -42,7 +67,7 @@ def check_rate_limit(ip: str) -> bool:
     total_requests = sum(rate_limits[ip].values())
     
     # Check if limit exceeded
-    if total_requests >= RATE_LIMIT_MAX:
+    if total_requests >= limit:
         return False
     
     # Record this request
@@ -53,66 +78,189 @@ def check_rate_limit(ip: str) -> bool:
     return True
 
 
-async def verify_api_key(
-    request: Request,
-    x_api_key: Optional[str] = Header(None, alias="X-API-Key")
-) -> str:
-    """Dependency for API key verification"""
-    # Skip for OPTIONS requests (CORS preflight)
-    if request.method == "OPTIONS":
+async def resolve_api_key(
+    x_api_key: Optional[str],
+    load: Callable[[str], Optional[ApiKeyIdentity]]
+) -> Optional[ApiKeyIdentity]:
+    """
+    Resolve a raw key to its identity; client keys go through the TTL cache.
+    A cache miss runs the blocking `load` in the threadpool, off the event loop.
+    """
+    if not x_api_key:
         return None
-        
-    # Verify API key
-    if not x_api_key or x_api_key != API_KEY:
-        # Get client IP safely
-        client_ip = getattr(request.client, 'host', '127.0.0.1')
-        logger.warning(f"Invalid API key attempt from {client_ip}")
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or missing API key",
-            headers={"WWW-Authenticate": "ApiKey"},
-        )
-    
-    # Check rate limits - handle None client safely
-    client_ip = getattr(request.client, 'host', '127.0.0.1')
-    if not check_rate_limit(client_ip):
-        logger.warning(f"Rate limit exceeded for {client_ip}")
-        raise HTTPException(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail="Rate limit exceeded, please try again later",
-        )
-    
-    # Store start time for timing requests
-    request.state.start_time = time.time()
-    
-    return x_api_key
+    if secrets.compare_digest(x_api_key.encode(), API_KEY.encode()):
+        return BOOTSTRAP_IDENTITY
+    hit, identity = api_key_cache.lookup(x_api_key)
+    if not hit:
+        identity = await run_in_threadpool(load, x_api_key)
+        api_key_cache.store(x_api_key, identity)
+    return identity
+
+
+def _load_api_key_from_app_db(app, raw_key: str) -> Optional[ApiKeyIdentity]:
+    """
+    Cache-miss path: look the key up with the same session provider the routes use
+    (honouring `app.dependency_overrides[get_db]`)
+    """
+    provider = getattr(app, "dependency_overrides", {}).get(get_db, get_db)
+    sessions = provider()
+    db = next(sessions)
+    try:
+        return load_api_key(db, raw_key)
+    finally:
+        sessions.close()
+
+
+class SecurityMiddleware:
+    """
+    Pure-ASGI middleware applying API key authentication, rate limiting, scope
+    checks, timing, audit logging and security headers to every route.
+    """
+    def __init__(self, app: ASGIApp, public_paths: Iterable[str] = PUBLIC_PATHS):
+        self.app = app
+        self.public_paths = frozenset(public_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.time()
+        method = scope["method"]
+        client = scope.get("client")
+        client_ip = client[0] if client else "127.0.0.1"
+
+        raw_key = request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-api-key":
+                raw_key = value.decode("latin-1")
+            elif name == b"x-request-id":
+                request_id = value.decode("latin-1")
+
+        # Identify the request and the caller for handlers and audit trails
+        state = scope.setdefault("state", {})
+        state["start_time"] = start_time
+        state["request_id"] = request_id or uuid.uuid4().hex
+
+        status_code = 500
+
+        async def send_with_headers(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if method not in READ_METHODS and status_code < 400:
+                    # Before the client sees the response, so its next read already goes to the primary
+                    replica_router.note_write(read_your_writes_key(state.get("api_key_id"), client_ip))
+                headers = list(message.get("headers", []))
+                present = {name for name, _ in headers}
+                # Headers set by the handler (e.g. Cache-Control) take precedence
+                headers.extend(pair for pair in SECURITY_HEADER_PAIRS if pair[0] not in present)
+                message["headers"] = headers
+            await send(message)
+
+        # Skip authentication for OPTIONS requests (CORS preflight) and public paths
+        if method != "OPTIONS" and scope["path"] not in self.public_paths:
+            identity = await resolve_api_key(
+                raw_key, lambda key: _load_api_key_from_app_db(scope.get("app"), key)
+            )
+            if identity is None:
+                audit_pipeline.emit({
+                    "ts": start_time, "event": "invalid_api_key", "method": method,
+                    "path": scope["path"], "client": client_ip,
+                })
+                response = JSONResponse(
+                    {"detail": "Invalid or missing API key"},
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    headers={"WWW-Authenticate": "ApiKey"},
+                )
+                await response(scope, receive, send_with_headers)
+                return
+
+            # Check rate limits - per key for client keys with their own quota, else per IP
+            if identity.rate_limit is not None:
+                within_limit = check_rate_limit(f"key:{identity.key_id}", identity.rate_limit)
+            else:
+                within_limit = check_rate_limit(client_ip)
+            if not within_limit:
+                audit_pipeline.emit({
+                    "ts": start_time, "event": "rate_limited", "method": method,
+                    "path": scope["path"], "client": client_ip, "api_key_id": identity.key_id,
+                })
+                response = JSONResponse(
+                    {"detail": "Rate limit exceeded, please try again later"},
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                )
+                await response(scope, receive, send_with_headers)
+                return
+
+            required_scope = "read" if method in READ_METHODS else "write"
+            if required_scope not in identity.scopes:
+                response = JSONResponse(
+                    {"detail": f"API key lacks the '{required_scope}' scope"},
+                    status_code=status.HTTP_403_FORBIDDEN,
+                )
+                await response(scope, receive, send_with_headers)
+                return
+
+            state["api_key_id"] = identity.key_id
+            state["scopes"] = identity.scopes
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            # The router stores the matched endpoint in the shared scope
+            endpoint = scope.get("endpoint")
+            audit_pipeline.emit({
+                "ts": start_time,
+                "event": "request",
+                "operation": getattr(endpoint, "__name__", None),
+                "method": method,
+                "path": scope["path"],
+                "status": status_code,
+                "client": client_ip,
+                "api_key_id": state.get("api_key_id"),
+                "duration": round(time.time() - start_time, 6),
+            })
 
-def generate_api_key() -> str:
-    """Generate a secure API key"""
-    return secrets.token_urlsafe(32)
+def require_scope(scope: str):
+    """Dependency factory restricting a route to keys holding `scope`"""
+    async def check_scope(request: Request) -> None:
+        if scope not in getattr(request.state, "scopes", ()):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"API key lacks the '{scope}' scope",
+            )
+    return check_scope
 
 def log_request(request: Request, operation: str, status_code: int, duration: float) -> None:
-    """Log request details for security audit"""
-    logger.info(
-        f"{operation}: {request.method} {request.url.path} - "
-        f"Status: {status_code} - "
-        f"Client: {getattr(request.client, 'host', '127.0.0.1')} - "
-        f"Duration: {duration:.4f}s"
-    )
+    """Queue request details for security audit (written by the audit pipeline thread)"""
+    audit_pipeline.emit({
+        "ts": time.time(),
+        "event": "request",
+        "operation": operation,
+        "method": request.method,
+        "path": request.url.path,
+        "status": status_code,
+        "client": getattr(request.client, 'host', '127.0.0.1'),
+        "duration": round(duration, 6),
+    })
 
 async def add_security_headers(response: Response) -> None:
     """Add security headers to response"""
-    for header, value in SECURITY_HEADERS.items():
-        response.headers[header] = value
+    response.headers.update(SECURITY_HEADERS)
 
 class SecurityAudit:
-    """Dependency class for logging and securing operations"""
+    """
+    Dependency class for logging and securing operations.
+    Routes of the app are covered by SecurityMiddleware; this is kept for
+    apps or routes mounted without it.
+    """
     
     def __init__(self, operation_name: str = "API"):
         self.operation_name = operation_name
         
     async def __call__(self, request: Request, response: Response):
-        # Get the start time stored by verify_api_key
+        # Get the start time stored by SecurityMiddleware
         start_time = getattr(request.state, "start_time", time.time())
         
         # Calculate duration
@@ -0,0 +1,564 @@
+import os
+import json
+import heapq
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from fastapi import Depends, Request
+from sqlalchemy import func
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+from simplebank.database import get_db, get_read_db, create_sync_engine, begin_write
+from simplebank.models import models
+from simplebank.models.models import Base, DEFAULT_CURRENCY
+from simplebank.utils.balance_audit import balance_change, balance_update_message
+from simplebank.utils.outbox import transaction_created_event, fetch_events
+from simplebank.utils.leases import JobLease
+from simplebank.utils.ledger import transfer_entries, deposit_entries
+from simplebank.utils.fx import fx_rates, pricing, RateTable
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated shard URLs, e.g. "sqlite:///./shard0.db,sqlite:///./shard1.db"; empty disables sharding
+SHARD_DATABASE_URLS = [url for url in os.getenv("SHARD_DATABASE_URLS", "").split(",") if url]
+SHARD_SAGA_POLL_INTERVAL = float(os.getenv("SHARD_SAGA_POLL_INTERVAL", "1.0"))  # Seconds
+SHARD_SAGA_BATCH_SIZE = int(os.getenv("SHARD_SAGA_BATCH_SIZE", "100"))
+SHARD_ID_RETRIES = 5
+SHARD_ID_BLOCK_SIZE = int(os.getenv("SHARD_ID_BLOCK_SIZE", "100"))  # Ids reserved per round trip to a shard
+
+SHARD_SAGA_CONSUMER = "shard_saga"
+TRANSFER_DEBITED = "transfer.debited"
+TRANSFER_COMPENSATED = "transfer.compensated"
+
+
+def _leg_entries(account: models.Account, transaction: models.Transaction, amount: float,
+                 timestamp: datetime) -> List[models.LedgerEntry]:
+    """
+    One leg of a cross-shard transfer: the account side and its counterpart on the
+    external account, so each shard's ledger balances on its own.
+    """
+    return [
+        models.LedgerEntry(account=account, transaction=transaction, amount=amount,
+                           kind="transfer", timestamp=timestamp),
+        models.LedgerEntry(account_id=None, transaction=transaction, amount=-amount,
+                           kind="transfer", timestamp=timestamp),
+    ]
+
+
+class ShardRouter:
+    """
+    Accounts and transactions spread over several databases by account id.
+
+    Ids encode their shard: shard `k` of `n` only allocates ids with `id % n == k`,
+    so routing needs no lookup table. Each worker reserves blocks of
+    SHARD_ID_BLOCK_SIZE ids from the shard's `shard_id_sequences` row and hands
+    them out from memory; ids left in a block when the worker stops are skipped. A customer's accounts are placed on shard
+    `customer_id % n`. Customers (and every table not listed here) stay on the
+    primary database.
+
+    Transfers between accounts of one shard commit in a single local transaction.
+    Every step that checks a balance before writing it starts with `begin_write`,
+    so on SQLite shards (which ignore FOR UPDATE) it holds the write lock throughout.
+    Cross-shard transfers run as a saga over the outbox: the source shard debits
+    and writes a `transfer.debited` event in one commit, then the destination shard
+    credits and stores a mirror of the transaction under the same id (the primary
+    key makes the credit idempotent). If the destination account is gone the
+    source shard is refunded (`transfer.compensated`). The credit is attempted
+    inline and re-driven from the outbox by `ShardSagaRelay` after failures.
+
+    Each shard holds every transaction touching its accounts, so per-account
+    history stays single-shard; global lists fan out and merge-sort by id.
+    """
+    def __init__(self, engines: List[Engine]):
+        self.engines = engines
+        self.sessions = [sessionmaker(bind=engine) for engine in engines]
+        self._pool: Optional[ThreadPoolExecutor] = None
+        # Reserved id blocks by (shard engine, table)
+        self._ids: Dict[Tuple[Engine, str], Iterator[int]] = {}
+        self._ids_lock = threading.Lock()
+
+    @classmethod
+    def from_urls(cls, urls: Iterable[str]) -> "ShardRouter":
+        return cls([create_sync_engine(url) for url in urls])
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.engines)
+
+    @property
+    def count(self) -> int:
+        return len(self.engines)
+
+    def shard_of(self, entity_id: int) -> int:
+        return entity_id % self.count
+
+    def session(self, shard: int) -> Session:
+        return self.sessions[shard]()
+
+    def create_all(self) -> None:
+        for engine in self.engines:
+            Base.metadata.create_all(bind=engine)
+            # Shards created before saga steps were made unique
+            for index in models.OutboxEvent.__table__.indexes:
+                index.create(bind=engine, checkfirst=True)
+
+    def _reserve_ids(self, model, shard: int) -> Iterator[int]:
+        """
+        Take the next block of id slots of `model` on `shard` in a short transaction of
+        its own. The sequence row only moves by compare-and-set, so concurrent workers
+        get disjoint blocks; it is seeded once from the highest id already on the shard.
+        """
+        sequence, name = models.ShardIdSequence, model.__tablename__
+        db = self.session(shard)
+        try:
+            for _ in range(SHARD_ID_RETRIES):
+                row = db.get(sequence, name)
+                if row is None:
+                    last = db.query(func.max(model.id)).filter(model.id % self.count == shard).scalar()
+                    first = last // self.count + 1 if last is not None else (0 if shard else 1)
+                    db.add(sequence(name=name, next_slot=first + SHARD_ID_BLOCK_SIZE))
+                    try:
+                        db.commit()
+                    except IntegrityError:  # Another worker seeded it first
+                        db.rollback()
+                        continue
+                else:
+                    first = row.next_slot
+                    moved = db.query(sequence).filter(sequence.name == name, sequence.next_slot == first).update(
+                        {sequence.next_slot: first + SHARD_ID_BLOCK_SIZE}, synchronize_session=False
+                    )
+                    db.commit()
+                    if not moved:
+                        continue
+                return (slot * self.count + shard for slot in range(first, first + SHARD_ID_BLOCK_SIZE))
+            raise RuntimeError(f"Could not reserve {name} ids on shard {shard}")
+        finally:
+            db.close()
+
+    def _next_id(self, model, shard: int) -> int:
+        """Next unused id owned by `shard`, from this worker's reserved block"""
+        key = (self.engines[shard], model.__tablename__)
+        with self._ids_lock:
+            new_id = next(self._ids.get(key, iter(())), None)
+            if new_id is None:
+                self._ids[key] = self._reserve_ids(model, shard)
+                new_id = next(self._ids[key])
+            return new_id
+
+    def _with_new_id(self, db: Session, model, shard: int, work: Callable[[int], Any]) -> Any:
+        """
+        Run `work(new_id)` and flush. Should the id be taken anyway (e.g. a row written
+        with an explicit id), the flush fails; everything is rolled back and `work`
+        runs again from scratch with the next id.
+        """
+        for _ in range(SHARD_ID_RETRIES):
+            result = work(self._next_id(model, shard))
+            try:
+                db.flush()
+            except IntegrityError:
+                db.rollback()
+                continue
+            return result
+        raise RuntimeError(f"Could not allocate a {model.__tablename__} id on shard {shard}")
+
+    # Writes
+
+    def create_account(self, customer_id: int, initial_deposit: float, request: Optional[Request] = None,
+                       currency: str = DEFAULT_CURRENCY) -> models.Account:
+        shard = self.shard_of(customer_id)
+        db = self.session(shard)
+        try:
+            def work(account_id: int) -> models.Account:
+                account = models.Account(id=account_id, customer_id=customer_id, balance=initial_deposit,
+                                         currency=currency)
+                db.add(account)
+                db.add(balance_change(request, account, balance_before=0.0))
+                db.add_all(deposit_entries(account, initial_deposit))
+                return account
+            account = self._with_new_id(db, models.Account, shard, work)
+            db.commit()
+            db.refresh(account)
+            db.expunge(account)
+            return account
+        finally:
+            db.close()
+
+    def transfer(self, from_account_id: int, to_account_id: int, amount: float,
+                 request: Optional[Request] = None,
+                 request_id: Optional[str] = None) -> Tuple[bool, List[Dict[str, Any]]]:
+        """
+        Move `amount` between two accounts on any shards. Background jobs pass no
+        request and identify themselves with `request_id`.
+        Raises LookupError for a missing account and ValueError for insufficient funds
+        or a missing FX rate. Returns whether the transfer is complete (False while a
+        cross-shard credit is pending) and the balance update messages to publish.
+        """
+        rates = fx_rates.current
+        source, destination = self.shard_of(from_account_id), self.shard_of(to_account_id)
+        if source == destination:
+            return True, self._local_transfer(source, from_account_id, to_account_id, amount, request, rates,
+                                              request_id)
+
+        db = self.session(destination)
+        try:
+            to_account = db.get(models.Account, to_account_id)
+            if to_account is None:
+                raise LookupError("Destination account not found")
+            to_currency = to_account.currency
+        finally:
+            db.close()
+        transaction_id, messages = self._debit(source, from_account_id, to_account_id, amount, request,
+                                               rates, to_currency, request_id)
+        try:
+            messages += self.apply_credit(source, transaction_id)
+        except Exception as e:
+            logger.warning(f"Credit of cross-shard transfer {transaction_id} deferred to the saga relay: {e}")
+            return False, messages
+        return True, messages
+
+    def _local_transfer(self, shard: int, from_account_id: int, to_account_id: int, amount: float,
+                        request: Optional[Request], rates: RateTable,
+                        request_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Single-shard fast path: both balances, the ledger and the outbox in one commit"""
+        db = self.session(shard)
+        try:
+            def work(transaction_id: int) -> List[models.BalanceChange]:
+                begin_write(db)
+                # Lock in ascending id order so concurrent transfers cannot deadlock
+                accounts = {
+                    account.id: account
+                    for account in db.query(models.Account).filter(
+                        models.Account.id.in_([from_account_id, to_account_id])
+                    ).order_by(models.Account.id).with_for_update().all()
+                }
+                from_account, to_account = accounts.get(from_account_id), accounts.get(to_account_id)
+                if from_account is None:
+                    raise LookupError("Source account not found")
+                if to_account is None:
+                    raise LookupError("Destination account not found")
+                if from_account.balance < amount:
+                    raise ValueError("Insufficient funds in source account")
+                conversion = rates.convert(amount, from_account.currency, to_account.currency)
+                from_balance_before, to_balance_before = from_account.balance, to_account.balance
+                from_account.balance -= amount
+                to_account.balance += conversion.amount
+                now = datetime.utcnow()
+                transaction = models.Transaction(id=transaction_id, from_account_id=from_account_id,
+                                                 to_account_id=to_account_id, amount=amount, timestamp=now,
+                                                 **pricing(from_account.currency, conversion))
+                changes = [
+                    balance_change(request, from_account, from_balance_before, transaction, now, request_id),
+                    balance_change(request, to_account, to_balance_before, transaction, now, request_id),
+                ]
+                db.add_all([transaction, *transfer_entries(transaction, now), *changes,
+                            transaction_created_event(transaction)])
+                return changes
+            changes = self._with_new_id(db, models.Transaction, shard, work)
+            messages = [balance_update_message(change) for change in changes]
+            db.commit()
+            return messages
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _debit(self, shard: int, from_account_id: int, to_account_id: int, amount: float,
+               request: Optional[Request], rates: RateTable, to_currency: str,
+               request_id: Optional[str] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """Saga step 1 on the source shard: debit and `transfer.debited` event in one commit"""
+        db = self.session(shard)
+        try:
+            def work(transaction_id: int) -> models.BalanceChange:
+                begin_write(db)
+                from_account = db.get(models.Account, from_account_id, with_for_update=True)
+                if from_account is None:
+                    raise LookupError("Source account not found")
+                if from_account.balance < amount:
+                    raise ValueError("Insufficient funds in source account")
+                # Priced here so the credit applies exactly what was debited, whatever the rates are by then
+                conversion = rates.convert(amount, from_account.currency, to_currency)
+                balance_before = from_account.balance
+                from_account.balance -= amount
+                now = datetime.utcnow()
+                transaction = models.Transaction(id=transaction_id, from_account_id=from_account_id,
+                                                 to_account_id=to_account_id, amount=amount, timestamp=now,
+                                                 **pricing(from_account.currency, conversion))
+                change = balance_change(request, from_account, balance_before, transaction, now, request_id)
+                db.add_all([
+                    transaction, *_leg_entries(from_account, transaction, -amount, now), change,
+                    models.OutboxEvent(event_type=TRANSFER_DEBITED, transaction=transaction, payload=json.dumps({
+                        "from_account_id": from_account_id, "to_account_id": to_account_id, "amount": amount,
+                        **pricing(from_account.currency, conversion),
+                        "request_id": change.request_id,
+                    })),
+                ])
+                return change
+            change = self._with_new_id(db, models.Transaction, shard, work)
+            transaction_id, message = change.transaction_id, balance_update_message(change)
+            db.commit()
+            return transaction_id, [message]
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def apply_credit(self, source: int, transaction_id: int) -> List[Dict[str, Any]]:
+        """
+        Saga step 2 for a debited transfer: credit the destination shard, or refund
+        the source shard when the destination account no longer exists.
+        Safe to repeat; returns the balance update messages of what was applied now.
+        """
+        db = self.session(source)
+        try:
+            event = db.query(models.OutboxEvent).filter(
+                models.OutboxEvent.transaction_id == transaction_id,
+                models.OutboxEvent.event_type == TRANSFER_DEBITED
+            ).one()
+            data = json.loads(event.payload)
+            timestamp = event.transaction.timestamp
+        finally:
+            db.close()
+
+        to_account_id, amount = data["to_account_id"], data["amount"]
+        credited = data.get("credited_amount", amount)  # Events written before transfers were priced lack it
+        db = self.session(self.shard_of(to_account_id))
+        try:
+            begin_write(db)
+            to_account = db.get(models.Account, to_account_id, with_for_update=True)
+            if to_account is None:
+                db.rollback()
+                return self._compensate(source, transaction_id)
+            balance_before = to_account.balance
+            to_account.balance += credited
+            # Mirror under the source id: a repeated credit collides on the primary key
+            mirror = models.Transaction(id=transaction_id, from_account_id=data["from_account_id"],
+                                        to_account_id=to_account_id, amount=amount, timestamp=timestamp,
+                                        currency=data.get("currency"), credited_amount=data.get("credited_amount"),
+                                        fx_rate=data.get("fx_rate"), fx_rate_version=data.get("fx_rate_version"))
+            change = balance_change(None, to_account, balance_before, mirror, timestamp,
+                                    data.get("request_id") or f"saga:{transaction_id}")
+            db.add_all([mirror, *_leg_entries(to_account, mirror, credited, timestamp), change,
+                        transaction_created_event(mirror)])
+            try:
+                db.flush()
+            except IntegrityError:
+                db.rollback()
+                return []  # Already credited
+            message = balance_update_message(change)
+            db.commit()
+            return [message]
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _compensate(self, shard: int, transaction_id: int) -> List[Dict[str, Any]]:
+        """
+        Refund the debit of a transfer whose destination account is missing.
+        The `transfer.compensated` event is unique per transaction, so a concurrent
+        or repeated refund fails on flush and is rolled back whole.
+        """
+        db = self.session(shard)
+        try:
+            begin_write(db)
+            compensated = db.query(models.OutboxEvent).filter(
+                models.OutboxEvent.transaction_id == transaction_id,
+                models.OutboxEvent.event_type == TRANSFER_COMPENSATED
+            ).first()
+            if compensated is not None:
+                return []
+            transaction = db.get(models.Transaction, transaction_id)
+            from_account = db.get(models.Account, transaction.from_account_id, with_for_update=True)
+            balance_before = from_account.balance
+            from_account.balance += transaction.amount
+            now = datetime.utcnow()
+            change = balance_change(None, from_account, balance_before, transaction, now, f"saga:{transaction_id}")
+            db.add_all([*_leg_entries(from_account, transaction, transaction.amount, now), change,
+                        models.OutboxEvent(event_type=TRANSFER_COMPENSATED, transaction=transaction, payload=json.dumps({
+                            "from_account_id": transaction.from_account_id,
+                            "to_account_id": transaction.to_account_id,
+                            "amount": transaction.amount,
+                        }))])
+            try:
+                db.flush()
+            except IntegrityError:
+                db.rollback()
+                return []  # Already compensated
+            message = balance_update_message(change)
+            db.commit()
+            logger.warning(f"Cross-shard transfer {transaction_id} compensated: destination account missing")
+            return [message]
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def relay(self, shard: int, batch_size: int = SHARD_SAGA_BATCH_SIZE,
+              lag: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Re-drive the credits of debited transfers of one shard, in outbox order.
+        The shard's `shard_saga` consumer offset only moves past events whose credit
+        (or compensation) is committed, so nothing is lost across crashes. Events are
+        read with `fetch_events`, which holds back those younger than the outbox
+        visibility lag, so a debit committing after a higher id is not skipped.
+        """
+        db = self.session(shard)
+        try:
+            consumer = db.get(models.EventConsumer, SHARD_SAGA_CONSUMER)
+            if consumer is None:
+                consumer = models.EventConsumer(name=SHARD_SAGA_CONSUMER, offset=0)
+                db.add(consumer)
+                db.commit()
+            messages = []
+            for event in fetch_events(db, consumer.offset, batch_size, lag):
+                if event.event_type == TRANSFER_DEBITED:
+                    try:
+                        messages += self.apply_credit(shard, event.transaction_id)
+                    except Exception as e:
+                        logger.warning(f"Saga credit of transfer {event.transaction_id} failed, will retry: {e}")
+                        break
+                consumer.offset = event.id
+                db.commit()
+            return messages
+        finally:
+            db.close()
+
+    # Reads
+
+    def fan_out(self, query: Callable[[Session, int], List[Any]]) -> List[List[Any]]:
+        """Run `query(session, shard)` on every shard in parallel; rows are detached"""
+        def run(shard: int) -> List[Any]:
+            db = self.session(shard)
+            try:
+                rows = query(db, shard)
+                db.expunge_all()
+                return rows
+            finally:
+                db.close()
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.count, thread_name_prefix="shard")
+        return list(self._pool.map(run, range(self.count)))
+
+    def merged(self, query: Callable[[Session, int], List[Any]], skip: int, limit: int,
+               key: Callable[[Any], Any] = lambda row: row.id) -> List[Any]:
+        """
+        Merge-sort per-shard results, each already sorted by `key` and limited to
+        `skip + limit` rows, and cut the requested page.
+        """
+        return list(islice(heapq.merge(*self.fan_out(query), key=key), skip, skip + limit))
+
+    def accounts_by_id(self, ids: Iterable[int]) -> Dict[int, models.Account]:
+        """Resolve account ids with one IN query per shard, in parallel"""
+        by_shard: Dict[int, set] = {}
+        for account_id in ids:
+            by_shard.setdefault(self.shard_of(account_id), set()).add(account_id)
+
+        def query(db: Session, shard: int) -> List[models.Account]:
+            if shard not in by_shard:
+                return []
+            return db.query(models.Account).filter(models.Account.id.in_(by_shard[shard])).all()
+        return {account.id: account for accounts in self.fan_out(query) for account in accounts}
+
+    def list_accounts(self, skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> List[models.Account]:
+        def query(db: Session, shard: int) -> List[models.Account]:
+            accounts = db.query(models.Account)
+            if after_id is not None:
+                accounts = accounts.filter(models.Account.id > after_id)
+            return accounts.order_by(models.Account.id).limit(skip + limit).all()
+        return self.merged(query, skip, limit)
+
+    def list_transactions(self, skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> List[models.Transaction]:
+        def query(db: Session, shard: int) -> List[models.Transaction]:
+            # Cross-shard mirrors are listed by their source shard only
+            transactions = db.query(models.Transaction).filter(models.Transaction.id % self.count == shard)
+            if after_id is not None:
+                transactions = transactions.filter(models.Transaction.id > after_id)
+            return transactions.order_by(models.Transaction.id).limit(skip + limit).all()
+        return self.merged(query, skip, limit)
+
+
+shard_router = ShardRouter.from_urls(SHARD_DATABASE_URLS)
+
+
+def _routed_session(db: Session, entity_id: int):
+    """`db` when sharding is disabled, else a session of the shard owning `entity_id`"""
+    if not shard_router.enabled:
+        yield db
+        return
+    shard_db = shard_router.session(shard_router.shard_of(entity_id))
+    try:
+        yield shard_db
+    finally:
+        shard_db.close()
+
+
+# Dependency for account-scoped reads: the account's shard when sharding is enabled
+def get_account_db(account_id: int, db: Session = Depends(get_read_db)):
+    yield from _routed_session(db, account_id)
+
+
+# Same, but on the primary rather than a replica when sharding is disabled
+def get_account_primary_db(account_id: int, db: Session = Depends(get_db)):
+    yield from _routed_session(db, account_id)
+
+
+# Dependency for the accounts of a customer, which all live on shard `customer_id % shards`
+def get_customer_accounts_db(customer_id: int, db: Session = Depends(get_read_db)):
+    yield from _routed_session(db, customer_id)
+
+
+class ShardSagaRelay:
+    """
+    Background task completing cross-shard transfers whose inline credit failed.
+    With a `lease`, only the worker holding it relays.
+    """
+    def __init__(self, router: ShardRouter, publish: Optional[Callable[[int, Dict[str, Any]], Any]] = None,
+                 poll_interval: float = SHARD_SAGA_POLL_INTERVAL, lease: Optional[JobLease] = None):
+        self.router = router
+        self.publish = publish
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self._task: Optional[asyncio.Task] = None
+
+    async def relay_once(self) -> int:
+        applied = 0
+        for shard in range(self.router.count):
+            messages = await asyncio.to_thread(self.router.relay, shard)
+            applied += len(messages)
+            if self.publish is not None:
+                for message in messages:
+                    self.publish(message["account_id"], message)
+        return applied
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if self.lease is None or await asyncio.to_thread(self.lease.held):
+                    await self.relay_once()
+            except Exception as e:
+                logger.error(f"Shard saga relay failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            if self.lease is not None:
+                self.lease.release()
@@ -0,0 +1,123 @@
+import os
+import re
+import asyncio
+from typing import Any, Dict, Iterable, List, Tuple
+from urllib.parse import parse_qsl, urlencode
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from simplebank.database import replica_router, read_your_writes_key
+
+# Comma-separated path patterns of GET routes whose identical concurrent requests share one execution
+SINGLE_FLIGHT_PATHS = [
+    pattern for pattern in os.getenv(
+        "SINGLE_FLIGHT_PATHS", r"^/api/accounts/\d+$,^/api/accounts/\d+/transactions$"
+    ).split(",") if pattern
+]
+# Request headers that change the response, so they are part of the key
+SINGLE_FLIGHT_VARY_HEADERS = (b"accept", b"accept-encoding", b"if-none-match", b"origin")
+
+
+class SingleFlightStats:
+    """Counters of one worker; followers / (leaders + followers) is the coalescing ratio"""
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        self.bypassed = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        executed = self.leaders + self.followers
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "bypassed": self.bypassed,
+            "coalescing_ratio": round(self.followers / executed, 4) if executed else 0.0,
+        }
+
+    def reset(self) -> None:
+        self.leaders = self.followers = self.bypassed = 0
+
+
+single_flight_stats = SingleFlightStats()
+
+
+class SingleFlightMiddleware:
+    """
+    Coalesce identical concurrent GETs of the configured routes within one worker.
+
+    The first request for a key (the leader) runs the endpoint; requests with the
+    same key arriving while it is in flight (followers) wait for it and replay its
+    response messages instead of running the same queries and ETag hashing again.
+    Nothing is kept once the leader finishes, so this never serves stale data
+    beyond the lifetime of one request.
+
+    Runs inside SecurityMiddleware, so every request is still authenticated, rate
+    limited and audited on its own. Clients inside their read-your-writes window
+    bypass coalescing so they never join a read started before their write.
+    """
+    def __init__(self, app: ASGIApp, paths: Iterable[str] = SINGLE_FLIGHT_PATHS,
+                 stats: SingleFlightStats = single_flight_stats):
+        self.app = app
+        self.paths = [re.compile(pattern) for pattern in paths]
+        self.stats = stats
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+
+    def _key(self, scope: Scope) -> Tuple:
+        query = urlencode(sorted(parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)))
+        headers = dict(scope["headers"])
+        return (scope["path"], query, *(headers.get(name, b"") for name in SINGLE_FLIGHT_VARY_HEADERS))
+
+    def _applies(self, scope: Scope) -> bool:
+        return (
+            scope["type"] == "http"
+            and scope["method"] == "GET"
+            and any(pattern.match(scope["path"]) for pattern in self.paths)
+        )
+
+    def _in_write_window(self, scope: Scope) -> bool:
+        client = scope.get("client")
+        state = scope.get("state", {})
+        key = read_your_writes_key(state.get("api_key_id"), client[0] if client else "127.0.0.1")
+        return replica_router.in_write_window(key)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if not self._applies(scope):
+            await self.app(scope, receive, send)
+            return
+        if self._in_write_window(scope):
+            self.stats.bypassed += 1
+            await self.app(scope, receive, send)
+            return
+
+        key = self._key(scope)
+        flight = self._inflight.get(key)
+        if flight is not None:
+            self.stats.followers += 1
+            result = await asyncio.shield(flight)
+            if result is not None:
+                messages, endpoint = result
+                scope["endpoint"] = endpoint  # Audited under the same operation as the leader
+                for message in messages:
+                    await send(message)
+                return
+            # The leader failed: run this request on its own
+            await self.app(scope, receive, send)
+            return
+
+        flight = asyncio.get_running_loop().create_future()
+        self._inflight[key] = flight
+        self.stats.leaders += 1
+        messages: List[Message] = []
+        complete = False
+
+        async def capture(message: Message) -> None:
+            nonlocal complete
+            # Copied before outer middlewares add their per-request headers
+            messages.append({**message, "headers": list(message["headers"])} if "headers" in message else dict(message))
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                complete = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            del self._inflight[key]
+            flight.set_result((messages, scope.get("endpoint")) if complete else None)
@@ -0,0 +1,186 @@
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from simplebank.models import models
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _parse_limits(value: str) -> Dict[str, Tuple[int, float]]:
+    """Parse "minute=20:20000,hour=100:100000" into {window: (max count, max amount)}; 0 disables"""
+    limits = {}
+    for item in value.split(","):
+        window, _, limit = item.partition("=")
+        if window.strip():
+            count, _, amount = limit.partition(":")
+            limits[window.strip()] = (int(count or 0), float(amount or 0))
+    return limits
+
+
+# Per source account and window: maximum number of transfers and total amount
+VELOCITY_LIMITS = _parse_limits(os.getenv("VELOCITY_LIMITS", "minute=20:20000,hour=100:100000,day=500:500000"))
+# A transfer above this multiple of the account's mean transfer over the last day is blocked
+ANOMALY_MEAN_MULTIPLIER = float(os.getenv("ANOMALY_MEAN_MULTIPLIER", "10"))
+# Transfers needed in the last day before the mean is trusted
+ANOMALY_MIN_HISTORY = int(os.getenv("ANOMALY_MIN_HISTORY", "5"))
+# Accounts kept in memory per worker; the least recently active are dropped and rehydrated on demand
+VELOCITY_MAX_ACCOUNTS = int(os.getenv("VELOCITY_MAX_ACCOUNTS", "100000"))
+
+# Ring buffers: (bucket count, bucket width in seconds). The window slides one bucket at a time.
+WINDOWS = {"minute": (60, 1), "hour": (60, 60), "day": (24, 3600)}
+HYDRATION_WINDOW = timedelta(days=1)
+
+
+class TransferRejected(Exception):
+    """A transfer broke a velocity limit (status 429) or an anomaly rule (status 403)"""
+    def __init__(self, rule: str, detail: str, status_code: int):
+        super().__init__(detail)
+        self.rule = rule
+        self.detail = detail
+        self.status_code = status_code
+
+
+class RollingWindow:
+    """Transfer count and amount per time bucket, in fixed-size arrays reused in a ring"""
+    __slots__ = ("width", "epochs", "counts", "amounts")
+
+    def __init__(self, buckets: int, width: int):
+        self.width = width
+        self.epochs = array("q", [-1] * buckets)
+        self.counts = array("l", [0] * buckets)
+        self.amounts = array("d", [0.0] * buckets)
+
+    def add(self, at: float, count: int, amount: float) -> None:
+        epoch = int(at // self.width)
+        slot = epoch % len(self.epochs)
+        if self.epochs[slot] != epoch:
+            if self.epochs[slot] > epoch:
+                return  # Older than the window
+            self.epochs[slot], self.counts[slot], self.amounts[slot] = epoch, 0, 0.0
+        self.counts[slot] += count
+        self.amounts[slot] += amount
+
+    def totals(self, at: float) -> Tuple[int, float]:
+        oldest = int(at // self.width) - len(self.epochs)
+        count, amount = 0, 0.0
+        for slot, epoch in enumerate(self.epochs):
+            if epoch > oldest:
+                count += self.counts[slot]
+                amount += self.amounts[slot]
+        return count, amount
+
+
+class AccountActivity:
+    __slots__ = ("windows",)
+
+    def __init__(self):
+        self.windows = {name: RollingWindow(buckets, width) for name, (buckets, width) in WINDOWS.items()}
+
+    def add(self, at: float, count: int, amount: float) -> None:
+        for window in self.windows.values():
+            window.add(at, count, amount)
+
+
+@dataclass
+class Reservation:
+    account_id: int
+    amount: float
+    at: float
+
+
+def _timestamp(moment: datetime) -> float:
+    return (moment - _EPOCH).total_seconds()
+
+
+class VelocityRules:
+    """
+    In-process rules evaluated before a transfer locks any row.
+
+    Every source account gets rolling transfer counts and amounts per minute, hour
+    and day in small ring buffers, filled from its transfers of the last day the
+    first time it is seen by this worker. `admit` checks the limits and the
+    anomaly rule and reserves the transfer in the same step, so concurrent
+    transfers cannot slip past a limit together; `cancel` undoes the reservation
+    when the transfer fails. Only this worker's transfers are counted after
+    hydration, so with several workers each limit applies per worker.
+    """
+    def __init__(self, limits: Dict[str, Tuple[int, float]] = VELOCITY_LIMITS,
+                 mean_multiplier: float = ANOMALY_MEAN_MULTIPLIER, min_history: int = ANOMALY_MIN_HISTORY,
+                 max_accounts: int = VELOCITY_MAX_ACCOUNTS):
+        self.limits = limits
+        self.mean_multiplier = mean_multiplier
+        self.min_history = min_history
+        self.max_accounts = max_accounts
+        self._accounts: "OrderedDict[int, AccountActivity]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_hydrated(self, account_id: int) -> bool:
+        return account_id in self._accounts
+
+    def hydrate(self, account_id: int, transfers: Iterable[Tuple[datetime, float]]) -> None:
+        """Load an account's recent (timestamp, amount) transfers; kept as is if already loaded"""
+        activity = AccountActivity()
+        for timestamp, amount in transfers:
+            activity.add(_timestamp(timestamp), 1, amount)
+        with self._lock:
+            if account_id not in self._accounts:
+                self._accounts[account_id] = activity
+                while len(self._accounts) > self.max_accounts:
+                    self._accounts.popitem(last=False)
+
+    def admit(self, account_id: int, amount: float, now: Optional[datetime] = None) -> Reservation:
+        """Raise TransferRejected if the transfer breaks a rule, else reserve it"""
+        at = _timestamp(now or datetime.utcnow())
+        with self._lock:
+            activity = self._accounts.get(account_id)
+            if activity is None:
+                activity = self._accounts[account_id] = AccountActivity()
+            self._accounts.move_to_end(account_id)
+            self._check(activity, amount, at)
+            activity.add(at, 1, amount)
+        return Reservation(account_id, amount, at)
+
+    def cancel(self, reservation: Reservation) -> None:
+        with self._lock:
+            activity = self._accounts.get(reservation.account_id)
+            if activity is not None:
+                activity.add(reservation.at, -1, -reservation.amount)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._accounts.clear()
+
+    def _check(self, activity: AccountActivity, amount: float, at: float) -> None:
+        for name, (max_count, max_amount) in self.limits.items():
+            count, total = activity.windows[name].totals(at)
+            if max_count and count + 1 > max_count:
+                raise TransferRejected(f"{name}_count", f"Transfer limit reached: {max_count} transfers per {name}", 429)
+            if max_amount and total + amount > max_amount:
+                raise TransferRejected(f"{name}_amount", f"Transfer limit reached: {max_amount:.2f} per {name}", 429)
+
+        count, total = activity.windows["day"].totals(at)
+        if self.mean_multiplier and count >= self.min_history and amount > self.mean_multiplier * total / count:
+            raise TransferRejected(
+                "amount_anomaly",
+                f"Transfer blocked: amount exceeds {self.mean_multiplier:g}x the account's average transfer", 403
+            )
+
+
+velocity_rules = VelocityRules()
+
+
+def recent_transfers_query(account_id: int, now: Optional[datetime] = None):
+    """Transfers sent by an account within the hydration window"""
+    tx = models.Transaction
+    since = (now or datetime.utcnow()) - HYDRATION_WINDOW
+    return select(tx.timestamp, tx.amount).where(tx.from_account_id == account_id, tx.timestamp >= since)
+
+
+def load_recent_transfers(db: Session, account_id: int) -> List[Tuple[datetime, float]]:
+    return [(row.timestamp, row.amount) for row in db.execute(recent_transfers_query(account_id))]